@@ -12,5 +12,15 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'adyge_books.settings')
+# Под ASGI публичные страницы обслуживают асинхронные представления
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+# Постоянные соединения под ASGI копятся в потоках обработчиков,
+# поэтому здесь лучше пул (DB_POOL=True), чем DB_CONN_MAX_AGE
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
+
+# Шаблоны и представления загружаются до первого запроса, см. main/warmup.py
+from main.warmup import warmup  # noqa: E402
+
+warmup()
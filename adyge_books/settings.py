@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -8,6 +9,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-default-key-for-dev')
 DEBUG = os.getenv('DEBUG', 'False') == 'True'
+# manage.py test: тесты считают SQL-запросы, кеш в базе им мешал бы
+TESTING = sys.argv[1:2] == ['test']
 ALLOWED_HOSTS = ['localhost', '127.0.0.1']
 
 INSTALLED_APPS = [
@@ -17,11 +20,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'main',
 ]
 
 MIDDLEWARE = [
+    'main.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'main.middleware.StaticFilesMiddleware',
+    'main.middleware.ThrottleMiddleware',
+    'main.middleware.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -32,23 +40,39 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'adyge_books.urls'
 
+# Шаблоны компилируются один раз на процесс (cached.Loader) независимо от
+# DEBUG. TEMPLATE_CACHE=False - перечитывать их при каждом рендеринге.
+TEMPLATE_CACHE = os.getenv('TEMPLATE_CACHE', 'True') == 'True'
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)] if TEMPLATE_CACHE
+            else TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'main.context_processors.cache_version',
             ],
         },
     },
 ]
 
 # PostgreSQL Database
+# Соединения не открываются заново на каждый запрос: DB_POOL=True - пул
+# psycopg (нужен psycopg[pool] 3), иначе соединение процесса живет
+# DB_CONN_MAX_AGE секунд. В обоих случаях соединение проверяется перед
+# использованием, если база перезапускалась.
+DB_POOL = os.getenv('DB_POOL', 'False') == 'True'
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -57,8 +81,67 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        # С пулом соединение возвращается в пул в конце запроса
+        'CONN_MAX_AGE': 0 if DB_POOL else DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
     }
 }
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        # Сколько секунд ждать свободное соединение, прежде чем вернуть ошибку
+        'timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+    }
+
+# Реплики для чтения (main/routers.py): DB_REPLICA_HOSTS=host1,host2:5433,
+# остальные параметры как у основной базы. Публичные страницы читают
+# с реплики, запись, админка и команды manage.py работают с основной базой.
+# После POST клиент DB_REPLICA_STICKY_SECONDS секунд читает из основной
+# базы, чтобы сразу видеть свои изменения несмотря на отставание реплики;
+# столько же секунд после любого изменения данных из основной базы читают
+# все, чтобы в кеш страниц не попали данные с отстающей реплики.
+for number, replica in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica{number}'] = dict(
+        DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'],
+        # В тестах реплика - та же тестовая база
+        TEST={'MIRROR': 'default'},
+    )
+DATABASE_ROUTERS = ['main.routers.ReplicaRouter']
+DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', '15'))
+
+# Cache
+# Кеш общий для всех процессов: версия кеша страниц, корзины ограничения
+# частоты и отметка для чтения с реплик должны быть видны каждому воркеру.
+# REDIS_URL - Redis, иначе таблица в базе (manage.py createcachetable).
+# Локальный кеш процесса - только при DEBUG и в тестах; запуск с ним
+# в другом режиме останавливает проверка main/checks.py.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+elif DEBUG or TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'main_cache',
+        }
+    }
+
+# Время жизни закешированных страниц и фрагментов. Изменения через
+# админку сбрасывают кеш сразу, см. main/signals.py
+PAGE_CACHE_TIMEOUT = int(os.getenv('PAGE_CACHE_TIMEOUT', '3600'))
 
 # Internationalization
 LANGUAGE_CODE = 'ru-ru'
@@ -71,17 +154,91 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Конвейер статики (main/storage.py): collectstatic минифицирует CSS,
+# добавляет в имена файлов хеш содержимого и кладет рядом сжатые копии
+# .gz и .br. STATIC_SERVE - отдавать собранную статику из Django с
+# заголовками immutable, когда перед приложением нет nginx.
+STATIC_PIPELINE = os.getenv('STATIC_PIPELINE', 'False') == 'True'
+STATIC_SERVE = os.getenv('STATIC_SERVE', 'False') == 'True'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': 'main.storage.StaticStorage' if STATIC_PIPELINE
+        else 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Статическая выгрузка страниц для nginx (manage.py export_static)
+STATIC_EXPORT_ROOT = os.getenv('STATIC_EXPORT_ROOT', BASE_DIR / 'static_export')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-EMAIL_BACKEND ='django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.yandex.ru'  
-PORT =os.getenv('EMAIL_PORT')
-EMAIL_USE_TLS = True
-HOST_USER =os.getenv('EMAIL_HOST_USER') 
-HOST_PASSWORD =os.getenv('EMAIL_HOST_PASSWORD')
-FROM_EMAIL =os.getenv('DEFAULT_FROM_EMAIL') 
-CONTACT = os.getenv('DEFAULT_FROM_EMAIL')
\ No newline at end of file
+# Как часто (в секундах) накопленные просмотры новостей сбрасываются в базу.
+# 0 - писать сразу при каждом просмотре. Сброс обновляет и закешированные
+# списки новостей, где показаны просмотры (см. main/counters.py).
+NEWS_VIEWS_FLUSH_INTERVAL = int(os.getenv('NEWS_VIEWS_FLUSH_INTERVAL', '10'))
+
+# Асинхронные представления (main/async_views.py). asgi.py включает их
+# по умолчанию. ASYNC_PARALLEL_QUERIES выполняет независимые запросы
+# страницы параллельно, каждый в своем соединении с базой. Только с пулом
+# (DB_POOL=True): без него каждый запрос открывал бы новые соединения.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+ASYNC_PARALLEL_QUERIES = DB_POOL and os.getenv('ASYNC_PARALLEL_QUERIES', 'False') == 'True'
+
+# Ограничение частоты (main/throttle.py): корзины токенов в кеше по IP
+# и по cookie сессии для отправки формы контактов и поиска. Ставка
+# "число/период": 5/10m - 5 запросов подряд, затем по одному раз в 2
+# минуты. Сверх ставки - ответ 429 без обращения к базе. Счетчики
+# отклоненных запросов - на /metrics/.
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'True') == 'True'
+THROTTLE_RATES = {
+    'contacts': {
+        'ip': os.getenv('THROTTLE_CONTACTS_IP', '10/10m'),
+        'session': os.getenv('THROTTLE_CONTACTS_SESSION', '3/10m'),
+    },
+    # На один IP может приходиться много читателей (NAT, офис)
+    'search': {
+        'ip': os.getenv('THROTTLE_SEARCH_IP', '120/m'),
+        'session': os.getenv('THROTTLE_SEARCH_SESSION', '30/m'),
+    },
+}
+# Число доверенных прокси (nginx) перед приложением: адрес клиента
+# берется из X-Forwarded-For. 0 - REMOTE_ADDR.
+THROTTLE_PROXY_COUNT = int(os.getenv('THROTTLE_PROXY_COUNT', '0'))
+# Одинаковое сообщение формы контактов сохраняется один раз за это время
+CONTACT_DUPLICATE_SECONDS = int(os.getenv('CONTACT_DUPLICATE_SECONDS', '3600'))
+
+# Прогрев при запуске процесса (adyge_books/wsgi.py, asgi.py): все шаблоны
+# из templates/ компилируются до первого запроса, а адреса из WARMUP_PAGES
+# (через запятую, например /catalog/,/authors/) запрашиваются, чтобы
+# заполнить кеш страниц. manage.py benchmark_startup меряет эффект.
+TEMPLATE_WARMUP = os.getenv('TEMPLATE_WARMUP', 'True') == 'True'
+WARMUP_PAGES = [page for page in os.getenv('WARMUP_PAGES', '').split(',') if page]
+
+# Инструментирование запросов: заголовок Server-Timing, метрики Prometheus
+# на /metrics/ и лог медленных запросов и N+1. Метрики доступны с заголовком
+# Authorization: Bearer METRICS_TOKEN, а без токена - только с адресов
+# METRICS_ALLOWED_IPS (за прокси адрес клиента - по THROTTLE_PROXY_COUNT)
+INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION_ENABLED', 'True') == 'True'
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '500'))
+DUPLICATE_QUERY_THRESHOLD = int(os.getenv('DUPLICATE_QUERY_THRESHOLD', '5'))
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.yandex.ru')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', '587'))
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True') == 'True'
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', '30'))
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
+CONTACT_EMAIL = os.getenv('CONTACT_EMAIL', DEFAULT_FROM_EMAIL)
+
+# Обработанные сообщения обратной связи старше этого срока (в днях)
+# manage.py archive_contact_messages переносит в архивную таблицу
+CONTACT_ARCHIVE_DAYS = int(os.getenv('CONTACT_ARCHIVE_DAYS', '180'))
@@ -18,8 +18,10 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from main import views as main_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', main_views.metrics, name='metrics'),
     path('', include('main.urls')),
 ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'adyge_books.settings')
 
 application = get_wsgi_application()
+
+# Шаблоны и представления загружаются до первого запроса, см. main/warmup.py
+from main.warmup import warmup  # noqa: E402
+
+warmup()
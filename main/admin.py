@@ -1,5 +1,84 @@
+from django import forms
 from django.contrib import admin
-from .models import Category, Author, Book, News, AuthorCategory, ContactMessage
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from .admin_filters import AutocompleteFilter, AutocompleteFilterMixin
+from .cache import bump_cache_version
+from .catalog import refresh_catalog
+from .conditional import mark_structure_changed
+from .models import (
+    Category, Author, Book, News, AuthorCategory, ContactMessage, OutboxEmail, ArchivedContactMessage,
+)
+from .pagination import EstimatedCountPaginator
+from .recommendations import rebuild_related_books, rebuild_related_news
+
+
+def flag_action(field, value, description):
+    # Действие списка, которое ставит или снимает флаг одним UPDATE
+    def action(modeladmin, request, queryset):
+        modeladmin.update_flag(request, queryset, field, value)
+    action.__name__ = f'{"set" if value else "unset"}_{field}'
+    action.short_description = description
+    return action
+
+
+class BulkActionsMixin:
+    # Массовые действия без сохранения объектов по одному: save() и сигналы
+    # не вызываются, поэтому их работу повторяет bulk_changed
+    def update_flag(self, request, queryset, field, value):
+        with transaction.atomic():
+            ids = list(queryset.exclude(**{field: value}).values_list('pk', flat=True))
+            self.model.objects.filter(pk__in=ids).update(**{field: value}, updated_at=timezone.now())
+            if ids:
+                self.bulk_changed(ids, {field})
+        self.message_user(request, f'Изменено записей: {len(ids)}')
+
+    def change_categories(self, request, queryset, add):
+        field = self.model._meta.get_field('categories')
+        through, source, target = field.remote_field.through, field.m2m_field_name(), field.m2m_reverse_field_name()
+        category = self.action_form.base_fields['category'].queryset.filter(
+            pk=request.POST.get('category') or None
+        ).first()
+        if category is None:
+            self.message_user(request, 'Выберите категорию', level='warning')
+            return
+        with transaction.atomic():
+            ids = list(queryset.values_list('pk', flat=True))
+            if add:
+                through.objects.bulk_create(
+                    [through(**{f'{source}_id': pk, target: category}) for pk in ids], ignore_conflicts=True,
+                )
+            else:
+                through.objects.filter(**{f'{source}_id__in': ids, target: category}).delete()
+            self.bulk_changed(ids, {'categories'})
+            transaction.on_commit(mark_structure_changed)
+        self.message_user(request, f'Изменено записей: {len(ids)}')
+
+    def add_category(self, request, queryset):
+        self.change_categories(request, queryset, add=True)
+    add_category.short_description = "Добавить в категорию"
+
+    def remove_category(self, request, queryset):
+        self.change_categories(request, queryset, add=False)
+    remove_category.short_description = "Убрать из категории"
+
+    def bulk_changed(self, ids, fields):
+        bump_cache_version()
+
+
+def category_action_form(model):
+    # Поле категории рядом со списком действий, с автодополнением
+    field = model._meta.get_field('categories')
+    return type(f'{model.__name__}ActionForm', (ActionForm,), {
+        'category': forms.ModelChoiceField(
+            field.remote_field.model.objects.all(), required=False, label='Категория',
+            widget=AutocompleteSelect(field, admin.site),
+        ),
+    })
+
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -14,46 +93,143 @@ class AuthorCategoryAdmin(admin.ModelAdmin):
     search_fields = ['name']
 
 @admin.register(Author)
-class AuthorAdmin(admin.ModelAdmin):
+class AuthorAdmin(AutocompleteFilterMixin, BulkActionsMixin, admin.ModelAdmin):
     list_display = ['name', 'slug', 'is_popular', 'get_categories']
-    list_filter = ['is_popular', 'categories']
+    list_filter = ['is_popular', ('categories', AutocompleteFilter)]
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
+    # Постраничная выдача автодополнения авторов требует порядка
+    ordering = ['name']
     filter_horizontal = ['categories']  # Добавляем удобный выбор категорий
+    action_form = category_action_form(Author)
+    actions = [
+        flag_action('is_popular', True, "Отметить как популярных"),
+        flag_action('is_popular', False, "Снять отметку популярности"),
+        'add_category', 'remove_category',
+    ]
+    
+    def get_queryset(self, request):
+        # Категории всех авторов страницы - одним запросом
+        return super().get_queryset(request).prefetch_related('categories')
     
     def get_categories(self, obj):
         return ", ".join([category.name for category in obj.categories.all()])
     get_categories.short_description = 'Категории'
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(AutocompleteFilterMixin, BulkActionsMixin, admin.ModelAdmin):
     list_display = ['title', 'author', 'is_available', 'is_bestseller', 'is_new']
-    list_filter = ['is_available', 'is_bestseller', 'is_new', 'categories', 'publication_date']
+    list_filter = [
+        'is_available', 'is_bestseller', 'is_new',
+        ('author', AutocompleteFilter), ('categories', AutocompleteFilter), 'publication_date',
+    ]
+    list_select_related = ['author']
     prepopulated_fields = {'slug': ('title',)}
     search_fields = ['title', 'author__name']
+    autocomplete_fields = ['author']
     filter_horizontal = ['categories']
+    action_form = category_action_form(Book)
+    actions = [
+        flag_action('is_available', True, "Отметить как доступные"),
+        flag_action('is_available', False, "Снять с продажи"),
+        flag_action('is_bestseller', True, "Отметить как бестселлеры"),
+        flag_action('is_bestseller', False, "Снять отметку бестселлера"),
+        flag_action('is_new', True, "Отметить как новинки"),
+        flag_action('is_new', False, "Снять отметку новинки"),
+        'add_category', 'remove_category',
+    ]
+    
+    def get_queryset(self, request):
+        # Описание в списке не выводится
+        return super().get_queryset(request).defer('description')
+    
+    def bulk_changed(self, ids, fields):
+        # То же, что сигналы main/signals.py делают при сохранении одной книги
+        refresh_catalog(Book.objects.filter(pk__in=ids))
+        if fields & {'is_available', 'categories'}:
+            # Один пересчет на все выбранные книги
+            transaction.on_commit(lambda: rebuild_related_books(ids))
+            transaction.on_commit(mark_structure_changed)
+        super().bulk_changed(ids, fields)
 
 @admin.register(News)
-class NewsAdmin(admin.ModelAdmin):
+class NewsAdmin(BulkActionsMixin, admin.ModelAdmin):
     list_display = ['title', 'category', 'publish_date', 'views_count', 'is_published']
     list_filter = ['category', 'is_published', 'publish_date']
     prepopulated_fields = {'slug': ('title',)}
     search_fields = ['title', 'content']
+    actions = [
+        flag_action('is_published', True, "Опубликовать"),
+        flag_action('is_published', False, "Снять с публикации"),
+    ]
+    
+    def get_queryset(self, request):
+        # Тексты новостей в списке не выводятся
+        return super().get_queryset(request).defer('content', 'short_description')
+    
+    def bulk_changed(self, ids, fields):
+        transaction.on_commit(lambda: rebuild_related_news(ids))
+        super().bulk_changed(ids, fields)
 
 
 @admin.register(ContactMessage)
 class ContactMessageAdmin(admin.ModelAdmin):
-    list_display = ['name', 'email', 'subject', 'created_at', 'is_processed']
+    list_display = ['name', 'email', 'subject', 'created_at', 'is_processed', 'get_email_status']
     list_filter = ['is_processed', 'subject', 'created_at']
+    # Поиск обслуживают триграммные индексы по UPPER(поле)
     search_fields = ['name', 'email', 'message']
     readonly_fields = ['created_at']
-    list_editable = ['is_processed']
+    # Таблица только растет: без точного COUNT(*) на каждой странице списка
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     actions = ['mark_as_processed', 'mark_as_unprocessed']
     
+    def get_queryset(self, request):
+        # Статус последнего уведомления одним подзапросом, без запроса на строку
+        latest = OutboxEmail.objects.filter(contact_message=OuterRef('pk')).order_by('-created_at')
+        return super().get_queryset(request).annotate(email_status=Subquery(latest.values('status')[:1]))
+    
+    def get_email_status(self, obj):
+        return dict(OutboxEmail.STATUS_CHOICES).get(obj.email_status, '-')
+    get_email_status.short_description = 'Уведомление'
+    get_email_status.admin_order_field = 'email_status'
+    
     def mark_as_processed(self, request, queryset):
         queryset.update(is_processed=True)
     mark_as_processed.short_description = "Отметить как обработанные"
     
     def mark_as_unprocessed(self, request, queryset):
         queryset.update(is_processed=False)
-    mark_as_unprocessed.short_description = "Отметить как необработанные"
\ No newline at end of file
+    mark_as_unprocessed.short_description = "Отметить как необработанные"
+
+
+@admin.register(ArchivedContactMessage)
+class ArchivedContactMessageAdmin(admin.ModelAdmin):
+    list_display = ['name', 'email', 'subject', 'created_at', 'email_status', 'archived_at']
+    list_filter = ['subject', 'email_status']
+    search_fields = ['=email']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['subject', 'recipients']
+    list_select_related = ['contact_message']
+    raw_id_fields = ['contact_message']
+    readonly_fields = ['attempts', 'last_error', 'created_at', 'sent_at']
+    actions = ['retry_now']
+    
+    def retry_now(self, request, queryset):
+        queryset.exclude(status=OutboxEmail.STATUS_SENT).update(
+            status=OutboxEmail.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
+    retry_now.short_description = "Отправить повторно"
@@ -0,0 +1,41 @@
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+
+
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    # Фильтр списка по связи без перечисления всей связанной таблицы:
+    # значение выбирается через автодополнение админки (нужны search_fields
+    # у админки связанной модели), из базы читается только выбранная запись.
+    template = 'admin/main/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.admin_site = model_admin.admin_site
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+    def field_choices(self, field, request, model_admin):
+        return []
+
+    def has_output(self):
+        return True
+
+    def rendered_widget(self):
+        related = self.field.remote_field.model
+        form_field = forms.ModelChoiceField(
+            related._default_manager.all(), required=False,
+            widget=AutocompleteSelect(self.field, self.admin_site),
+        )
+        value = self.lookup_val[-1] if self.lookup_val else None
+        return form_field.widget.render(self.lookup_kwarg, value)
+
+
+class AutocompleteFilterMixin:
+    # Скрипты select2 должны подключаться в <head> вместе со скриптами
+    # админки, поэтому добавляются к media самой ModelAdmin
+    @property
+    def media(self):
+        return (
+            super().media
+            + AutocompleteSelect(None, self.admin_site).media
+            + forms.Media(js=['admin/js/jquery.init.js', 'js/admin_autocomplete_filter.js'])
+        )
@@ -0,0 +1,47 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import ArchivedContactMessage, ContactMessage, OutboxEmail
+
+# Перенос старых обработанных сообщений из рабочей таблицы в архив.
+# Каждая пачка - отдельная короткая транзакция, поэтому перенос можно
+# запускать на работающем сайте: блокируются только строки пачки, а строки,
+# которые сейчас правят в админке, пропускаются до следующего запуска.
+
+ARCHIVE_FIELDS = ['id', 'name', 'email', 'phone', 'subject', 'message', 'agree_to_terms', 'created_at']
+
+
+def archive_cutoff(days):
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+def archivable(before):
+    # Обработанные и старше срока; сообщения с письмом в очереди ждут отправки
+    return (
+        ContactMessage.objects.filter(is_processed=True, created_at__lt=before)
+        .exclude(emails__status=OutboxEmail.STATUS_PENDING)
+    )
+
+
+def archive_batch(before, limit=1000):
+    latest = OutboxEmail.objects.filter(contact_message=OuterRef('pk')).order_by('-created_at')
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            archivable(before).select_for_update(skip_locked=True)
+            .annotate(email_status=Subquery(latest.values('status')[:1]))
+            .order_by('created_at')
+            .values(*ARCHIVE_FIELDS, 'email_status')[:limit]
+        )
+        if not rows:
+            return 0
+        ArchivedContactMessage.objects.bulk_create([
+            ArchivedContactMessage(**{**row, 'email_status': row['email_status'] or ''}, archived_at=now)
+            for row in rows
+        ])
+        # Вместе с сообщениями удаляются и их письма в outbox
+        ContactMessage.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+    return len(rows)
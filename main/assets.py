@@ -0,0 +1,261 @@
+import gzip
+import json
+import mimetypes
+import re
+import shutil
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotAllowed, HttpResponseNotFound
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from fontTools import subset as font_subset
+except ImportError:
+    font_subset = None
+
+# Сборка статики: минификация CSS, сжатые копии для отдачи без сжатия
+# на лету и собственный набор иконок Font Awesome только из тех значков,
+# что встречаются в шаблонах. Хеши в именах файлов добавляет
+# main.storage.StaticStorage при collectstatic.
+
+# Сжимаем только текст: изображения и woff2 уже сжаты
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.xml', '.html', '.map', '.ttf', '.otf', '.eot', '.ico'}
+MIN_COMPRESS_SIZE = 256
+# Имя с хешем содержимого от ManifestStaticFilesStorage: styles.3f1c2a9b0d4e.css
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Файлы без хеша могут смениться при следующей выкладке
+UNHASHED_MAX_AGE = 300
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_css_re = re.compile(r'/\*.*?\*/|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[^"\'/]+|/', re.S)
+_css_space_re = re.compile(r'\s+')
+_css_punct_re = re.compile(r' ?([{};,>]) ?')
+
+
+def minify_css(text):
+    # Комментарии и лишние пробелы вне строк; /*! ... */ - лицензии, остаются
+    parts = []
+    for token in _css_re.findall(text):
+        if token.startswith('/*'):
+            if token.startswith('/*!'):
+                parts.append(token)
+        elif token[0] in '"\'':
+            parts.append(token)
+        else:
+            token = _css_punct_re.sub(r'\1', _css_space_re.sub(' ', token))
+            token = token.replace(': ', ':').replace(';}', '}')
+            # На стыке с вырезанным комментарием
+            if not parts or parts[-1].endswith(tuple('{};,>:')):
+                token = token.lstrip()
+            elif token[:1] in ('{', '}', ';', ',', '>'):
+                parts[-1] = parts[-1].rstrip()
+            parts.append(token)
+    return ''.join(parts).strip()
+
+
+def compress_file(path):
+    # Кладет рядом path.gz и path.br, если они заметно меньше оригинала
+    path = Path(path)
+    if path.suffix not in COMPRESSIBLE or path.stat().st_size < MIN_COMPRESS_SIZE:
+        return []
+    data = path.read_bytes()
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    written = []
+    for suffix, compressed in variants:
+        if len(compressed) < len(data) * 0.95:
+            target = path.with_name(path.name + suffix)
+            target.write_bytes(compressed)
+            written.append(target)
+    return written
+
+
+# Иконки. Источник - дистрибутив Font Awesome Free (пакет fontawesomefree
+# или каталог из npm-пакета @fortawesome/fontawesome-free).
+
+ICON_STYLES = {
+    # стиль: (классы, семейство, начертание, файл шрифта)
+    'solid': (('fas', 'fa-solid'), 'Font Awesome 6 Free', 900, 'fa-solid-900'),
+    'regular': (('far', 'fa-regular'), 'Font Awesome 6 Free', 400, 'fa-regular-400'),
+    'brands': (('fab', 'fa-brands'), 'Font Awesome 6 Brands', 400, 'fa-brands-400'),
+}
+_icon_re = re.compile(r'(?<![\w-])fa-([a-z0-9]+(?:-[a-z0-9]+)*)')
+_style_re = re.compile(r'(?<![\w-])(fas|far|fab)(?![\w-])')
+
+
+def find_icons(paths):
+    # Все fa-* из шаблонов и скриптов, в том числе в classList.toggle('fa-...'),
+    # и классы стилей (fas, fa-solid...) - шрифты неиспользуемых стилей не нужны
+    names, classes = set(), set()
+    for root in paths:
+        root = Path(root)
+        files = root.rglob('*') if root.is_dir() else [root]
+        for path in files:
+            if path.suffix in ('.html', '.js', '.txt') and path.is_file():
+                text = path.read_text('utf-8')
+                names.update(_icon_re.findall(text))
+                classes.update(_style_re.findall(text))
+    classes.update(f'fa-{name}' for name in names)
+    styles = {style for style, (style_classes, *_) in ICON_STYLES.items() if classes & set(style_classes)}
+    return names - {cls[3:] for style_classes, *_ in ICON_STYLES.values() for cls in style_classes}, styles
+
+
+def _icon_index(source):
+    # Имя или синоним -> (основное имя, код символа, стили)
+    index = {}
+    icons = json.loads((Path(source) / 'metadata' / 'icons.json').read_text('utf-8'))
+    for name, icon in icons.items():
+        entry = (name, icon['unicode'], icon['styles'])
+        index[name] = entry
+        for alias in icon.get('aliases', {}).get('names', []):
+            index[alias] = entry
+    return index
+
+
+def _subset_font(source, target, codepoints):
+    if font_subset is None:
+        # Без fontTools кладем шрифт целиком
+        shutil.copyfile(source.with_suffix('.woff2'), target)
+        return
+    options = font_subset.Options()
+    options.flavor = 'woff2' if brotli is not None else 'woff'
+    options.layout_features = []
+    font = font_subset.load_font(str(source.with_suffix('.ttf')), options)
+    subsetter = font_subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+    font_subset.save_font(font, str(target), options)
+
+
+def build_icons(source, output, scan_paths):
+    # Пишет в output icons.css и шрифты только с используемыми значками.
+    # Возвращает найденные значки и имена, которых нет в Font Awesome.
+    source, output = Path(source), Path(output)
+    index = _icon_index(source)
+    used, styles = find_icons(scan_paths)
+    icons = {name: index[name] for name in used if name in index}
+    unknown = sorted(used - set(icons))
+
+    (output / 'webfonts').mkdir(parents=True, exist_ok=True)
+    extension = 'woff2' if brotli is not None or font_subset is None else 'woff'
+    rules = []
+    base_classes = []
+    for style, (classes, family, weight, font_name) in ICON_STYLES.items():
+        if style not in styles:
+            continue
+        codepoints = sorted({int(code, 16) for _, code, styles in icons.values() if style in styles})
+        if not codepoints:
+            continue
+        font_file = f'{font_name}.{extension}'
+        _subset_font(source / 'webfonts' / font_name, output / 'webfonts' / font_file, codepoints)
+        rules.append(
+            f'@font-face{{font-family:"{family}";font-style:normal;font-weight:{weight};'
+            f'font-display:block;src:url(webfonts/{font_file}) format("{extension}")}}'
+        )
+        rules.append(f'{",".join("." + cls for cls in classes)}{{font-family:"{family}";font-weight:{weight}}}')
+        base_classes.extend(classes)
+    rules.insert(0, (
+        f'{",".join("." + cls for cls in base_classes)}{{-moz-osx-font-smoothing:grayscale;'
+        '-webkit-font-smoothing:antialiased;display:inline-block;font-style:normal;'
+        'font-variant:normal;line-height:1;text-rendering:auto}'
+    ))
+    for name in sorted(icons):
+        rules.append(f'.fa-{name}:before{{content:"\\{icons[name][1]}"}}')
+
+    header = (
+        '/*! Font Awesome Free by @fontawesome - https://fontawesome.com\n'
+        ' * License - https://fontawesome.com/license/free (Icons: CC BY 4.0, Fonts: SIL OFL 1.1, Code: MIT License)\n'
+        ' * Набор собран командой build_icons, не редактировать вручную */\n'
+    )
+    (output / 'icons.css').write_text(header + '\n'.join(rules) + '\n', 'utf-8')
+    license_file = source / 'LICENSE.txt'
+    if license_file.exists():
+        shutil.copyfile(license_file, output / 'LICENSE.txt')
+    return sorted(icons), unknown
+
+
+# Отдача собранной статики самим приложением (STATIC_SERVE), когда перед
+# ним нет nginx. С nginx то же самое делают gzip_static и brotli_static:
+#
+#   location /static/ {
+#       alias /srv/adyge_books/staticfiles/;
+#       gzip_static on;
+#       brotli_static on;
+#       location ~ "\.[0-9a-f]{12}\.\w+$" {
+#           add_header Cache-Control "public, max-age=31536000, immutable";
+#       }
+#   }
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def serve_static(request, name):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        path = Path(safe_join(settings.STATIC_ROOT, name))
+    except SuspiciousFileOperation:
+        return HttpResponseNotFound()
+    if not path.is_file():
+        return HttpResponseNotFound()
+
+    accepted = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    encoding = None
+    for candidate, suffix in ENCODINGS:
+        if candidate in accepted and path.with_name(path.name + suffix).is_file():
+            encoding, path = candidate, path.with_name(path.name + suffix)
+            break
+
+    stat = path.stat()
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{"-" + encoding if encoding else ""}"'
+    if HASHED_NAME_RE.search(name):
+        cache_control = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        cache_control = f'public, max-age={UNHASHED_MAX_AGE}'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        response = FileResponse(path.open('rb'), content_type=content_type)
+        # Имя сжатой копии в заголовке не нужно
+        del response['Content-Disposition']
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+async def aserve_static(request, name):
+    response = await sync_to_async(serve_static)(request, name)
+    if response.streaming:
+        # FileResponse читает файл синхронно; статика небольшая,
+        # поэтому читаем ее целиком в потоке
+        chunks = await sync_to_async(list)(response.streaming_content)
+
+        async def content():
+            for chunk in chunks:
+                yield chunk
+        response.streaming_content = content()
+    return response
@@ -0,0 +1,231 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db import connections
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, redirect
+from django.shortcuts import render as render_sync
+from django.template.loader import render_to_string as render_to_string_sync
+from django.urls import reverse
+
+from . import sitemaps
+from .cache import cache_page_versioned
+from .counters import news_views, views_stamp
+from .forms import ContactForm
+from .models import Author, AuthorCategory, Book, CatalogEntry, News
+from .search import MIN_QUERY_LENGTH, search_authors, search_books, search_news
+from .views import _catalog_books, _catalog_facets, save_contact_message
+
+# Асинхронные версии публичных страниц для запуска под ASGI (ASYNC_VIEWS=True).
+# Шаблоны рендерятся из уже загруженных списков, а запросы и рендер
+# выполняются в потоках, поэтому цикл событий не ждет ни базу, ни диск.
+
+
+def _in_own_thread(func, *args):
+    try:
+        return func(*args)
+    finally:
+        # Поток исполнителя берется случайный: его соединение не переживет
+        # запрос с пользой, а оставленное открытым так и висело бы в базе.
+        # Закрытие возвращает соединение в пул (DB_POOL).
+        connections.close_all()
+
+
+# Рендер тоже уходит из цикла событий: загрузчик шаблонов и {% static %}
+# с манифестом могут читать файлы. Поток - общий, как у запросов ORM.
+render = sync_to_async(render_sync)
+render_to_string = sync_to_async(render_to_string_sync)
+
+
+async def run(func, *args):
+    # Асинхронный ORM Django выполняет запросы по одному в общем потоке,
+    # поэтому независимые запросы параллельно идут через собственные потоки
+    # и соединения из пула. Без ASYNC_PARALLEL_QUERIES - обычный асинхронный ORM.
+    if settings.ASYNC_PARALLEL_QUERIES:
+        return await sync_to_async(_in_own_thread, thread_sensitive=False)(func, *args)
+    return await sync_to_async(func)(*args)
+
+
+async def fetch(queryset):
+    if settings.ASYNC_PARALLEL_QUERIES:
+        return await run(list, queryset)
+    return [obj async for obj in queryset]
+
+
+async def index(request):
+    books, authors, latest_news = await asyncio.gather(
+        fetch(CatalogEntry.objects.order_by('-publication_date', '-pk')[:8]),
+        fetch(Author.objects.popular().order_by('name')[:6]),
+        fetch(News.objects.published().order_by('-publish_date')[:3]),
+    )
+    context = {
+        'books': books,
+        'authors': authors,
+        'latest_news': latest_news,
+    }
+    return await render(request, 'main/index.html', context)
+
+@cache_page_versioned
+async def catalog(request):
+    context, facets = await asyncio.gather(
+        run(_catalog_books, request),
+        run(_catalog_facets, request),
+    )
+    context['facets'] = facets
+    return await render(request, 'main/catalog.html', context)
+
+@cache_page_versioned
+async def catalog_page(request):
+    context = await run(_catalog_books, request)
+    html = await render_to_string('main/includes/catalog_books.html', context, request=request)
+    return JsonResponse({
+        'html': html,
+        'next_cursor': context['next_cursor'],
+        'next_query': context['next_query'],
+    })
+
+@cache_page_versioned
+async def authors(request):
+    authors = Author.objects.for_cards().order_by('name')
+
+    category_slug = request.GET.get('category')
+    if category_slug:
+        authors = authors.filter(categories__slug=category_slug)
+
+    popular_only = request.GET.get('popular')
+    if popular_only:
+        authors = authors.popular()
+
+    authors, author_categories = await asyncio.gather(fetch(authors), fetch(AuthorCategory.objects.all()))
+    context = {
+        'authors': authors,
+        'author_categories': author_categories,
+        'current_category': category_slug,
+        'popular_only': popular_only,
+    }
+    return await render(request, 'main/authors.html', context)
+
+@cache_page_versioned
+async def about(request):
+    return await render(request, 'main/about.html')
+
+# Список показывает просмотры, см. main.counters.views_stamp
+@cache_page_versioned(stamp=views_stamp)
+async def news(request):
+    news_list = News.objects.published().order_by('-publish_date')
+
+    category = request.GET.get('category')
+    if category:
+        news_list = news_list.filter(category=category)
+
+    context = {
+        'news_list': await fetch(news_list),
+        'current_category': category,
+    }
+    return await render(request, 'main/news.html', context)
+
+async def search(request):
+    query = request.GET.get('q', '').strip()
+    books, authors, news_list = [], [], []
+
+    if len(query) >= MIN_QUERY_LENGTH:
+        books, authors, news_list = await asyncio.gather(
+            run(search_books, Book.objects.available().for_cards(), query, 12),
+            run(search_authors, Author.objects.all(), query, 6),
+            run(search_news, News.objects.published(), query, 6),
+        )
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'books': [{'title': book.title, 'author': book.author.name,
+                       'url': reverse('book_detail', args=[book.slug])} for book in books],
+            'authors': [{'name': author.name,
+                         'url': reverse('author_detail', args=[author.slug])} for author in authors],
+            'news': [{'title': item.title,
+                      'url': reverse('news_detail', args=[item.slug])} for item in news_list],
+        })
+
+    context = {
+        'query': query,
+        'books': books,
+        'authors': authors,
+        'news_list': news_list,
+    }
+    return await render(request, 'main/search.html', context)
+
+@cache_page_versioned
+async def book_detail(request, slug):
+    book = await aget_object_or_404(Book.objects.available().for_detail(), slug=slug)
+    context = {
+        'book': book,
+        'related_books': await fetch(Book.objects.recommended_for(book)),
+    }
+    return await render(request, 'main/book_detail.html', context)
+
+@cache_page_versioned
+async def author_detail(request, slug):
+    # Книги выбираем по slug автора, не дожидаясь самого автора
+    author, books = await asyncio.gather(
+        aget_object_or_404(Author.objects.with_book_count(), slug=slug),
+        fetch(CatalogEntry.objects.filter(author_slug=slug)),
+    )
+    context = {
+        'author': author,
+        'books': books,
+    }
+    return await render(request, 'main/author_detail.html', context)
+
+async def news_detail(request, slug):
+    news_item = await aget_object_or_404(News.objects.published(), slug=slug)
+    if not getattr(request, 'static_export', False):
+        news_item.views_count = news_views.live_count(news_item) + 1
+        # При NEWS_VIEWS_FLUSH_INTERVAL=0 запись идет в базу сразу
+        record = sync_to_async(news_views.record)(news_item.pk)
+    else:
+        record = asyncio.sleep(0)
+
+    related_news, _ = await asyncio.gather(fetch(news_item.get_related_news()), record)
+    context = {
+        'news_item': news_item,
+        'related_news': related_news,
+    }
+    return await render(request, 'main/news_detail.html', context)
+
+@cache_page_versioned
+async def sitemap_index(request):
+    xml = await run(sitemaps.index_xml, sitemaps.base_url(request))
+    return HttpResponse(xml, content_type=sitemaps.CONTENT_TYPE)
+
+async def sitemap_section(request, section, shard):
+    base = sitemaps.base_url(request)
+    if section == 'pages' and shard == 0:
+        return HttpResponse(sitemaps.pages_xml(base), content_type=sitemaps.CONTENT_TYPE)
+    if section not in sitemaps.SECTIONS:
+        raise Http404
+    key = sitemaps.shard_cache_key(base, section, shard)
+    body = await cache.aget(key)
+    if body is not None:
+        return HttpResponse(body, content_type=sitemaps.CONTENT_TYPE)
+    if not await run(sitemaps.shard_exists, section, shard):
+        raise Http404
+    # Синхронный итератор ASGI-сервер сначала прочитал бы целиком
+    rows = sitemaps.aiterate(sitemaps.bound_rows(section, shard))
+    return StreamingHttpResponse(
+        sitemaps.acached_stream(key, sitemaps.ashard_xml(base, section, rows)), content_type=sitemaps.CONTENT_TYPE,
+    )
+
+async def contacts(request):
+    if request.method == 'POST':
+        form = ContactForm(request.POST)
+        if form.is_valid():
+            # Сохранение в транзакции целиком выполняется в одном потоке
+            await sync_to_async(save_contact_message)(form)
+            messages.success(request, 'Ваше сообщение успешно отправлено! Мы свяжемся с вами в ближайшее время.')
+            return redirect('contacts')
+    else:
+        form = ContactForm()
+
+    return await render(request, 'main/contacts.html', {'form': form})
@@ -0,0 +1,381 @@
+import csv
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.contrib.postgres.expressions import ArraySubquery
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.db.models import BooleanField, F, OuterRef
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from .cache import bump_cache_version
+from .catalog import refresh_catalog
+from .conditional import mark_structure_changed
+from .images import get_derivatives
+from .models import Author, AuthorCategory, Book, Category, News
+from .recommendations import rebuild_all, rebuild_related_books, rebuild_related_news
+from .search import update_book_vectors, update_news_vectors
+from .slugs import unique_slugs
+
+logger = logging.getLogger(__name__)
+
+# Массовый импорт и выгрузка книг, авторов и новостей в CSV или JSONL.
+# Файл читается и пишется построчно, в памяти держится одна пачка строк.
+# Объекты ищутся по slug: найденные обновляются, остальные создаются.
+# Авторы и категории указываются своими slug, список категорий в CSV
+# разделяется точкой с запятой.
+
+BATCH_SIZE = 1000
+LIST_SEPARATOR = ';'
+FORMATS = ('csv', 'jsonl')
+# Если импорт изменил такую долю книг или новостей, похожие пересчитываются
+# полностью: это дешевле, чем обновлять чужие списки для каждой строки
+FULL_REBUILD_SHARE = 0.3
+# Ошибки файла из строки: нет файла, путь вне каталога, битое изображение
+FILE_ERRORS = (OSError, ValueError, SyntaxError, UnidentifiedImageError, Image.DecompressionBombError)
+BOOLEANS = {'1': True, 'true': True, 'yes': True, 'да': True, '0': False, 'false': False, 'no': False, 'нет': False}
+
+
+class Kind:
+    # Импортируемая модель: обычные поля, поле названия для slug,
+    # поле файла, модель категорий и ссылка на автора
+    def __init__(self, model, title_field, fields, file_field, categories=None, author=False):
+        self.model = model
+        self.title_field = title_field
+        self.fields = fields
+        self.file_field = file_field
+        self.categories = categories
+        self.author = author
+
+    @property
+    def columns(self):
+        columns = ['slug', *self.fields, self.file_field]
+        if self.author:
+            columns.append('author')
+        if self.categories:
+            columns.append('categories')
+        return columns
+
+    def through(self):
+        # (модель связи, поле объекта, поле категории)
+        field = self.model._meta.get_field('categories')
+        return field.remote_field.through, field.m2m_field_name(), field.m2m_reverse_field_name()
+
+
+KINDS = {
+    'authors': Kind(
+        Author, 'name', ['name', 'bio', 'birth_date', 'is_popular'], 'photo', categories=AuthorCategory,
+    ),
+    'books': Kind(
+        Book, 'title',
+        ['title', 'description', 'publication_date', 'is_available', 'is_bestseller', 'is_new'],
+        'cover_image', categories=Category, author=True,
+    ),
+    'news': Kind(
+        News, 'title', ['title', 'short_description', 'content', 'category', 'publish_date', 'is_published'],
+        'image',
+    ),
+}
+
+
+def to_python(field, value):
+    # В CSV все значения - строки; флаги принимаем в привычных написаниях
+    if isinstance(field, BooleanField) and isinstance(value, str):
+        if value.strip().lower() not in BOOLEANS:
+            raise ValidationError(f'{field.name}: ожидается да/нет, получено {value!r}')
+        return BOOLEANS[value.strip().lower()]
+    return field.to_python(value)
+
+
+def detect_format(path):
+    return 'jsonl' if Path(path).suffix.lower() in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+
+def read_rows(stream, fmt):
+    # (номер строки, словарь); неразобранная строка JSONL приходит как None
+    if fmt == 'jsonl':
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, None
+        return
+    reader = csv.DictReader(stream)
+    for row in reader:
+        if row.get('categories') is not None:
+            row['categories'] = [slug for slug in row['categories'].split(LIST_SEPARATOR) if slug]
+        yield reader.line_num, row
+
+
+class Importer:
+    def __init__(self, kind, files_root=None, workers=8, batch_size=BATCH_SIZE, recommendations=True):
+        self.kind = KINDS[kind]
+        self.files_root = Path(files_root) if files_root else None
+        self.workers = workers
+        self.batch_size = batch_size
+        self.recommendations = recommendations
+        self.created = self.updated = self.failed = 0
+        # Похожие пересчитываются после каждой пачки, id на весь импорт
+        # не копятся. Когда изменена большая доля таблицы, дальше - один
+        # полный пересчет в конце.
+        self.changed = 0
+        self.full_rebuild = False
+
+    def run(self, rows):
+        self.full_rebuild_at = FULL_REBUILD_SHARE * self.kind.model.objects.count()
+        batch = []
+        for item in rows:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        self.finish()
+        return self.created, self.updated, self.failed
+
+    def error(self, number, message):
+        self.failed += 1
+        logger.warning('Строка %s пропущена: %s', number, message)
+
+    def lookup(self, model, slugs):
+        return dict(model.objects.filter(slug__in=set(slugs)).values_list('slug', 'pk'))
+
+    def import_batch(self, batch):
+        kind = self.kind
+        rows = []
+        for number, row in batch:
+            if not isinstance(row, dict):
+                self.error(number, 'не удалось разобрать строку')
+                continue
+            rows.append((number, {key: value for key, value in row.items() if key in kind.columns}))
+
+        # Связанные объекты и уже существующие записи - по запросу на пачку
+        authors = self.lookup(Author, [row['author'] for _, row in rows if row.get('author')]) if kind.author else {}
+        categories = {}
+        if kind.categories:
+            categories = self.lookup(kind.categories, [
+                slug for _, row in rows for slug in self.category_slugs(row) or ()
+            ])
+        existing = kind.model.objects.in_bulk(
+            [row['slug'] for _, row in rows if row.get('slug')], field_name='slug',
+        )
+
+        prepared = []
+        seen = set()
+        for number, row in rows:
+            if row.get('slug') and row['slug'] in seen:
+                self.error(number, f'slug {row["slug"]!r} повторяется в одной пачке')
+                continue
+            try:
+                prepared.append((number, *self.build(row, existing, authors, categories)))
+            except ValidationError as error:
+                self.error(number, '; '.join(error.messages))
+                continue
+            seen.add(row.get('slug'))
+
+        prepared = self.attach_files(prepared)
+        if prepared:
+            self.save(prepared, {key for _, row in rows for key in row})
+
+    def category_slugs(self, row):
+        value = row.get('categories')
+        if isinstance(value, str):
+            value = [slug for slug in value.split(LIST_SEPARATOR) if slug]
+        return value
+
+    def build(self, row, existing, authors, categories):
+        # (объект, файл из строки, id категорий или None, явные даты)
+        kind = self.kind
+        model = kind.model
+        slug = row.get('slug') or ''
+        if slug:
+            validate_slug(slug)
+        obj = existing.get(slug) or model(slug=slug)
+
+        dates = {}
+        for name in kind.fields:
+            if name not in row:
+                continue
+            field = model._meta.get_field(name)
+            value = row[name]
+            if value in ('', None):
+                if field.null:
+                    value = None
+                elif field.has_default():
+                    continue
+            value = to_python(field, value)
+            setattr(obj, name, value)
+            if getattr(field, 'auto_now_add', False):
+                # bulk_create подставит текущее время, записываем отдельно
+                dates[name] = value
+
+        if kind.author and (row.get('author') or obj.pk is None):
+            if row.get('author') not in authors:
+                raise ValidationError(f'неизвестный автор {row.get("author")!r}')
+            obj.author_id = authors[row['author']]
+
+        category_ids = None
+        slugs = self.category_slugs(row)
+        if kind.categories and slugs is not None:
+            missing = [slug for slug in slugs if slug not in categories]
+            if missing:
+                raise ValidationError(f'неизвестные категории: {", ".join(missing)}')
+            category_ids = [categories[slug] for slug in slugs]
+
+        file_value = row.get(kind.file_field) or None
+        if obj.pk is None and file_value is None and not model._meta.get_field(kind.file_field).blank:
+            raise ValidationError(f'не указан файл {kind.file_field}')
+        obj.full_clean(
+            exclude=['slug', 'author', 'categories', kind.file_field, 'search_vector'],
+            validate_unique=False, validate_constraints=False,
+        )
+        return obj, file_value, category_ids, dates
+
+    def store_file(self, value):
+        # Без каталога с файлами значение - уже имя файла в хранилище
+        if self.files_root is None:
+            return value
+        root = self.files_root.resolve()
+        source = (root / value).resolve()
+        # ../ и абсолютные пути из файла данных не выходят за каталог
+        if not source.is_relative_to(root):
+            raise ValueError('путь вне каталога с файлами')
+        with Image.open(source) as image:
+            # Битый файл - ошибка строки, а не пустая обложка
+            image.verify()
+        field = self.kind.model._meta.get_field(self.kind.file_field)
+        with source.open('rb') as content:
+            name = default_storage.save(field.generate_filename(None, source.name), File(content))
+        get_derivatives(name)
+        return name
+
+    def attach_files(self, prepared):
+        # Копирование файлов и построение уменьшенных копий - параллельно
+        jobs = [item for item in prepared if item[2]]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self.store_file, file_value) for _, _, file_value, *_ in jobs]
+        failed = set()
+        for (number, obj, file_value, *_), future in zip(jobs, futures):
+            try:
+                setattr(obj, self.kind.file_field, future.result())
+            except FILE_ERRORS as error:
+                self.error(number, f'файл {file_value}: {error}')
+                failed.add(number)
+        return [item for item in prepared if item[0] not in failed]
+
+    def save(self, prepared, columns):
+        kind = self.kind
+        model = kind.model
+        created = [obj for _, obj, *_ in prepared if obj.pk is None]
+        updated = [obj for _, obj, *_ in prepared if obj.pk is not None]
+        update_fields = [name for name in [*kind.fields, kind.file_field] if name in columns]
+        if kind.author and 'author' in columns:
+            update_fields.append('author')
+        now = timezone.now()
+        for obj in updated:
+            # bulk_update не проставляет auto_now сам
+            obj.updated_at = now
+
+        with transaction.atomic():
+            # Slug новых строк: один запрос по префиксам на пачку, см. main/slugs.py
+            pending = [obj for obj in created if not obj.slug]
+            slugs = unique_slugs(
+                model, [getattr(obj, kind.title_field) for obj in pending],
+                reserved={obj.slug for obj in created if obj.slug},
+            )
+            for obj, slug in zip(pending, slugs):
+                obj.slug = slug
+            model.objects.bulk_create(created)
+            if updated:
+                model.objects.bulk_update(updated, [*update_fields, 'updated_at'])
+            dated = [(obj, dates) for _, obj, _, _, dates in prepared if dates]
+            for obj, dates in dated:
+                for name, value in dates.items():
+                    setattr(obj, name, value)
+            if dated:
+                model.objects.bulk_update([obj for obj, _ in dated], sorted({name for _, d in dated for name in d}))
+
+            linked = [(obj, category_ids) for _, obj, _, category_ids, _ in prepared if category_ids is not None]
+            if linked:
+                through, source, target = kind.through()
+                through.objects.filter(**{f'{source}__in': [obj.pk for obj, _ in linked]}).delete()
+                through.objects.bulk_create([
+                    through(**{f'{source}_id': obj.pk, f'{target}_id': category_id})
+                    for obj, category_ids in linked for category_id in category_ids
+                ])
+
+            # То, что при сохранении по одному делают сигналы (main/signals.py)
+            ids = [obj.pk for obj in created + updated]
+            if model is Book:
+                books = Book.objects.filter(pk__in=ids)
+                update_book_vectors(books)
+                refresh_catalog(books)
+            elif model is Author and updated:
+                books = Book.objects.filter(author__in=[obj.pk for obj in updated])
+                update_book_vectors(books)
+                refresh_catalog(books)
+            elif model is News:
+                update_news_vectors(News.objects.filter(pk__in=ids))
+
+        self.created += len(created)
+        self.updated += len(updated)
+        self.rebuild_recommendations(ids)
+
+    def rebuild_recommendations(self, ids):
+        rebuild = {Book: rebuild_related_books, News: rebuild_related_news}.get(self.kind.model)
+        if not self.recommendations or rebuild is None or self.full_rebuild:
+            return
+        self.changed += len(ids)
+        if self.changed >= self.full_rebuild_at:
+            self.full_rebuild = True
+        else:
+            rebuild(ids)
+
+    def finish(self):
+        if self.full_rebuild:
+            rebuild_all()
+        bump_cache_version()
+        mark_structure_changed()
+
+
+def export_rows(kind):
+    # Потоковая выгрузка: серверный курсор, категории - одним подзапросом
+    kind = KINDS[kind]
+    queryset = kind.model.objects.order_by('pk')
+    annotations = {}
+    if kind.author:
+        annotations['author_slug'] = F('author__slug')
+    if kind.categories:
+        through, source, target = kind.through()
+        annotations['category_list'] = ArraySubquery(
+            through.objects.filter(**{source: OuterRef('pk')}).order_by(f'{target}__slug').values(f'{target}__slug')
+        )
+    queryset = queryset.annotate(**annotations)
+    for row in queryset.values('slug', *kind.fields, kind.file_field, *annotations).iterator(chunk_size=BATCH_SIZE):
+        if kind.author:
+            row['author'] = row.pop('author_slug')
+        if kind.categories:
+            row['categories'] = row.pop('category_list')
+        yield row
+
+
+def write_rows(rows, stream, fmt, columns):
+    if fmt == 'jsonl':
+        for row in rows:
+            stream.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+        return
+    writer = csv.DictWriter(stream, fieldnames=columns)
+    writer.writeheader()
+    for row in rows:
+        if isinstance(row.get('categories'), list):
+            row['categories'] = LIST_SEPARATOR.join(row['categories'])
+        writer.writerow(row)
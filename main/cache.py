@@ -0,0 +1,90 @@
+import hashlib
+import time
+from functools import partial, wraps
+from urllib.parse import urlencode
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = 'main:content_version'
+# Когда версию меняли в последний раз: см. main/routers.py
+BUMPED_KEY = 'main:content_bumped_at'
+
+
+def get_cache_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Начальное значение берем от времени: если ключ версии вытеснят
+        # из кеша, старые страницы с маленькой версией не всплывут снова
+        cache.add(VERSION_KEY, int(time.time()), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_cache_version(data_changed=True):
+    # Все закешированные страницы и фрагменты содержат версию в ключе,
+    # поэтому смена версии разом делает их недоступными. data_changed=False -
+    # данные не менялись (замеры с холодным кешем): чтение остается на реплике.
+    if data_changed:
+        cache.set(BUMPED_KEY, time.time(), timeout=None)
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        get_cache_version()
+        return cache.incr(VERSION_KEY)
+
+
+def bumped_within(seconds):
+    # Меняли ли данные за последние seconds секунд
+    bumped_at = cache.get(BUMPED_KEY)
+    return bumped_at is not None and time.time() - bumped_at < seconds
+
+
+def page_cache_key(request, version=None, stamp=None):
+    # Порядок GET-параметров не должен порождать разные ключи
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    digest = hashlib.md5(f'{request.path}?{query}'.encode('utf-8')).hexdigest()
+    key = f'main:page:{version or get_cache_version()}:{digest}'
+    return key if stamp is None else f'{key}:{stamp}'
+
+
+def cache_page_versioned(view=None, stamp=None):
+    # Кеширует ответ GET-запроса целиком. Только для страниц без форм
+    # с CSRF-токеном и без сообщений пользователю. stamp - функция,
+    # добавляющая к ключу данные, которые меняются без смены версии
+    # (см. main.counters.views_stamp).
+    if view is None:
+        return partial(cache_page_versioned, stamp=stamp)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+
+        key = page_cache_key(request, stamp=stamp and stamp())
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.cookies:
+            cache.set(key, response, settings.PAGE_CACHE_TIMEOUT)
+        return response
+
+    @wraps(view)
+    async def async_wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return await view(request, *args, **kwargs)
+
+        key = page_cache_key(request, stamp=stamp and await sync_to_async(stamp)())
+        response = await cache.aget(key)
+        if response is not None:
+            return response
+
+        response = await view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.cookies:
+            await cache.aset(key, response, settings.PAGE_CACHE_TIMEOUT)
+        return response
+
+    return async_wrapper if iscoroutinefunction(view) else wrapper
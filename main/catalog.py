@@ -0,0 +1,54 @@
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db import transaction
+from django.db.models import OuterRef
+
+BATCH_SIZE = 2000
+
+ENTRY_FIELDS = [
+    'title', 'slug', 'author', 'author_name', 'author_slug', 'category_slugs',
+    'cover_image', 'publication_date', 'is_bestseller', 'is_new',
+]
+
+
+def refresh_catalog(books):
+    # Пересобирает записи каталога для книг из queryset: доступные
+    # вставляются или обновляются, остальные удаляются. Модели берутся
+    # из queryset, поэтому функция работает и в миграциях.
+    Book = books.model
+    CatalogEntry = Book._meta.apps.get_model('main', 'CatalogEntry')
+    slugs = Book.categories.through.objects.filter(book=OuterRef('pk')).order_by(
+        'category__slug').values('category__slug')
+    rows = books.filter(is_available=True).values_list(
+        'pk', 'title', 'slug', 'author_id', 'author__name', 'author__slug', 'cover_image',
+        'publication_date', 'is_bestseller', 'is_new', ArraySubquery(slugs),
+    ).order_by()
+    entries = [
+        CatalogEntry(
+            book_id=pk, title=title, slug=slug, author_id=author_id, author_name=author_name,
+            author_slug=author_slug, cover_image=cover_image, publication_date=publication_date,
+            is_bestseller=is_bestseller, is_new=is_new, category_slugs=category_slugs,
+        )
+        for (pk, title, slug, author_id, author_name, author_slug, cover_image,
+             publication_date, is_bestseller, is_new, category_slugs) in rows
+    ]
+    with transaction.atomic():
+        CatalogEntry.objects.bulk_create(
+            entries, batch_size=BATCH_SIZE, update_conflicts=True,
+            unique_fields=['book'], update_fields=ENTRY_FIELDS,
+        )
+        removed, _ = CatalogEntry.objects.filter(book__in=books.values('pk')).exclude(
+            book__in=[entry.book_id for entry in entries]
+        ).delete()
+    return len(entries), removed
+
+
+def sync_catalog(books):
+    # Сверка пачками: пересобирает записи книг и удаляет записи недоступных
+    written = removed = 0
+    book_ids = list(books.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(book_ids), BATCH_SIZE):
+        batch = book_ids[start:start + BATCH_SIZE]
+        batch_written, batch_removed = refresh_catalog(books.filter(pk__in=batch))
+        written += batch_written
+        removed += batch_removed
+    return written, removed
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def shared_cache(app_configs, **kwargs):
+    # Кеш страниц и ограничение частоты с кешем отдельного процесса работают
+    # неверно: смена версии после правки в админке сбрасывает страницы
+    # только у одного воркера, у каждого воркера свои корзины токенов
+    if settings.DEBUG or getattr(settings, 'TESTING', False):
+        return []
+    if settings.CACHES['default']['BACKEND'] not in LOCAL_CACHES:
+        return []
+    if not settings.PAGE_CACHE_TIMEOUT and not settings.THROTTLE_ENABLED:
+        return []
+    return [Error(
+        'Кеш страниц и ограничение частоты требуют общего кеша.',
+        hint='Задайте REDIS_URL или DatabaseCache, либо PAGE_CACHE_TIMEOUT=0 и THROTTLE_ENABLED=False.',
+        id='main.E001',
+    )]
@@ -0,0 +1,213 @@
+import datetime
+import hashlib
+import time
+from functools import lru_cache, wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Subquery
+from django.db.models.functions import Greatest
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .cache import get_cache_version
+from .counters import views_flushed_at
+from .models import Author, AuthorCategory, Book, Category, News
+from .sitemaps import MAX_SHARD, SECTIONS, shard_rows
+from .static_export import template_files, templates_signature
+
+# Условные GET-запросы: браузер или CDN присылает If-None-Match или
+# If-Modified-Since, и если данные страницы не менялись, отвечаем 304,
+# не выполняя запросов самого представления. Время изменения страницы -
+# самое позднее updated_at среди ее строк, его считает один агрегатный запрос
+# и запоминает до следующего изменения данных.
+#
+# Удаление строк, правка связей многие-ко-многим и пересчет похожих книг
+# updated_at не меняют: для них хранится общая отметка в кеше.
+
+CHANGED_KEY = 'main:structure_changed_at'
+MISSING = object()
+
+
+def structure_changed_at():
+    value = cache.get(CHANGED_KEY)
+    if value is None:
+        # Отметку вытеснили из кеша: считаем, что все изменилось сейчас
+        cache.add(CHANGED_KEY, time.time(), timeout=None)
+        value = cache.get(CHANGED_KEY) or time.time()
+    return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+
+
+def mark_structure_changed():
+    cache.set(CHANGED_KEY, time.time(), timeout=None)
+
+
+@lru_cache(maxsize=None)
+def templates_state():
+    # Новая верстка после выкладки тоже меняет валидаторы всех страниц
+    modified = max(path.stat().st_mtime for _, path in template_files())
+    return templates_signature(), datetime.datetime.fromtimestamp(modified, tz=datetime.timezone.utc)
+
+
+def _latest(queryset, *fields):
+    expressions = [Max(field) if isinstance(field, str) else field for field in fields]
+    latest = Greatest(*expressions) if len(expressions) > 1 else expressions[0]
+    return queryset.order_by().aggregate(latest=latest)['latest']
+
+
+def _latest_of(*models):
+    # Без фильтров: скрытая или снятая с публикации строка тоже меняет список.
+    # Каждый максимум берется по индексу на updated_at.
+    first, *rest = models
+    return _latest(first.objects.all(), 'updated_at', *[
+        Subquery(model.objects.order_by('-updated_at').values('updated_at')[:1]) for model in rest
+    ])
+
+
+def counted(validators):
+    # Страница показывает просмотры новостей: их сброс в базу не меняет
+    # updated_at, поэтому к валидаторам добавляется отметка сброса
+    validators.counted = True
+    return validators
+
+
+# Валидаторы страниц: время последнего изменения данных или None,
+# если объекта нет и проверять нечего
+
+def static(request):
+    # Страница без данных меняется только вместе с шаблонами
+    return datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
+
+@counted
+def index(request):
+    return _latest_of(Book, Author, News)
+
+
+def sitemap_index(request):
+    return _latest_of(Book, Author, News)
+
+
+def catalog(request):
+    return _latest_of(Book, Author, Category)
+
+
+def authors(request):
+    return _latest_of(Author, AuthorCategory, Book)
+
+
+@counted
+def news(request):
+    return _latest_of(News)
+
+
+def feed(request):
+    return _latest_of(News)
+
+
+def book_detail(request, slug):
+    # Тот же отбор, что в представлении: у скрытой книги валидаторов нет,
+    # и представление отвечает 404
+    return _latest(
+        Book.objects.available().filter(slug=slug),
+        'updated_at', 'author__updated_at', 'categories__updated_at', 'recommendations__related__updated_at',
+    )
+
+
+def author_detail(request, slug):
+    return _latest(Author.objects.filter(slug=slug), 'updated_at', 'categories__updated_at', 'book__updated_at')
+
+
+def sitemap_section(request, section, shard):
+    if section not in SECTIONS:
+        return static(request) if section == 'pages' and shard == 0 else None
+    if shard > MAX_SHARD:
+        return None
+    return _latest(shard_rows(section, shard), 'updated_at')
+
+
+def validate(request, validators, args, kwargs):
+    # (ETag, Last-Modified) или None
+    if validators is None or request.method not in ('GET', 'HEAD'):
+        return None
+    # Время изменения хранится под версией кеша страниц: пока данные
+    # не менялись, повторные запросы и ответы 304 обходятся без SQL
+    arguments = hashlib.md5(repr((args, sorted(kwargs.items()))).encode('utf-8')).hexdigest()
+    key = f'main:validators:{get_cache_version()}:{validators.__module__}.{validators.__name__}:{arguments}'
+    latest = cache.get(key, MISSING)
+    if latest is MISSING:
+        latest = validators(request, *args, **kwargs)
+        cache.set(key, latest, settings.PAGE_CACHE_TIMEOUT)
+    if latest is None:
+        return None
+    signature, last_modified = templates_state()
+    last_modified = max(last_modified, latest, structure_changed_at())
+    if getattr(validators, 'counted', False):
+        last_modified = max(last_modified, views_flushed_at())
+    digest = hashlib.md5(f'{signature}:{last_modified.isoformat()}'.encode('utf-8')).hexdigest()
+    return quote_etag(digest), last_modified
+
+
+def http_cache(view, validators=None, **cache_control):
+    # Политика Cache-Control маршрута и ответ 304 по валидаторам.
+    # Без валидаторов страница всегда рендерится заново.
+
+    def finish(request, response, state):
+        if request.method not in ('GET', 'HEAD'):
+            return response
+        if state is not None and response.status_code in (200, 304):
+            etag, last_modified = state
+            response.headers.setdefault('ETag', etag)
+            response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+        if response.cookies:
+            # Ответ с Set-Cookie нельзя отдавать из общего кеша
+            patch_cache_control(response, private=True)
+        elif cache_control:
+            patch_cache_control(response, **cache_control)
+        return response
+
+    def not_modified(request, state):
+        if state is None:
+            return None
+        etag, last_modified = state
+        return get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+
+    # Без If-None-Match и If-Modified-Since ответ 304 невозможен: валидаторы
+    # нужны только для заголовков, и считаются после представления и только
+    # для ответа 200. Ответы 404 и редиректы запроса на них не тратят.
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not conditional(request):
+            response = view(request, *args, **kwargs)
+            state = validate(request, validators, args, kwargs) if response.status_code == 200 else None
+            return finish(request, response, state)
+        state = validate(request, validators, args, kwargs)
+        response = not_modified(request, state)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        return finish(request, response, state)
+
+    @wraps(view)
+    async def async_wrapper(request, *args, **kwargs):
+        if not conditional(request):
+            response = await view(request, *args, **kwargs)
+            state = None
+            if response.status_code == 200:
+                state = await sync_to_async(validate)(request, validators, args, kwargs)
+            return finish(request, response, state)
+        state = await sync_to_async(validate)(request, validators, args, kwargs)
+        response = not_modified(request, state)
+        if response is None:
+            response = await view(request, *args, **kwargs)
+        return finish(request, response, state)
+
+    cached = async_wrapper if iscoroutinefunction(view) else wrapper
+    # Для проверки бюджета запросов в тестах
+    cached.validators = validators
+    return cached
+
+
+def conditional(request):
+    return 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from .cache import get_cache_version
+from .counters import views_stamp
+
+
+def cache_version(request):
+    # Для {% cache %} в шаблонах: версия в ключе фрагмента сбрасывается
+    # при любом изменении книг, авторов, новостей и категорий
+    return {
+        'cache_version': get_cache_version(),
+        'fragment_cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+        # Для фрагментов со счетчиками просмотров; читается из кеша,
+        # только если шаблон его использует
+        'views_stamp': SimpleLazyObject(views_stamp),
+    }
@@ -0,0 +1,116 @@
+import atexit
+import datetime
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+
+from .models import News
+
+logger = logging.getLogger(__name__)
+
+# Когда просмотры в последний раз сбрасывали в базу. Сброс не меняет
+# updated_at и версию кеша, а списки новостей показывают просмотры:
+# отметка входит в ключи кеша и валидаторы этих страниц. Меняется она
+# не чаще раза в NEWS_VIEWS_FLUSH_INTERVAL на процесс.
+FLUSHED_KEY = 'main:views_flushed_at'
+
+
+def views_stamp():
+    # Для ключей кеша
+    return cache.get(FLUSHED_KEY) or 0
+
+
+def views_flushed_at():
+    return datetime.datetime.fromtimestamp(views_stamp(), tz=datetime.timezone.utc)
+
+
+class ViewCounter:
+    # Копит просмотры в памяти процесса и периодически сбрасывает их в базу
+    # агрегированными UPDATE ... SET field = field + n. Запрос страницы
+    # ничего не пишет в базу и не берет блокировку строки.
+
+    def __init__(self, model, field, interval_setting):
+        self.model = model
+        self.field = field
+        self.interval_setting = interval_setting
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def interval(self):
+        return getattr(settings, self.interval_setting, 10)
+
+    def record(self, pk):
+        with self._lock:
+            self._pending[pk] += 1
+        if self.interval <= 0:
+            self.flush()
+        else:
+            self._start_flusher()
+
+    def pending(self, pk):
+        with self._lock:
+            return self._pending[pk]
+
+    def live_count(self, obj):
+        # Значение из базы плюс еще не сброшенные просмотры этого процесса
+        return getattr(obj, self.field) + self.pending(obj.pk)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+
+        # Объекты с одинаковым приростом обновляем одним запросом
+        by_amount = defaultdict(list)
+        for pk, amount in pending.items():
+            by_amount[amount].append(pk)
+        try:
+            for amount, pks in by_amount.items():
+                self.model.objects.filter(pk__in=pks).update(
+                    **{self.field: F(self.field) + amount}
+                )
+        except Exception:
+            # Не теряем просмотры: вернем их в буфер до следующей попытки
+            with self._lock:
+                self._pending.update(pending)
+            raise
+        cache.set(FLUSHED_KEY, time.time(), timeout=None)
+        return sum(pending.values())
+
+    def _start_flusher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name=f'{self.model.__name__}.{self.field} flusher', daemon=True
+            )
+            self._thread.start()
+        atexit.register(self._flush_quietly)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self._flush_quietly()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Не удалось сохранить счетчики %s.%s', self.model.__name__, self.field)
+        finally:
+            # Соединение потока-сбрасывателя не должно висеть между сбросами
+            connection.close()
+
+
+news_views = ViewCounter(News, 'views_count', 'NEWS_VIEWS_FLUSH_INTERVAL')
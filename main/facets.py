@@ -0,0 +1,134 @@
+import datetime
+
+from django.core.exceptions import EmptyResultSet, FullResultSet
+from django.db import connections
+from django.db.models import Q
+
+# Фильтры каталога по нескольким признакам и число книг для каждого
+# значения. Внутри признака значения объединяются через ИЛИ, признаки
+# между собой - через И. Счетчики признака считаются с учетом всех
+# остальных фильтров, кроме его собственного, чтобы было видно, сколько
+# книг добавит еще одна отмеченная категория.
+
+MAX_VALUES = 20
+# Авторов в боковой панели - самые многочисленные по текущим фильтрам
+AUTHOR_FACET_LIMIT = 20
+FLAGS = ('new', 'bestseller')
+
+
+def _year(value):
+    try:
+        year = int(value)
+    except (TypeError, ValueError):
+        return None
+    return year if 1 <= year <= 9999 else None
+
+
+def parse_filters(params):
+    return {
+        'category': [slug for slug in params.getlist('category') if slug][:MAX_VALUES],
+        'author': [slug for slug in params.getlist('author') if slug][:MAX_VALUES],
+        'year_from': _year(params.get('year_from')),
+        'year_to': _year(params.get('year_to')),
+        'new': params.get('new') == '1',
+        'bestseller': params.get('bestseller') == '1',
+    }
+
+
+def _conditions(filters):
+    # {признак: условие}; год - один признак из двух границ
+    conditions = {}
+    if filters['category']:
+        conditions['category'] = Q(category_slugs__overlap=filters['category'])
+    if filters['author']:
+        conditions['author'] = Q(author_slug__in=filters['author'])
+    year = Q()
+    if filters['year_from']:
+        year &= Q(publication_date__gte=datetime.date(filters['year_from'], 1, 1))
+    if filters['year_to']:
+        year &= Q(publication_date__lte=datetime.date(filters['year_to'], 12, 31))
+    if year:
+        conditions['year'] = year
+    for flag in FLAGS:
+        if filters[flag]:
+            conditions[flag] = Q(**{f'is_{flag}': True})
+    return conditions
+
+
+def apply_filters(entries, filters, exclude=None):
+    for name, condition in _conditions(filters).items():
+        if name != exclude:
+            entries = entries.filter(condition)
+    return entries
+
+
+def _where(queryset):
+    # WHERE запроса без JOIN как SQL-фрагмент для общего запроса счетчиков
+    query = queryset.query
+    try:
+        return query.get_compiler(queryset.db).compile(query.where)
+    except FullResultSet:
+        return 'TRUE', []
+    except EmptyResultSet:
+        return 'FALSE', []
+
+
+def facet_counts(entries, filters):
+    # Все счетчики одним запросом: по ветке UNION ALL на признак, каждая
+    # с фильтрами остальных признаков
+    table = entries.model._meta.db_table
+    parts, params = [], []
+
+    def branch(sql, facet):
+        where, where_params = _where(apply_filters(entries, filters, exclude=facet))
+        parts.append(sql.format(table=table, where=where))
+        params.extend(where_params)
+
+    branch(
+        "(SELECT 'category', category_slug, NULL, COUNT(*) FROM {table}, unnest(category_slugs) AS category_slug "
+        "WHERE {where} GROUP BY category_slug)", 'category',
+    )
+    # Кроме первых авторов по числу книг, в ответ всегда попадают отмеченные
+    branch(
+        "(SELECT 'author', author_slug, MIN(author_name), COUNT(*) FROM {table} WHERE {where} "
+        "GROUP BY author_slug ORDER BY COUNT(*) DESC, author_slug LIMIT %s)", 'author',
+    )
+    params.append(AUTHOR_FACET_LIMIT)
+    if filters['author']:
+        branch(
+            "(SELECT 'author', author_slug, MIN(author_name), COUNT(*) FROM {table} "
+            "WHERE {where} AND author_slug = ANY(%s) GROUP BY author_slug)", 'author',
+        )
+        params.append(filters['author'])
+    branch(
+        "(SELECT 'year', EXTRACT(YEAR FROM publication_date)::int::text, NULL, COUNT(*) FROM {table} "
+        "WHERE {where} GROUP BY 2)", 'year',
+    )
+    for flag in FLAGS:
+        branch(f"(SELECT 'flag', '{flag}', NULL, COUNT(*) FROM {{table}} WHERE {{where}} AND is_{flag})", flag)
+
+    counts = {'category': {}, 'author': {}, 'year': {}, 'flag': {}}
+    with connections[entries.db].cursor() as cursor:
+        cursor.execute(' UNION ALL '.join(parts), params)
+        for facet, value, label, count in cursor.fetchall():
+            counts[facet][value] = (label, count) if facet == 'author' else count
+    return counts
+
+
+def facet_context(entries, filters, categories):
+    # Значения признаков для шаблона: (значение, подпись, число, отмечено)
+    counts = facet_counts(entries, filters)
+    authors = sorted(counts['author'].items(), key=lambda item: (-item[1][1], item[1][0]))
+    years = sorted(int(year) for year in counts['year'])
+    return {
+        'categories': [
+            (category.slug, category.name, counts['category'].get(category.slug, 0),
+             category.slug in filters['category'])
+            for category in categories
+        ],
+        'authors': [
+            (slug, name, count, slug in filters['author']) for slug, (name, count) in authors
+        ],
+        'years': [(year, counts['year'][str(year)]) for year in years],
+        'flags': {flag: counts['flag'].get(flag, 0) for flag in FLAGS},
+    }
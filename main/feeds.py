@@ -0,0 +1,43 @@
+from django.contrib.syndication.views import Feed
+from django.urls import reverse, reverse_lazy
+from django.utils.feedgenerator import Atom1Feed
+
+from .models import News
+
+FEED_SIZE = 30
+
+
+class NewsFeed(Feed):
+    title = 'Новости издательства Адыгейского университета'
+    link = reverse_lazy('news')
+    description = 'Мероприятия, новые издания, награды и проекты издательства'
+
+    def items(self):
+        # Текст новости в ленте не нужен
+        return (
+            News.objects.published().order_by('-publish_date')
+            .only('title', 'slug', 'short_description', 'category', 'publish_date', 'updated_at')[:FEED_SIZE]
+        )
+
+    def item_title(self, item):
+        return item.title
+
+    def item_description(self, item):
+        return item.short_description
+
+    def item_link(self, item):
+        return reverse('news_detail', args=[item.slug])
+
+    def item_pubdate(self, item):
+        return item.publish_date
+
+    def item_updateddate(self, item):
+        return item.updated_at
+
+    def item_categories(self, item):
+        return [item.get_category_display()]
+
+
+class AtomNewsFeed(NewsFeed):
+    feed_type = Atom1Feed
+    subtitle = NewsFeed.description
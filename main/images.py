@@ -0,0 +1,136 @@
+import hashlib
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Ширины уменьшенных копий. Больше оригинала не увеличиваем.
+WIDTHS = (160, 320, 480, 800, 1200)
+
+# (расширение, MIME-тип, формат Pillow, параметры сохранения) по убыванию
+# эффективности: браузер выберет первый поддерживаемый <source>
+FORMATS = [
+    ('avif', 'image/avif', 'AVIF', {'quality': 55}),
+    ('webp', 'image/webp', 'WEBP', {'quality': 80, 'method': 4}),
+]
+
+THUMBS_DIR = 'thumbs'
+
+# Копии, которых нет в кеше при рендеринге страницы, строятся в фоне:
+# страница не ждет кодирования AVIF и пока показывает оригинал
+_builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='derivatives')
+# Сколько секунд другие процессы не ставят ту же картинку в очередь
+QUEUED_TIMEOUT = 300
+
+
+def supported_formats():
+    return [fmt for fmt in FORMATS if features.check(fmt[0])]
+
+
+def derivative_name(name, width, extension):
+    # books/covers/book.jpg -> books/covers/thumbs/book.jpg-320w.webp.
+    # Имя оригинала целиком, с расширением: у book.jpg и book.png свои копии
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, THUMBS_DIR, f'{filename}-{width}w.{extension}')
+
+
+def _cache_key(name):
+    return 'main:img:' + hashlib.md5(name.encode('utf-8')).hexdigest()
+
+
+def _open(name):
+    with default_storage.open(name, 'rb') as original:
+        image = Image.open(original)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    return image
+
+
+def build_derivatives(name, force=False):
+    # Возвращает {расширение: [(ширина, имя файла), ...]} для всех
+    # поддерживаемых форматов, создавая недостающие копии рядом с оригиналом
+    image = None
+    result = {}
+    for extension, _, pillow_format, options in supported_formats():
+        result[extension] = []
+        for width in WIDTHS:
+            target = derivative_name(name, width, extension)
+            if not force and default_storage.exists(target):
+                result[extension].append((width, target))
+                continue
+            if image is None:
+                image = _open(name)
+            if width >= image.width:
+                continue
+            resized = image.copy()
+            resized.thumbnail((width, image.height), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, pillow_format, **options)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            # Хранилище может сохранить файл под другим именем (например,
+            # если параллельный воркер успел записать копию): в <picture> -
+            # то имя, которое оно вернуло
+            saved = default_storage.save(target, ContentFile(buffer.getvalue()))
+            result[extension].append((width, saved))
+    cache.set(_cache_key(name), result, None)
+    return result
+
+
+def get_derivatives(name):
+    result = cache.get(_cache_key(name))
+    if result is not None:
+        return result
+    if not default_storage.exists(name):
+        # Оригинала нет (например, еще не загружен на этот сервер)
+        result = {}
+    else:
+        try:
+            return build_derivatives(name)
+        except (OSError, ValueError):
+            logger.warning('Не удалось построить копии изображения %s', name, exc_info=True)
+            result = {}
+    # Повторим попытку позже, а пока отдаем оригинал как есть
+    cache.set(_cache_key(name), result, 300)
+    return result
+
+
+def cached_derivatives(name):
+    # Копии без построения: None, если в кеше о них ничего нет
+    return cache.get(_cache_key(name))
+
+
+def queue_derivatives(name):
+    # Одну картинку строит один процесс, остальные пока отдают оригинал
+    if cache.add(_cache_key(name) + ':queued', True, QUEUED_TIMEOUT):
+        return _builder.submit(_build_queued, name)
+    return None
+
+
+def _build_queued(name):
+    try:
+        get_derivatives(name)
+    except Exception:
+        logger.exception('Не удалось построить копии изображения %s', name)
+    finally:
+        cache.delete(_cache_key(name) + ':queued')
+
+
+def delete_derivatives(name):
+    targets = {derivative_name(name, width, extension) for extension, *_ in FORMATS for width in WIDTHS}
+    # Включая копии, которые хранилище сохранило под другим именем
+    for variants in (cache.get(_cache_key(name)) or {}).values():
+        targets.update(target for _, target in variants)
+    for target in sorted(targets):
+        if default_storage.exists(target):
+            default_storage.delete(target)
+    cache.delete(_cache_key(name))
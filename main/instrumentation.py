@@ -0,0 +1,247 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограммы длительности запросов, секунды
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_current = ContextVar('main_request_stats', default=None)
+
+_PROJECT_DIR = str(settings.BASE_DIR)
+_THIS_FILE = os.path.abspath(__file__)
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    # Параметры передаются отдельно, остается свернуть списки IN разной длины
+    return _IN_LIST.sub('IN (...)', _SPACES.sub(' ', sql).strip())
+
+
+def origin():
+    # Первый кадр стека из кода проекта: откуда на самом деле пришел запрос
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if (
+            filename.startswith(_PROJECT_DIR) and filename != _THIS_FILE
+            and 'site-packages' not in filename
+        ):
+            return f'{os.path.relpath(filename, _PROJECT_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return '?'
+
+
+class RequestStats:
+    def __init__(self):
+        self.query_count = 0
+        self.query_time = 0.0
+        self.fingerprints = Counter()
+        self.origins = {}
+        self.sections = defaultdict(float)
+        # Асинхронные представления выполняют запросы в нескольких потоках
+        self._lock = threading.Lock()
+
+    def record_query(self, sql, duration):
+        key = fingerprint(sql)
+        where = None if key in self.origins else origin()
+        with self._lock:
+            self.query_count += 1
+            self.query_time += duration
+            self.fingerprints[key] += 1
+            self.origins.setdefault(key, where)
+
+    def duplicates(self, threshold):
+        return [(sql, count, self.origins[sql]) for sql, count in self.fingerprints.items() if count >= threshold]
+
+
+def current_stats():
+    return _current.get()
+
+
+@contextmanager
+def timed(section):
+    # Время участка кода (шаблоны, изображения) в статистике текущего запроса
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.sections[section] += time.perf_counter() - started
+
+
+def _query_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_query(sql, time.perf_counter() - started)
+
+
+def _attach(connection, **kwargs):
+    # Обертка стоит на всех соединениях всех потоков, а статистику запроса
+    # находит через contextvar: он переходит и в потоки sync_to_async
+    if _query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_query_wrapper)
+
+
+@contextmanager
+def collect():
+    for connection in connections.all(initialized_only=True):
+        _attach(connection)
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+_template_render = Template.render
+
+
+def _timed_render(self, *args, **kwargs):
+    # include внутри шаблона идет мимо этой обертки, поэтому время не удваивается
+    with timed('templates'):
+        return _template_render(self, *args, **kwargs)
+
+
+def install():
+    Template.render = _timed_render
+    connection_created.connect(_attach, dispatch_uid='main.instrumentation')
+
+
+class Metrics:
+    # Агрегаты по представлениям в памяти процесса. При нескольких
+    # воркерах у каждого свои счетчики: Prometheus суммирует их по instance.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter()
+        self.duration = defaultdict(float)
+        self.buckets = defaultdict(Counter)
+        self.queries = Counter()
+        self.query_time = defaultdict(float)
+        self.sections = defaultdict(float)
+        self.duplicates = Counter()
+        self.slow = Counter()
+
+    def observe(self, view, status, duration, stats, duplicates, slow):
+        with self._lock:
+            self.requests[(view, status)] += 1
+            self.duration[view] += duration
+            for bound in BUCKETS:
+                if duration <= bound:
+                    self.buckets[view][bound] += 1
+            self.queries[view] += stats.query_count
+            self.query_time[view] += stats.query_time
+            for section, seconds in stats.sections.items():
+                self.sections[(view, section)] += seconds
+            self.duplicates[view] += len(duplicates)
+            if slow:
+                self.slow[view] += 1
+
+    def render(self):
+        with self._lock:
+            lines = [
+                '# HELP adyge_requests_total Обработанные запросы.',
+                '# TYPE adyge_requests_total counter',
+            ]
+            for (view, status), count in sorted(self.requests.items()):
+                lines.append(f'adyge_requests_total{{view="{view}",status="{status}"}} {count}')
+
+            lines += [
+                '# HELP adyge_request_duration_seconds Время обработки запроса.',
+                '# TYPE adyge_request_duration_seconds histogram',
+            ]
+            totals = Counter()
+            for (view, _), count in self.requests.items():
+                totals[view] += count
+            for view in sorted(totals):
+                for bound in BUCKETS:
+                    lines.append(
+                        f'adyge_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} '
+                        f'{self.buckets[view][bound]}'
+                    )
+                lines.append(f'adyge_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {totals[view]}')
+                lines.append(f'adyge_request_duration_seconds_sum{{view="{view}"}} {self.duration[view]:.6f}')
+                lines.append(f'adyge_request_duration_seconds_count{{view="{view}"}} {totals[view]}')
+
+            for name, help_text, values in (
+                ('adyge_db_queries_total', 'SQL-запросы.', self.queries),
+                ('adyge_db_duration_seconds_total', 'Время SQL-запросов.', self.query_time),
+                ('adyge_duplicate_queries_total', 'Повторяющиеся запросы (N+1).', self.duplicates),
+                ('adyge_slow_requests_total', 'Медленные запросы.', self.slow),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for view in sorted(values):
+                    value = values[view]
+                    lines.append(f'{name}{{view="{view}"}} {value:.6f}' if isinstance(value, float)
+                                 else f'{name}{{view="{view}"}} {value}')
+
+            lines += [
+                '# HELP adyge_section_duration_seconds_total Время шаблонов и изображений.',
+                '# TYPE adyge_section_duration_seconds_total counter',
+            ]
+            for (view, section), seconds in sorted(self.sections.items()):
+                lines.append(
+                    f'adyge_section_duration_seconds_total{{view="{view}",section="{section}"}} {seconds:.6f}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def server_timing(duration, stats):
+    parts = [f'db;dur={stats.query_time * 1000:.1f};desc="{stats.query_count} SQL"']
+    for section, seconds in sorted(stats.sections.items()):
+        parts.append(f'{section};dur={seconds * 1000:.1f}')
+    parts.append(f'total;dur={duration * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    # Нераспознанные адреса сводим в одну метку, чтобы не плодить серии
+    return match.view_name if match and match.view_name else 'unresolved'
+
+
+def report(request, response, duration, stats):
+    view = view_name(request)
+    duplicates = stats.duplicates(settings.DUPLICATE_QUERY_THRESHOLD)
+    slow = duration * 1000 >= settings.SLOW_REQUEST_MS
+    metrics.observe(view, response.status_code, duration, stats, duplicates, slow)
+
+    for sql, count, where in duplicates:
+        logger.warning('N+1 в %s (%s): %s раз из %s\n%s', view, request.path, count, where, sql)
+    if slow:
+        top = sorted(stats.fingerprints.items(), key=lambda item: item[1], reverse=True)[:5]
+        logger.warning(
+            'Медленный запрос %s (%s): %.0f мс, SQL %s за %.0f мс, %s\n%s',
+            view, request.path, duration * 1000, stats.query_count, stats.query_time * 1000,
+            ', '.join(f'{section} {seconds * 1000:.0f} мс' for section, seconds in stats.sections.items()),
+            '\n'.join(f'{count}x {stats.origins[sql]}: {sql}' for sql, count in top),
+        )
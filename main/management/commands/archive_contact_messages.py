@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.archive import archivable, archive_batch, archive_cutoff
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые обработанные сообщения обратной связи в архив пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CONTACT_ARCHIVE_DAYS,
+            help='Переносить сообщения старше этого числа дней',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Сообщений в одной транзакции')
+        parser.add_argument('--pause', type=float, default=0, help='Пауза между пачками, секунд')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не переносить')
+
+    def handle(self, *args, **options):
+        before = archive_cutoff(options['days'])
+        if options['dry_run']:
+            self.stdout.write(f'К переносу: {archivable(before).count()}')
+            return
+
+        total = 0
+        while True:
+            moved = archive_batch(before, options['batch_size'])
+            total += moved
+            if moved < options['batch_size']:
+                break
+            time.sleep(options['pause'])
+        self.stdout.write(f'Перенесено в архив: {total}')
@@ -0,0 +1,148 @@
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+
+from main import synthetic
+from main.management.commands.benchmark_urls import benchmark_urls, percentile
+
+
+def _summary(latencies, statuses, elapsed):
+    errors = sum(1 for status in statuses if status >= 400)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+    }
+
+
+def run_wsgi(urls, total, concurrency):
+    # Поток на соединение, как у gunicorn с gthread
+    local = threading.local()
+    latencies, statuses = [], []
+
+    def request(url):
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        started = time.perf_counter()
+        response = local.client.get(url)
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses.append(response.status_code)
+
+    def close_connections():
+        connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(request, itertools.islice(itertools.cycle(urls), total)))
+        list(pool.map(lambda _: close_connections(), range(concurrency)))
+    return _summary(latencies, statuses, time.perf_counter() - started)
+
+
+def run_asgi(urls, total, concurrency):
+    # Все запросы в одном цикле событий, как у uvicorn
+    latencies, statuses = [], []
+
+    async def worker(queue):
+        client = AsyncClient()
+        while True:
+            try:
+                url = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            response = await client.get(url)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses.append(response.status_code)
+
+    async def main():
+        queue = asyncio.Queue()
+        for url in itertools.islice(itertools.cycle(urls), total):
+            queue.put_nowait(url)
+        await asyncio.gather(*(worker(queue) for _ in range(concurrency)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return _summary(latencies, statuses, time.perf_counter() - started)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность сайта под WSGI (синхронные представления, '
+        'поток на запрос) и ASGI (асинхронные представления, один цикл событий) '
+        'при высокой конкурентности на одних и тех же данных. Каждый режим '
+        'запускается в отдельном процессе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='Сначала заполнить базу синтетическими данными')
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--authors', type=int, default=10000)
+        parser.add_argument('--news', type=int, default=50000)
+        parser.add_argument('--requests', type=int, default=2000, help='Запросов в каждом режиме')
+        parser.add_argument('--concurrency', type=int, default=64, help='Одновременных запросов')
+        parser.add_argument('--cached', action='store_true', help='Не отключать кеш страниц')
+        parser.add_argument('--json', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'], help='Служебный: выполнить один режим')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            self.run_mode(options)
+            return
+
+        if options['seed']:
+            synthetic.seed(books=options['books'], authors=options['authors'], news=options['news'], messages=0)
+            call_command('update_search_index', stdout=self.stdout)
+
+        results = {}
+        for mode in ('wsgi', 'asgi'):
+            command = [
+                sys.executable, sys.argv[0], 'benchmark_asgi', '--mode', mode,
+                '--requests', str(options['requests']), '--concurrency', str(options['concurrency']),
+            ]
+            if options['cached']:
+                command.append('--cached')
+            if options['settings']:
+                command += ['--settings', options['settings']]
+            environment = dict(os.environ, ASYNC_VIEWS='True' if mode == 'asgi' else 'False')
+            output = subprocess.run(command, env=environment, check=True, stdout=subprocess.PIPE, text=True).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+
+        self.stdout.write(f'{"режим":<6} {"запросов/с":>11} {"p50, мс":>9} {"p95, мс":>9} {"p99, мс":>9} {"ошибок":>7}')
+        for mode, row in results.items():
+            self.stdout.write(
+                f'{mode:<6} {row["rps"]:>11.1f} {row["p50_ms"]:>9.2f} {row["p95_ms"]:>9.2f} '
+                f'{row["p99_ms"]:>9.2f} {row["errors"]:>7}'
+            )
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as output:
+                json.dump({'concurrency': options['concurrency'], 'results': results}, output, indent=2)
+
+    def run_mode(self, options):
+        urls = list(benchmark_urls().values())
+        runner = run_asgi if options['mode'] == 'asgi' else run_wsgi
+        # Без кеша страниц меряем представления, а не чтение из кеша
+        # Все запросы идут с одного адреса - ограничение частоты их бы отклонило
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'], 'THROTTLE_ENABLED': False}
+        if not options['cached']:
+            overrides['PAGE_CACHE_TIMEOUT'] = 0
+        with override_settings(**overrides):
+            # Прогрев: соединения с базой, шаблоны, копии изображений
+            runner(urls, len(urls) * 2, options['concurrency'])
+            result = runner(urls, options['requests'], options['concurrency'])
+        self.stdout.write(json.dumps(result))
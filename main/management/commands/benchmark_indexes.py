@@ -0,0 +1,148 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import QueryDict
+
+from main import synthetic
+from main.facets import apply_filters, parse_filters
+from main.models import Author, Book, CatalogEntry, ContactMessage, News
+from main.pagination import CATALOG_ORDERINGS, CATALOG_PAGE_SIZE
+
+# Индексы под фильтры представлений (миграции 0006_view_indexes, 0008_catalog_entry
+# и 0010_catalog_facets).
+# Для замера "до" они временно удаляются внутри транзакции.
+VIEW_INDEXES = [
+    'author_name_idx',
+    'author_popular_name_idx',
+    'catalog_new_idx',
+    'catalog_title_idx',
+    'catalog_popular_idx',
+    'catalog_popular_order_idx',
+    'catalog_author_idx',
+    'catalog_author_slug_idx',
+    'catalog_categories_idx',
+    'contact_created_idx',
+    'contact_processed_created_idx',
+    'news_published_date_idx',
+    'news_published_category_idx',
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+def view_queries():
+    # Те же запросы, что выполняют представления и админка: карточки книг
+    # читаются из CatalogEntry (main/views.py), страница каталога -
+    # keyset_page с запасом в одну строку
+    category = Book.categories.field.related_model.objects.order_by('id').values_list('slug', flat=True).first()
+    author_id, author_slug = CatalogEntry.objects.values_list('author_id', 'author_slug').first() or (None, '')
+    page = CATALOG_PAGE_SIZE + 1
+
+    def filtered(query):
+        return apply_filters(CatalogEntry.objects.all(), parse_filters(QueryDict(query)))
+
+    return {
+        'index_books': CatalogEntry.objects.order_by('-publication_date', '-pk')[:8],
+        'catalog_new': CatalogEntry.objects.order_by(*CATALOG_ORDERINGS['new'])[:page],
+        'catalog_popular': CatalogEntry.objects.order_by(*CATALOG_ORDERINGS['popular'])[:page],
+        'catalog_title': CatalogEntry.objects.order_by(*CATALOG_ORDERINGS['title'])[:page],
+        'catalog_category': filtered(f'category={category}').order_by(*CATALOG_ORDERINGS['new'])[:page],
+        'catalog_bestseller': filtered('bestseller=1').order_by(*CATALOG_ORDERINGS['new'])[:page],
+        'catalog_author': filtered(f'author={author_slug}').order_by(*CATALOG_ORDERINGS['new'])[:page],
+        'author_books': CatalogEntry.objects.filter(author=author_id),
+        # Асинхронная страница автора выбирает книги по slug, см. main/async_views.py
+        'author_books_slug': CatalogEntry.objects.filter(author_slug=author_slug),
+        'popular_authors': Author.objects.popular().order_by('name')[:6],
+        'authors_page': Author.objects.order_by('name')[:50],
+        'news_list': News.objects.published().order_by('-publish_date')[:12],
+        'news_category': News.objects.published().filter(category='events').order_by('-publish_date')[:12],
+        'admin_unprocessed': ContactMessage.objects.filter(is_processed=False).order_by('-created_at')[:100],
+        'admin_messages': ContactMessage.objects.order_by('-created_at')[:100],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет запросы представлений с индексами и без них, выводит EXPLAIN и время. '
+        'Индексы удаляются внутри транзакции и возвращаются откатом; '
+        'DROP INDEX блокирует таблицы, запускайте на копии базы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='Сначала заполнить базу синтетическими данными')
+        parser.add_argument('--clear', action='store_true', help='Удалить синтетические данные и выйти')
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--authors', type=int, default=10000)
+        parser.add_argument('--news', type=int, default=50000)
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20, help='Сколько раз выполнять каждый запрос')
+        parser.add_argument('--plans', action='store_true', help='Печатать полные планы EXPLAIN ANALYZE')
+        parser.add_argument('--json', help='Сохранить результаты в JSON-файл')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            synthetic.clear()
+            self.stdout.write(self.style.SUCCESS('Синтетические данные удалены'))
+            return
+        if options['seed']:
+            started = time.perf_counter()
+            synthetic.seed(
+                books=options['books'], authors=options['authors'],
+                news=options['news'], messages=options['messages'],
+            )
+            self.stdout.write(f'Данные созданы за {time.perf_counter() - started:.1f} с')
+        self.analyze()
+
+        results = {'with_indexes': self.measure(options['repeat'])}
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for name in VIEW_INDEXES:
+                        cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+                self.analyze()
+                results['without_indexes'] = self.measure(options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+        self.analyze()
+
+        self.report(results, options['plans'])
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            for model in (Author, Book, Book.categories.through, CatalogEntry, News, ContactMessage):
+                cursor.execute(f'ANALYZE "{model._meta.db_table}"')
+
+    def measure(self, repeat):
+        measurements = {}
+        for name, queryset in view_queries().items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset._chain())
+                timings.append((time.perf_counter() - started) * 1000)
+            measurements[name] = {
+                'median_ms': round(statistics.median(timings), 3),
+                'max_ms': round(max(timings), 3),
+                'plan': queryset.explain(analyze=True, buffers=True),
+            }
+        return measurements
+
+    def report(self, results, show_plans):
+        after, before = results['with_indexes'], results['without_indexes']
+        self.stdout.write(f'{"запрос":<20} {"без индексов, мс":>18} {"с индексами, мс":>18} {"ускорение":>10}')
+        for name in after:
+            old, new = before[name]['median_ms'], after[name]['median_ms']
+            speedup = old / new if new else float('inf')
+            self.stdout.write(f'{name:<20} {old:>18.3f} {new:>18.3f} {speedup:>9.1f}x')
+            if show_plans:
+                self.stdout.write(f'\n-- {name}: без индексов\n{before[name]["plan"]}')
+                self.stdout.write(f'-- {name}: с индексами\n{after[name]["plan"]}\n')
@@ -0,0 +1,114 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from main.management.commands.benchmark_urls import percentile
+
+# Режим: переменные окружения рабочего процесса
+MODES = {
+    'cold': {'TEMPLATE_WARMUP': 'False'},
+    'warm': {'TEMPLATE_WARMUP': 'True'},
+}
+
+
+def wsgi_get(application, path, host):
+    environ = RequestFactory(HTTP_HOST=host).get(path).environ
+    statuses = []
+    body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return int(statuses[0].split()[0])
+
+
+class Command(BaseCommand):
+    help = (
+        'Меряет время до первого ответа у только что запущенного рабочего процесса '
+        'с прогревом при старте и без него. Каждый процесс запускается заново и '
+        'загружает adyge_books.wsgi, как gunicorn.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Процессов в каждом режиме')
+        parser.add_argument('--url', action='append', help='Первые запросы процесса (по умолчанию /catalog/)')
+        parser.add_argument(
+            '--prime', action='store_true',
+            help='Добавить режим primed: прогрев с запросом этих адресов (WARMUP_PAGES) и кешем страниц',
+        )
+        parser.add_argument('--json', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--mode', help='Служебный: один рабочий процесс')
+
+    def handle(self, *args, **options):
+        urls = options['url'] or ['/catalog/']
+        if options['mode']:
+            self.run_worker(urls)
+            return
+
+        modes = dict(MODES)
+        if options['prime']:
+            modes['primed'] = {'TEMPLATE_WARMUP': 'True', 'WARMUP_PAGES': ','.join(urls)}
+        results = {}
+        for mode, environment in modes.items():
+            command = [sys.executable, sys.argv[0], 'benchmark_startup', '--mode', mode]
+            for url in urls:
+                command += ['--url', url]
+            if options['settings']:
+                command += ['--settings', options['settings']]
+            environment = dict(os.environ, **environment)
+            if mode != 'primed':
+                # Ответ должен строиться заново, а не браться из общего кеша
+                environment['PAGE_CACHE_TIMEOUT'] = '0'
+            results[mode] = []
+            for _ in range(options['workers']):
+                environment['BENCHMARK_SPAWNED_AT'] = repr(time.time())
+                output = subprocess.run(
+                    command, env=environment, check=True, stdout=subprocess.PIPE, text=True,
+                ).stdout
+                results[mode].append(json.loads(output.strip().splitlines()[-1]))
+
+        self.stdout.write(
+            f'{"режим":<7} {"запуск, мс":>11} {"1-й ответ, мс":>14} {"2-й ответ, мс":>14} '
+            f'{"до 1-го ответа, мс":>19} {"p95":>7}'
+        )
+        for mode, workers in results.items():
+            column = lambda key: [worker[key] for worker in workers]  # noqa: E731
+            self.stdout.write(
+                f'{mode:<7} {percentile(column("boot_ms"), 50):>11.0f} {percentile(column("first_ms"), 50):>14.1f} '
+                f'{percentile(column("second_ms"), 50):>14.1f} {percentile(column("ttfr_ms"), 50):>19.0f} '
+                f'{percentile(column("ttfr_ms"), 95):>7.0f}'
+            )
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as output:
+                json.dump({'urls': urls, 'results': results}, output, indent=2)
+
+    def run_worker(self, urls):
+        spawned_at = float(os.environ.get('BENCHMARK_SPAWNED_AT', time.time()))
+        # Загрузка приложения и прогрев - то, что делает сервер при старте процесса
+        application = importlib.import_module('adyge_books.wsgi').application
+        boot = time.time() - spawned_at
+        host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.')
+        host = 'localhost' if host == '*' else host
+
+        started = time.perf_counter()
+        statuses = [wsgi_get(application, url, host) for url in urls]
+        first = time.perf_counter() - started
+        ttfr = time.time() - spawned_at
+        started = time.perf_counter()
+        statuses += [wsgi_get(application, url, host) for url in urls]
+        second = time.perf_counter() - started
+        self.stdout.write(json.dumps({
+            'boot_ms': round(boot * 1000, 1),
+            'first_ms': round(first * 1000, 2),
+            'second_ms': round(second * 1000, 2),
+            'ttfr_ms': round(ttfr * 1000, 1),
+            'errors': sum(1 for status in statuses if status >= 400),
+        }))
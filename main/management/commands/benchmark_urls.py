@@ -0,0 +1,222 @@
+import json
+import math
+import platform
+import statistics
+import time
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.template.backends.django import Template
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from main import synthetic
+from main.cache import bump_cache_version
+from main.models import Author, Book, Category, News
+from main.pagination import CATALOG_ORDERINGS
+from main.sitemaps import SHARD_SIZE
+
+
+def percentile(values, percent):
+    # Ближайший ранг: для 20 замеров p95 - 19-й по возрастанию
+    ordered = sorted(values)
+    index = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def benchmark_urls():
+    # Все маршруты main/urls.py; каталог - с каждой сортировкой и фильтром
+    book = Book.objects.available().order_by('-publication_date').first()
+    author = Author.objects.order_by('-is_popular', 'name').first()
+    news_item = News.objects.published().order_by('-publish_date').first()
+    category = Category.objects.order_by('id').first()
+
+    urls = {
+        'index': reverse('index'),
+        'authors': reverse('authors'),
+        'about': reverse('about'),
+        'contacts': reverse('contacts'),
+        'news': reverse('news'),
+        'search': reverse('search') + '?q=тхылъ',
+    }
+    for sort in CATALOG_ORDERINGS:
+        urls[f'catalog_{sort}'] = reverse('catalog') + f'?sort={sort}'
+        urls[f'catalog_page_{sort}'] = reverse('catalog_page') + f'?sort={sort}'
+        if category:
+            urls[f'catalog_{sort}_category'] = reverse('catalog') + f'?sort={sort}&category={category.slug}'
+    urls['catalog_search'] = reverse('catalog') + '?search=тхылъ'
+    if book:
+        urls['book_detail'] = reverse('book_detail', kwargs={'slug': book.slug})
+    if author:
+        urls['author_detail'] = reverse('author_detail', kwargs={'slug': author.slug})
+    if news_item:
+        urls['news_detail'] = reverse('news_detail', kwargs={'slug': news_item.slug})
+    urls['sitemap'] = reverse('sitemap')
+    if book:
+        urls['sitemap_section'] = reverse('sitemap_section', kwargs={'section': 'books', 'shard': book.pk // SHARD_SIZE})
+    urls['news_feed'] = reverse('news_feed')
+    urls['news_feed_atom'] = reverse('news_feed_atom')
+    urls['robots_txt'] = reverse('robots_txt')
+    return urls
+
+
+@contextmanager
+def template_timer(timings):
+    # Время рендеринга шаблонов верхнего уровня (вложенные include входят в него)
+    original = Template.render
+
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - started)
+
+    with mock.patch.object(Template, 'render', render):
+        yield
+
+
+@contextmanager
+def capture_queries():
+    # Запросы ко всем базам: страницы могут читаться с реплики (main/routers.py)
+    captured = []
+    with ExitStack() as stack:
+        seen = set()
+        for alias in connections:
+            if id(connections[alias]) not in seen:
+                seen.add(id(connections[alias]))
+                captured.append(stack.enter_context(CaptureQueriesContext(connections[alias])))
+        yield captured
+
+
+def cold_cache():
+    # Вместо cache.clear(): общий Redis может хранить сессии, ограничение
+    # частоты и ключи других приложений. Новая версия делает недоступными
+    # только страницы, фрагменты и валидаторы сайта.
+    bump_cache_version(data_changed=False)
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку всех страниц сайта через тестовый клиент: p50/p95/p99, '
+        'число и время SQL-запросов, время рендеринга шаблонов. '
+        'Результаты можно сохранить в JSON и сравнить с прошлым запуском.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='Сначала заполнить базу синтетическими данными')
+        parser.add_argument('--clear', action='store_true', help='Удалить синтетические данные и выйти')
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--authors', type=int, default=10000)
+        parser.add_argument('--news', type=int, default=50000)
+        parser.add_argument('--messages', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=50, help='Запросов к каждому адресу')
+        parser.add_argument('--warmup', type=int, default=3, help='Прогревочных запросов, не входят в замер')
+        parser.add_argument('--cached', action='store_true', help='Не сбрасывать кеш страниц между запросами')
+        parser.add_argument('--host', default='localhost', help='Заголовок Host тестового клиента')
+        parser.add_argument('--json', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--compare', help='JSON прошлого запуска для сравнения p95')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            synthetic.clear()
+            self.stdout.write(self.style.SUCCESS('Синтетические данные удалены'))
+            return
+        if options['seed']:
+            started = time.perf_counter()
+            synthetic.seed(
+                books=options['books'], authors=options['authors'],
+                news=options['news'], messages=options['messages'],
+            )
+            call_command('update_search_index', stdout=self.stdout)
+            self.stdout.write(f'Данные созданы за {time.perf_counter() - started:.1f} с')
+
+        client = Client(HTTP_HOST=options['host'])
+        results = {}
+        # Все запросы идут с одного адреса - ограничение частоты их бы отклонило
+        with override_settings(THROTTLE_ENABLED=False):
+            for name, url in benchmark_urls().items():
+                results[name] = self.measure(client, url, options)
+
+        report = {
+            'meta': {
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'cached': options['cached'],
+                'rows': {
+                    'books': Book.objects.count(),
+                    'authors': Author.objects.count(),
+                    'news': News.objects.count(),
+                },
+            },
+            'urls': results,
+        }
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as source:
+                baseline = json.load(source)['urls']
+        self.report(results, baseline)
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+
+    def measure(self, client, url, options):
+        for _ in range(options['warmup']):
+            if not options['cached']:
+                cold_cache()
+            client.get(url)
+
+        latencies, query_counts, query_times, render_times = [], [], [], []
+        status = None
+        for _ in range(options['repeat']):
+            if not options['cached']:
+                cold_cache()
+            renders = []
+            with capture_queries() as captured, template_timer(renders):
+                started = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    # Карта сайта формируется по мере чтения ответа
+                    b''.join(response.streaming_content)
+                latencies.append((time.perf_counter() - started) * 1000)
+            status = response.status_code
+            queries = [query for context in captured for query in context.captured_queries]
+            query_counts.append(len(queries))
+            query_times.append(sum(float(query['time']) for query in queries) * 1000)
+            render_times.append(sum(renders) * 1000)
+
+        return {
+            'url': url,
+            'status': status,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'max_ms': round(max(latencies), 3),
+            'queries': max(query_counts),
+            'query_ms': round(statistics.median(query_times), 3),
+            'render_ms': round(statistics.median(render_times), 3),
+        }
+
+    def report(self, results, baseline):
+        header = f'{"адрес":<28} {"p50":>9} {"p95":>9} {"p99":>9} {"SQL":>4} {"SQL, мс":>9} {"шаблоны":>9}'
+        if baseline:
+            header += f' {"p95 было":>9}'
+        self.stdout.write(header)
+        for name, row in results.items():
+            line = (
+                f'{name:<28} {row["p50_ms"]:>9.2f} {row["p95_ms"]:>9.2f} {row["p99_ms"]:>9.2f} '
+                f'{row["queries"]:>4} {row["query_ms"]:>9.2f} {row["render_ms"]:>9.2f}'
+            )
+            if baseline and name in baseline:
+                line += f' {baseline[name]["p95_ms"]:>9.2f}'
+            if row['status'] != 200:
+                line += f'  (HTTP {row["status"]})'
+            self.stdout.write(line)
@@ -0,0 +1,43 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.assets import build_icons, brotli, font_subset
+
+
+def default_source():
+    try:
+        import fontawesomefree
+    except ImportError:
+        return None
+    return Path(fontawesomefree.__file__).parent / 'static' / 'fontawesomefree'
+
+
+class Command(BaseCommand):
+    help = 'Собирает static/vendor/fontawesome: только значки, которые встречаются в шаблонах и скриптах'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source', help='Каталог Font Awesome Free (metadata/, webfonts/); '
+                             'по умолчанию - из установленного пакета fontawesomefree',
+        )
+        parser.add_argument(
+            '--output', default=settings.BASE_DIR / 'static' / 'vendor' / 'fontawesome',
+            help='Куда положить icons.css и шрифты',
+        )
+
+    def handle(self, *args, **options):
+        source = options['source'] or default_source()
+        if source is None or not (Path(source) / 'metadata' / 'icons.json').exists():
+            raise CommandError('Не найден Font Awesome Free: pip install fontawesomefree или укажите --source')
+        if font_subset is None:
+            self.stderr.write('fontTools не установлен: шрифты будут скопированы целиком')
+        elif brotli is None:
+            self.stderr.write('brotli не установлен: шрифты будут в формате woff вместо woff2')
+
+        scan_paths = [*settings.TEMPLATES[0]['DIRS'], *settings.STATICFILES_DIRS]
+        icons, unknown = build_icons(source, options['output'], scan_paths)
+        for name in unknown:
+            self.stderr.write(f'Нет такого значка в Font Awesome: fa-{name}')
+        self.stdout.write(self.style.SUCCESS(f'Значков в наборе: {len(icons)}'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from main.images import build_derivatives
+from main.models import Author, Book, News
+
+
+class Command(BaseCommand):
+    help = 'Строит AVIF/WebP-копии обложек, фото авторов и изображений новостей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Пересоздать уже существующие копии')
+
+    def handle(self, *args, **options):
+        sources = [
+            Book.objects.values_list('cover_image', flat=True),
+            Author.objects.exclude(photo='').exclude(photo__isnull=True).values_list('photo', flat=True),
+            News.objects.values_list('image', flat=True),
+        ]
+        built = failed = 0
+        for names in sources:
+            for name in names.iterator():
+                try:
+                    build_derivatives(name, force=options['force'])
+                    built += 1
+                except (OSError, ValueError) as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'Обработано изображений: {built}, с ошибками: {failed}'))
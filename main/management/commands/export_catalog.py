@@ -0,0 +1,23 @@
+
+from django.core.management.base import BaseCommand
+
+from main.bulk import FORMATS, KINDS, detect_format, export_rows, write_rows
+
+
+class Command(BaseCommand):
+    help = 'Потоково выгружает книги, авторов или новости в CSV или JSONL в формате import_catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(KINDS))
+        parser.add_argument('path', nargs='?', default='-', help='Файл выгрузки, по умолчанию - стандартный вывод')
+        parser.add_argument('--format', choices=FORMATS, help='По умолчанию - по расширению файла')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path == '-' else detect_format(path))
+        columns = KINDS[options['kind']].columns
+        if path == '-':
+            write_rows(export_rows(options['kind']), self.stdout, fmt, columns)
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as stream:
+            write_rows(export_rows(options['kind']), stream, fmt, columns)
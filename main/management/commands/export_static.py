@@ -0,0 +1,30 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.static_export import export
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает страницы только для чтения (главная, о нас, авторы, новости, '
+        'карточки книг, авторов и новостей) в статические HTML-файлы для nginx. '
+        'Повторный запуск перерисовывает только страницы с изменившимися данными.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.STATIC_EXPORT_ROOT, help='Каталог выгрузки')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Процессов для рендеринга')
+        parser.add_argument('--force', action='store_true', help='Перерисовать все страницы')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rendered, skipped, removed, failed = export(
+            options['output'], workers=options['workers'], force=options['force'],
+        )
+        self.stdout.write(
+            f'Перерисовано: {rendered}, без изменений: {skipped}, удалено: {removed}, '
+            f'ошибок: {failed} за {time.perf_counter() - started:.1f} с'
+        )
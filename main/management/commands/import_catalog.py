@@ -0,0 +1,43 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.bulk import BATCH_SIZE, FORMATS, KINDS, Importer, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Массово загружает книги, авторов или новости из CSV или JSONL. Записи ищутся '
+        'по slug: найденные обновляются, остальные создаются. Файл читается потоково, '
+        'пачки сохраняются в отдельных транзакциях.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(KINDS))
+        parser.add_argument('path', help='Файл с данными, "-" - стандартный ввод')
+        parser.add_argument('--format', choices=FORMATS, help='По умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Строк в одной транзакции')
+        parser.add_argument('--files', help='Каталог с обложками и фото; пути в файле - относительно него')
+        parser.add_argument('--workers', type=int, default=8, help='Потоков для загрузки файлов')
+        parser.add_argument(
+            '--skip-recommendations', action='store_true',
+            help='Не пересчитывать похожие книги и новости (потом - rebuild_recommendations)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        fmt = options['format'] or detect_format(options['path'])
+        importer = Importer(
+            options['kind'], files_root=options['files'], workers=options['workers'],
+            batch_size=options['batch_size'], recommendations=not options['skip_recommendations'],
+        )
+        if options['path'] == '-':
+            created, updated, failed = importer.run(read_rows(sys.stdin, fmt))
+        else:
+            with open(options['path'], newline='', encoding='utf-8') as stream:
+                created, updated, failed = importer.run(read_rows(stream, fmt))
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {created}, обновлено: {updated}, пропущено строк: {failed} '
+            f'за {time.perf_counter() - started:.1f} с'
+        ))
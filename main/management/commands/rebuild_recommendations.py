@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main.models import RelatedBook, RelatedNews
+from main.recommendations import rebuild_all
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересчитывает похожие книги и новости'
+
+    def handle(self, *args, **options):
+        rebuild_all()
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожих книг: {RelatedBook.objects.count()}, новостей: {RelatedNews.objects.count()}'
+        ))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from main.outbox import deliver_batch
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из очереди (уведомления о сообщениях с сайта)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=50, help='Писем за одно SMTP-соединение')
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', type=float, default=5, help='Пауза между опросами, секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = deliver_batch(options['batch'])
+            if sent or failed:
+                self.stdout.write(f'Отправлено: {sent}, ошибок: {failed}')
+            if not options['loop']:
+                return
+            if sent + failed < options['batch']:
+                # Очередь пуста - ждем новых писем
+                time.sleep(options['interval'])
+            close_old_connections()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main.catalog import sync_catalog
+from main.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет записи каталога с книгами. Сигналы держат их в актуальном состоянии, '
+        'команда исправляет расхождения после массовых UPDATE и импорта; запускайте по расписанию.'
+    )
+
+    def handle(self, *args, **options):
+        written, removed = sync_catalog(Book.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'Записей каталога: {written}, удалено лишних: {removed}'))
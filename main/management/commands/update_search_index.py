@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Book, News
+from main.search import update_book_vectors, update_news_vectors
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает поисковые векторы книг и новостей'
+
+    def handle(self, *args, **options):
+        books = update_book_vectors(Book.objects.all())
+        news = update_news_vectors(News.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'Обновлено книг: {books}, новостей: {news}'))
@@ -0,0 +1,143 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+
+from . import instrumentation, routers, throttle
+from .assets import aserve_static, serve_static
+
+
+class InstrumentationMiddleware:
+    # Время запроса, SQL, шаблоны и изображения: в заголовок Server-Timing,
+    # в метрики /metrics/ и в лог для медленных запросов и N+1
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        instrumentation.install()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with instrumentation.collect() as stats:
+            response = self.get_response(request)
+        return self.finish(request, response, started, stats)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with instrumentation.collect() as stats:
+            response = await self.get_response(request)
+        return self.finish(request, response, started, stats)
+
+    def finish(self, request, response, started, stats):
+        duration = time.perf_counter() - started
+        response['Server-Timing'] = instrumentation.server_timing(duration, stats)
+        instrumentation.report(request, response, duration, stats)
+        return response
+
+
+class StaticFilesMiddleware:
+    # Собранная статика из STATIC_ROOT без nginx: готовые .br/.gz по
+    # Accept-Encoding и Cache-Control immutable для имен с хешем
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.STATIC_SERVE or not settings.STATIC_URL.startswith('/'):
+            raise MiddlewareNotUsed
+        self.prefix = settings.STATIC_URL
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.path_info.startswith(self.prefix):
+            return serve_static(request, request.path_info[len(self.prefix):])
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.path_info.startswith(self.prefix):
+            return await aserve_static(request, request.path_info[len(self.prefix):])
+        return await self.get_response(request)
+
+
+class ReplicaMiddleware:
+    # Публичные страницы читают с реплики (main/routers.py). Ответ на POST
+    # ставит cookie, и следующие DB_REPLICA_STICKY_SECONDS секунд клиент
+    # читает из основной базы - свое сообщение или правку он увидит сразу.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not routers.replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routers.reads_from(routers.replica_for(request)):
+            response = self.get_response(request)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        with routers.reads_from(routers.replica_for(request)):
+            response = await self.get_response(request)
+        return self.finish(request, response)
+
+    def finish(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(
+                routers.STICKY_COOKIE, '1', max_age=settings.DB_REPLICA_STICKY_SECONDS,
+                httponly=True, samesite='Lax', secure=request.is_secure(),
+            )
+        return response
+
+
+class ThrottleMiddleware:
+    # Ответ 429 клиенту, у которого кончились токены (main/throttle.py),
+    # до сессий, CSRF и представления
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.THROTTLE_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        limited = throttle.check(request)
+        if limited:
+            return self.too_many_requests(*limited)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        limited = await throttle.acheck(request)
+        if limited:
+            return self.too_many_requests(*limited)
+        return await self.get_response(request)
+
+    def too_many_requests(self, kind, retry_after):
+        response = HttpResponse(
+            f'Слишком много запросов. Повторите через {retry_after} с.',
+            status=429, content_type='text/plain; charset=utf-8',
+        )
+        response['Retry-After'] = str(retry_after)
+        response['Cache-Control'] = 'no-store'
+        return response
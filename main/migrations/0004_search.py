@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:54
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Заполнение векторов заморожено на момент миграции: main.search может
+# меняться дальше, а история миграций на чистой базе - нет. Тот же текст,
+# что индексировал main.search.update_book_vectors: палочка в любом
+# написании внутри кириллического слова - строчная ӏ, ё - е.
+PALOCHKA_PATTERN = r'(?<=[а-яёА-ЯЁӀӏ])[ӀIl1|]|[ӀIl1|](?=[а-яёА-ЯЁӀӏ])'
+
+
+def _vector(column, weight):
+    text = f"translate(regexp_replace(COALESCE({column}, ''), %(pattern)s, 'ӏ', 'g'), 'Ёё', 'Ее')"
+    return f"setweight(to_tsvector('russian'::regconfig, {text}), '{weight}')"
+
+
+def fill_search_vectors(apps, schema_editor):
+    params = {'pattern': PALOCHKA_PATTERN}
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE main_book b SET search_vector =
+                {_vector('b.title', 'A')} || {_vector('a.name', 'B')} || {_vector('b.description', 'C')}
+            FROM main_author a WHERE a.id = b.author_id
+        """, params)
+        cursor.execute(f"""
+            UPDATE main_news SET search_vector =
+                {_vector('title', 'A')} || {_vector('short_description', 'B')} || {_vector('content', 'C')}
+        """, params)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_contactmessage'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='news',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='author_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='book_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='news_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='news_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
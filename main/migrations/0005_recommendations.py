@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='main.book')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_to', to='main.book')),
+            ],
+            options={
+                'verbose_name': 'Похожая книга',
+                'verbose_name_plural': 'Похожие книги',
+                'indexes': [models.Index(fields=['book', '-score'], name='related_book_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'related'), name='unique_related_book')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RelatedNews',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('news', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='main.news')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_to', to='main.news')),
+            ],
+            options={
+                'verbose_name': 'Похожая новость',
+                'verbose_name_plural': 'Похожие новости',
+                'indexes': [models.Index(fields=['news', '-score'], name='related_news_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('news', 'related'), name='unique_related_news')],
+            },
+        ),
+    ]
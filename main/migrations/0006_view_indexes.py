@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['name'], name='author_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(condition=models.Q(('is_popular', True)), fields=['name'], name='author_popular_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['-publication_date', '-id'], name='book_available_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['title', 'id'], name='book_available_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['author', '-publication_date'], name='book_available_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactmessage',
+            index=models.Index(fields=['-created_at'], name='contact_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactmessage',
+            index=models.Index(fields=['is_processed', '-created_at'], name='contact_processed_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-publish_date'], name='news_published_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['category', '-publish_date'], name='news_published_category_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:22
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_catalog(apps, schema_editor):
+    # Заполнение заморожено на момент миграции, без main.catalog: его
+    # дальнейшие правки не должны менять историю миграций. Таблица только
+    # что создана, поэтому достаточно одного INSERT ... SELECT.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO main_catalogentry (
+                book_id, title, slug, author_id, author_name, author_slug, category_slugs,
+                cover_image, publication_date, is_bestseller, is_new
+            )
+            SELECT b.id, b.title, b.slug, b.author_id, a.name, a.slug,
+                   ARRAY(
+                       SELECT c.slug FROM main_book_categories bc
+                       JOIN main_category c ON c.id = bc.category_id
+                       WHERE bc.book_id = b.id ORDER BY c.slug
+                   ),
+                   b.cover_image, b.publication_date, b.is_bestseller, b.is_new
+            FROM main_book b JOIN main_author a ON a.id = b.author_id
+            WHERE b.is_available
+        """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_outboxemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogEntry',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='catalog_entry', serialize=False, to='main.book')),
+                ('title', models.CharField(max_length=200)),
+                ('slug', models.SlugField()),
+                ('author_name', models.CharField(max_length=200)),
+                ('author_slug', models.SlugField()),
+                ('category_slugs', django.contrib.postgres.fields.ArrayField(base_field=models.SlugField(), default=list, size=None)),
+                ('cover_image', models.ImageField(upload_to='books/covers/')),
+                ('publication_date', models.DateField()),
+                ('is_bestseller', models.BooleanField(default=False)),
+                ('is_new', models.BooleanField(default=False)),
+                ('author', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.author')),
+            ],
+            options={
+                'verbose_name': 'Запись каталога',
+                'verbose_name_plural': 'Записи каталога',
+                'ordering': ['-publication_date'],
+                'indexes': [models.Index(fields=['-publication_date', '-book'], name='catalog_new_idx'), models.Index(fields=['title', 'book'], name='catalog_title_idx'), models.Index(condition=models.Q(('is_bestseller', True)), fields=['-publication_date', '-book'], name='catalog_popular_idx'), models.Index(fields=['author', '-publication_date'], name='catalog_author_idx'), django.contrib.postgres.indexes.GinIndex(fields=['category_slugs'], name='catalog_categories_idx')],
+            },
+        ),
+        migrations.RunPython(fill_catalog, migrations.RunPython.noop),
+    ]
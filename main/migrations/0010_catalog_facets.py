@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['-is_bestseller', '-publication_date', '-book'], name='catalog_popular_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['author_slug', '-publication_date'], name='catalog_author_slug_idx'),
+        ),
+    ]
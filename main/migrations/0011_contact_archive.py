@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:46
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_catalog_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedContactMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Имя')),
+                ('email', models.EmailField(max_length=254, verbose_name='Email')),
+                ('phone', models.CharField(blank=True, max_length=20, verbose_name='Телефон')),
+                ('subject', models.CharField(choices=[('general', 'Общий вопрос'), ('cooperation', 'Сотрудничество'), ('manuscript', 'Отправка рукописи'), ('order', 'Заказ книг'), ('other', 'Другое')], max_length=20, verbose_name='Тема')),
+                ('message', models.TextField(verbose_name='Сообщение')),
+                ('agree_to_terms', models.BooleanField(verbose_name='Согласие на обработку данных')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания')),
+                ('email_status', models.CharField(blank=True, choices=[('pending', 'Ожидает отправки'), ('sent', 'Отправлено'), ('failed', 'Ошибка')], max_length=10, verbose_name='Уведомление')),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Перенесено в архив')),
+            ],
+            options={
+                'verbose_name': 'Архивное сообщение',
+                'verbose_name_plural': 'Архив сообщений',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='contactmessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='contact_name_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactmessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='gin_trgm_ops'), name='contact_email_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactmessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('message'), name='gin_trgm_ops'), name='contact_message_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedcontactmessage',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created_at'], name='contact_archive_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedcontactmessage',
+            index=models.Index(django.db.models.functions.text.Upper('email'), name='contact_archive_email_idx'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+# Пересчет заморожен на момент миграции, без main.recommendations: его
+# дальнейшие правки (веса, формулы, схема) не должны менять историю
+# миграций. Это полный пересчет rebuild_all: каждый объект получает
+# собственный список лучших соседей.
+RELATED_LIMIT = 12
+BATCH_SIZE = 500
+
+PARAMS = {
+    'category': 3.0, 'author': 2.0, 'recency': 1.0, 'days': 5 * 365, 'limit': RELATED_LIMIT,
+}
+
+BOOK_PAIRS = """
+    SELECT owner_id, other_id, SUM(shared) * %(category)s + MAX(same_author) * %(author)s AS base FROM (
+        SELECT oc.book_id AS owner_id, cc.book_id AS other_id, COUNT(*) AS shared, 0 AS same_author
+        FROM main_book_categories oc
+        JOIN main_book_categories cc ON cc.category_id = oc.category_id AND cc.book_id <> oc.book_id
+        WHERE oc.book_id = ANY(%(ids)s)
+        GROUP BY 1, 2
+        UNION ALL
+        SELECT o.id, c.id, 0, 1 FROM main_book o
+        JOIN main_book c ON c.author_id = o.author_id AND c.id <> o.id
+        WHERE o.id = ANY(%(ids)s)
+    ) pairs GROUP BY 1, 2
+"""
+
+NEWS_PAIRS = """
+    SELECT o.id AS owner_id, c.id AS other_id, %(category)s AS base FROM main_news o
+    JOIN main_news c ON c.category = o.category AND c.id <> o.id
+    WHERE o.id = ANY(%(ids)s)
+"""
+
+# (таблица, таблица соседей, столбец владельца, пары, видимость, дата)
+SOURCES = [
+    ('main_book', 'main_relatedbook', 'book_id', BOOK_PAIRS, 'c.is_available AND o.is_available',
+     'c.publication_date'),
+    ('main_news', 'main_relatednews', 'news_id', NEWS_PAIRS, 'c.is_published AND o.is_published',
+     '(c.publish_date AT TIME ZONE %(time_zone)s)::date'),
+]
+
+
+def fill_recommendations(apps, schema_editor):
+    # 0005 создала пустые таблицы: без этого у книг и новостей, сохраненных
+    # до нее, не будет похожих, пока кто-нибудь их не пересохранит
+    params = dict(PARAMS, today=timezone.localdate(), time_zone=settings.TIME_ZONE)
+    with schema_editor.connection.cursor() as cursor:
+        for table, related_table, owner_column, pairs, visible, date in SOURCES:
+            cursor.execute(f'SELECT id FROM {table} ORDER BY id')
+            ids = [row[0] for row in cursor.fetchall()]
+            for start in range(0, len(ids), BATCH_SIZE):
+                batch = dict(params, ids=ids[start:start + BATCH_SIZE])
+                cursor.execute(f'DELETE FROM {related_table} WHERE {owner_column} = ANY(%(ids)s)', batch)
+                cursor.execute(f"""
+                    WITH base AS ({pairs}),
+                    scored AS (
+                        SELECT b.owner_id, b.other_id,
+                               b.base + %(recency)s * GREATEST(0, 1 - (%(today)s - {date}) / %(days)s::float) AS forward
+                        FROM base b
+                        JOIN {table} o ON o.id = b.owner_id
+                        JOIN {table} c ON c.id = b.other_id
+                        WHERE {visible}
+                    )
+                    INSERT INTO {related_table} ({owner_column}, related_id, score)
+                    SELECT owner_id, other_id, forward FROM (
+                        SELECT owner_id, other_id, forward,
+                               ROW_NUMBER() OVER (PARTITION BY owner_id ORDER BY forward DESC, other_id) AS position
+                        FROM scored
+                    ) ranked WHERE position <= %(limit)s
+                """, batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_contact_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_recommendations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:29
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_fill_recommendations'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_available_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_available_title_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_available_author_idx',
+        ),
+    ]
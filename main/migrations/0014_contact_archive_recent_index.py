@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_drop_book_view_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedcontactmessage',
+            index=models.Index(fields=['-created_at', '-id'], name='contact_archive_recent_idx'),
+        ),
+    ]
@@ -1,11 +1,18 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex, GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
-from django.utils.text import slugify
+from django.db.models import Count
+from django.db.models.functions import Upper
 from django.utils import timezone
 
+from .slugs import generated_slug
+
 class Category(models.Model):
     name = models.CharField(max_length=100, verbose_name="Название")
     slug = models.SlugField(unique=True, verbose_name="URL")
     description = models.TextField(blank=True, verbose_name="Описание")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменено")
     
     class Meta:
         verbose_name = "Категория"
@@ -15,14 +22,14 @@ class Category(models.Model):
         return self.name
     
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        with generated_slug(self, self.name):
+            super().save(*args, **kwargs)
 
 class AuthorCategory(models.Model):
     name = models.CharField(max_length=100, verbose_name="Название")
     slug = models.SlugField(unique=True, verbose_name="URL")
     description = models.TextField(blank=True, verbose_name="Описание")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменено")
     
     class Meta:
         verbose_name = "Категория автора"
@@ -32,9 +39,19 @@ class AuthorCategory(models.Model):
         return self.name
     
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        with generated_slug(self, self.name):
+            super().save(*args, **kwargs)
+
+class AuthorQuerySet(models.QuerySet):
+    def popular(self):
+        return self.filter(is_popular=True)
+    
+    def with_book_count(self):
+        return self.annotate(book_count=Count('book', distinct=True))
+    
+    def for_cards(self):
+        # Карточки авторов показывают категории и число книг
+        return self.with_book_count().prefetch_related('categories')
 
 class Author(models.Model):
     name = models.CharField(max_length=200, verbose_name="Имя автора")
@@ -44,18 +61,49 @@ class Author(models.Model):
     birth_date = models.DateField(blank=True, null=True, verbose_name="Дата рождения")
     is_popular = models.BooleanField(default=False, verbose_name="Популярный автор")
     categories = models.ManyToManyField(AuthorCategory, blank=True, verbose_name="Категории")
+    # Для Last-Modified и ETag страниц, см. main/conditional.py
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Изменено")
+    
+    objects = AuthorQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Автор"
         verbose_name_plural = "Авторы"
+        indexes = [
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='author_name_trgm_idx'),
+            # Список авторов и популярные авторы, оба по имени
+            models.Index(fields=['name'], name='author_name_idx'),
+            models.Index(fields=['name'], condition=models.Q(is_popular=True), name='author_popular_name_idx'),
+        ]
     
     def __str__(self):
         return self.name
     
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        with generated_slug(self, self.name):
+            super().save(*args, **kwargs)
+
+class BookQuerySet(models.QuerySet):
+    def available(self):
+        return self.filter(is_available=True)
+    
+    def for_cards(self):
+        # Карточки книг выводят имя автора
+        return self.select_related('author')
+    
+    def for_detail(self):
+        return self.select_related('author').prefetch_related('categories')
+    
+    def recommended_for(self, book, limit=4):
+        # Соседи заранее посчитаны в main.recommendations
+        return self.available().for_cards().filter(
+            related_to__book=book
+        ).order_by('-related_to__score')[:limit]
+
+class BookManager(models.Manager.from_queryset(BookQuerySet)):
+    def get_queryset(self):
+        # Поисковый вектор нужен только в SQL, в Python его не загружаем
+        return super().get_queryset().defer('search_vector')
 
 class Book(models.Model):
     title = models.CharField(max_length=200, verbose_name="Название")
@@ -68,19 +116,41 @@ class Book(models.Model):
     is_available = models.BooleanField(default=True, verbose_name="Доступно")
     is_bestseller = models.BooleanField(default=False, verbose_name="Бестселлер")
     is_new = models.BooleanField(default=False, verbose_name="Новинка")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Изменено")
+    # Заполняется в main.signals, см. main.search.update_book_vectors
+    search_vector = SearchVectorField(null=True, editable=False)
+    
+    objects = BookManager()
     
     class Meta:
         verbose_name = "Книга"
         verbose_name_plural = "Книги"
         ordering = ['-publication_date']
+        indexes = [
+            GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='book_title_trgm_idx'),
+            # Списки и пагинация каталога читают CatalogEntry, см. его индексы
+        ]
     
     def __str__(self):
         return self.title
     
+    @property
+    def author_name(self):
+        # Как у CatalogEntry: карточки книг в шаблонах работают с обоими
+        return self.author.name
+    
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.title)
-        super().save(*args, **kwargs)
+        with generated_slug(self, self.title):
+            super().save(*args, **kwargs)
+
+class NewsQuerySet(models.QuerySet):
+    def published(self):
+        return self.filter(is_published=True)
+
+class NewsManager(models.Manager.from_queryset(NewsQuerySet)):
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
 
 class News(models.Model):
     NEWS_CATEGORIES = [
@@ -99,25 +169,116 @@ class News(models.Model):
     publish_date = models.DateTimeField(auto_now_add=True, verbose_name="Дата публикации")
     views_count = models.PositiveIntegerField(default=0, verbose_name="Количество просмотров")
     is_published = models.BooleanField(default=True, verbose_name="Опубликовано")
+    # Счетчик просмотров пишется через update() и время изменения не трогает
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Изменено")
+    # Заполняется в main.signals, см. main.search.update_news_vectors
+    search_vector = SearchVectorField(null=True, editable=False)
+    
+    objects = NewsManager()
     
     class Meta:
         verbose_name = "Новость"
         verbose_name_plural = "Новости"
         ordering = ['-publish_date']
+        indexes = [
+            GinIndex(fields=['search_vector'], name='news_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='news_title_trgm_idx'),
+            models.Index(
+                fields=['-publish_date'], condition=models.Q(is_published=True),
+                name='news_published_date_idx',
+            ),
+            models.Index(
+                fields=['category', '-publish_date'], condition=models.Q(is_published=True),
+                name='news_published_category_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.title
     
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.title)
-        super().save(*args, **kwargs)
+        with generated_slug(self, self.title):
+            super().save(*args, **kwargs)
+
+    def get_related_news(self, limit=3):
+        # Соседи заранее посчитаны в main.recommendations
+        return News.objects.published().filter(
+            related_to__news=self
+        ).order_by('-related_to__score')[:limit]
+    
+class RelatedBook(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='recommendations')
+    related = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='related_to')
+    score = models.FloatField()
+    
+    class Meta:
+        verbose_name = "Похожая книга"
+        verbose_name_plural = "Похожие книги"
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'related'], name='unique_related_book'),
+        ]
+        indexes = [
+            models.Index(fields=['book', '-score'], name='related_book_score_idx'),
+        ]
 
-    def get_related_news(self):
-        return News.objects.filter(
-            category=self.category,
-            is_published=True
-        ).exclude(id=self.id).order_by('-publish_date')[:3]
+class RelatedNews(models.Model):
+    news = models.ForeignKey(News, on_delete=models.CASCADE, related_name='recommendations')
+    related = models.ForeignKey(News, on_delete=models.CASCADE, related_name='related_to')
+    score = models.FloatField()
+    
+    class Meta:
+        verbose_name = "Похожая новость"
+        verbose_name_plural = "Похожие новости"
+        constraints = [
+            models.UniqueConstraint(fields=['news', 'related'], name='unique_related_news'),
+        ]
+        indexes = [
+            models.Index(fields=['news', '-score'], name='related_news_score_idx'),
+        ]
+    
+class CatalogEntry(models.Model):
+    # Плоская копия доступной книги для каталога, главной и страницы автора:
+    # все, что нужно карточке, лежит в одной строке без JOIN.
+    # Поддерживается из main.signals, сверяется командой sync_catalog.
+    book = models.OneToOneField(
+        Book, on_delete=models.CASCADE, primary_key=True, related_name='catalog_entry'
+    )
+    title = models.CharField(max_length=200)
+    slug = models.SlugField()
+    author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='+', db_index=False)
+    author_name = models.CharField(max_length=200)
+    author_slug = models.SlugField()
+    category_slugs = ArrayField(models.SlugField(), default=list)
+    # Имя файла обложки: URL и копии строит хранилище
+    cover_image = models.ImageField(upload_to='books/covers/')
+    publication_date = models.DateField()
+    is_bestseller = models.BooleanField(default=False)
+    is_new = models.BooleanField(default=False)
+    
+    class Meta:
+        verbose_name = "Запись каталога"
+        verbose_name_plural = "Записи каталога"
+        ordering = ['-publication_date']
+        indexes = [
+            # Ключи пагинации каталога (main.pagination)
+            models.Index(fields=['-publication_date', '-book'], name='catalog_new_idx'),
+            models.Index(fields=['title', 'book'], name='catalog_title_idx'),
+            models.Index(
+                fields=['-publication_date', '-book'], condition=models.Q(is_bestseller=True),
+                name='catalog_popular_idx',
+            ),
+            models.Index(
+                fields=['-is_bestseller', '-publication_date', '-book'], name='catalog_popular_order_idx',
+            ),
+            models.Index(fields=['author', '-publication_date'], name='catalog_author_idx'),
+            # Фильтр по авторам в каталоге и асинхронная страница автора
+            models.Index(fields=['author_slug', '-publication_date'], name='catalog_author_slug_idx'),
+            # category_slugs @> ARRAY['slug']: фильтр по категории без M2M и distinct
+            GinIndex(fields=['category_slugs'], name='catalog_categories_idx'),
+        ]
+    
+    def __str__(self):
+        return self.title
     
 class ContactMessage(models.Model):
     SUBJECT_CHOICES = [
@@ -141,6 +302,93 @@ class ContactMessage(models.Model):
         verbose_name = "Сообщение обратной связи"
         verbose_name_plural = "Сообщения обратной связи"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='contact_created_idx'),
+            models.Index(fields=['is_processed', '-created_at'], name='contact_processed_created_idx'),
+            # Поиск в админке: icontains строится как UPPER(поле) LIKE '%...%',
+            # триграммный индекс по тому же выражению обслуживает его без полного прохода
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='contact_name_trgm_idx'),
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'), name='contact_email_trgm_idx'),
+            GinIndex(OpClass(Upper('message'), name='gin_trgm_ops'), name='contact_message_trgm_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} - {self.get_subject_display()} - {self.created_at.strftime('%d.%m.%Y')}"
+
+class OutboxEmail(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает отправки'),
+        (STATUS_SENT, 'Отправлено'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+    
+    contact_message = models.ForeignKey(
+        ContactMessage, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='emails', verbose_name="Сообщение обратной связи"
+    )
+    subject = models.CharField(max_length=255, verbose_name="Тема")
+    body = models.TextField(verbose_name="Текст")
+    from_email = models.CharField(max_length=254, verbose_name="Отправитель")
+    recipients = models.TextField(verbose_name="Получатели", help_text="По одному адресу в строке")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Создано")
+    sent_at = models.DateTimeField(blank=True, null=True, verbose_name="Отправлено")
+    
+    class Meta:
+        verbose_name = "Исходящее письмо"
+        verbose_name_plural = "Исходящие письма"
+        ordering = ['-created_at']
+        indexes = [
+            # Очередь воркера: только неотправленные, по времени попытки
+            models.Index(
+                fields=['next_attempt_at'], condition=models.Q(status='pending'),
+                name='outbox_pending_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.subject} ({self.get_status_display()})"
+    
+    def recipient_list(self):
+        return [address for address in self.recipients.splitlines() if address]
+
+
+class ArchivedContactMessage(models.Model):
+    # Обработанные сообщения, перенесенные из рабочей таблицы командой
+    # archive_contact_messages. Первичный ключ - id исходного сообщения.
+    id = models.BigIntegerField(primary_key=True, verbose_name="ID")
+    name = models.CharField(max_length=100, verbose_name="Имя")
+    email = models.EmailField(verbose_name="Email")
+    phone = models.CharField(max_length=20, blank=True, verbose_name="Телефон")
+    subject = models.CharField(max_length=20, choices=ContactMessage.SUBJECT_CHOICES, verbose_name="Тема")
+    message = models.TextField(verbose_name="Сообщение")
+    agree_to_terms = models.BooleanField(verbose_name="Согласие на обработку данных")
+    created_at = models.DateTimeField(verbose_name="Дата создания")
+    email_status = models.CharField(
+        max_length=10, choices=OutboxEmail.STATUS_CHOICES, blank=True, verbose_name="Уведомление"
+    )
+    archived_at = models.DateTimeField(default=timezone.now, verbose_name="Перенесено в архив")
+    
+    class Meta:
+        verbose_name = "Архивное сообщение"
+        verbose_name_plural = "Архив сообщений"
+        ordering = ['-created_at']
+        indexes = [
+            # Строки добавляются по возрастанию даты: BRIN в сотни раз меньше
+            # B-tree, но годится только для выборок по диапазону дат
+            BrinIndex(fields=['created_at'], name='contact_archive_created_idx'),
+            # Для сортировки списка в админке: первая страница читается
+            # с начала индекса, без сортировки всего архива
+            models.Index(fields=['-created_at', '-id'], name='contact_archive_recent_idx'),
+            # Поиск по точному адресу (=email в админке - это iexact)
+            models.Index(Upper('email'), name='contact_archive_email_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.name} - {self.get_subject_display()} - {self.created_at.strftime('%d.%m.%Y')}"
\ No newline at end of file
+        return f"{self.name} - {self.get_subject_display()} - {self.created_at.strftime('%d.%m.%Y')}"
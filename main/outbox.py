@@ -0,0 +1,122 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+# Письмо, взятое воркером, снова становится доступным через это время,
+# если воркер упал и не записал результат
+CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+
+def backoff(attempts):
+    # 1, 2, 4, 8 ... минут, но не больше шести часов
+    return datetime.timedelta(minutes=min(2 ** (attempts - 1), 360))
+
+
+class NoRecipients(Exception):
+    pass
+
+
+def contact_recipients():
+    # CONTACT_EMAIL может содержать несколько адресов через запятую
+    return '\n'.join(address.strip() for address in (settings.CONTACT_EMAIL or '').split(',') if address.strip())
+
+
+def enqueue_contact_notification(contact_message):
+    return OutboxEmail.objects.create(
+        contact_message=contact_message,
+        subject=f'Новое сообщение: {contact_message.get_subject_display()}',
+        body=f'''
+Имя: {contact_message.name}
+Email: {contact_message.email}
+Телефон: {contact_message.phone or "Не указан"}
+Тема: {contact_message.get_subject_display()}
+Сообщение:
+{contact_message.message}
+
+Дата: {timezone.localtime(contact_message.created_at).strftime("%d.%m.%Y %H:%M")}
+''',
+        from_email=settings.DEFAULT_FROM_EMAIL or '',
+        recipients=contact_recipients(),
+    )
+
+
+def claim_batch(limit):
+    # Забираем письма, пропуская строки, уже заблокированные другим воркером
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:limit]
+        )
+        for email in emails:
+            email.attempts += 1
+            email.next_attempt_at = now + CLAIM_TIMEOUT
+        OutboxEmail.objects.bulk_update(emails, ['attempts', 'next_attempt_at'])
+    return emails
+
+
+def deliver_batch(limit=50):
+    emails = claim_batch(limit)
+    if not emails:
+        return 0, 0
+
+    sent = failed = 0
+    # Одно SMTP-соединение на всю пачку
+    connection = get_connection(fail_silently=False, timeout=settings.EMAIL_TIMEOUT)
+    try:
+        connection.open()
+    except Exception as error:
+        for email in emails:
+            _record_failure(email, error)
+        return 0, len(emails)
+
+    try:
+        for email in emails:
+            if not email.recipient_list():
+                # Без адресов send() ничего не отправляет: письмо ждет, пока
+                # CONTACT_EMAIL не настроят, и после MAX_ATTEMPTS помечается ошибкой
+                email.recipients = contact_recipients()
+                if not email.recipients:
+                    _record_failure(email, NoRecipients('не заданы получатели, проверьте CONTACT_EMAIL'))
+                    failed += 1
+                    continue
+                email.save(update_fields=['recipients'])
+            message = EmailMessage(
+                subject=email.subject, body=email.body,
+                from_email=email.from_email or None, to=email.recipient_list(),
+                connection=connection,
+            )
+            try:
+                message.send()
+            except Exception as error:
+                _record_failure(email, error)
+                failed += 1
+            else:
+                email.status = OutboxEmail.STATUS_SENT
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                email.save(update_fields=['status', 'sent_at', 'last_error'])
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _record_failure(email, error):
+    logger.warning('Не удалось отправить письмо %s (попытка %s): %s', email.pk, email.attempts, error)
+    email.last_error = f'{type(error).__name__}: {error}'
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutboxEmail.STATUS_FAILED
+    else:
+        email.next_attempt_at = timezone.now() + backoff(email.attempts)
+    email.save(update_fields=['status', 'next_attempt_at', 'last_error'])
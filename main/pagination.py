@@ -0,0 +1,108 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+CATALOG_PAGE_SIZE = 24
+
+# Порядок выдачи каталога для каждого варианта сортировки.
+# Последним полем всегда идет первичный ключ, чтобы ключ был уникальным.
+CATALOG_ORDERINGS = {
+    'new': ('-publication_date', '-pk'),
+    # Сначала бестселлеры, затем остальные книги по дате
+    'popular': ('-is_bestseller', '-publication_date', '-pk'),
+    'title': ('title', 'pk'),
+}
+
+
+def encode_cursor(obj, ordering):
+    values = []
+    for field in ordering:
+        value = getattr(obj, field.lstrip('-'))
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        values.append(value)
+    raw = json.dumps(values, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, ordering, model):
+    # Курсор приходит от клиента: неверный или подделанный курсор - это
+    # первая страница, а не ошибка базы при сравнении
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    try:
+        return [_clean(model, field.lstrip('-'), value) for field, value in zip(ordering, values)]
+    except (ValidationError, TypeError, ValueError):
+        return None
+
+
+def _clean(model, name, value):
+    field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+    if field.is_relation:
+        # pk CatalogEntry - связь с книгой. Курсору нужна только величина
+        # для сравнения: книга-якорь могла быть удалена, это не ошибка
+        field = field.target_field
+    # Приведение типа и проверка диапазона (например, bigint) без запросов
+    value = field.to_python(value)
+    field.run_validators(value)
+    if value is None or isinstance(value, str) and '\x00' in value:
+        raise ValueError(name)
+    return value
+
+
+def _after_cursor(ordering, values):
+    # Условие "строго после курсора" для составного ключа:
+    # (a > x) OR (a = x AND b > y) OR ...
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = '__lt' if field.startswith('-') else '__gt'
+        condition |= Q(**equal, **{name + lookup: value})
+        equal[name] = value
+    return condition
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=CATALOG_PAGE_SIZE):
+    queryset = queryset.order_by(*ordering)
+    values = decode_cursor(cursor, ordering, queryset.model)
+    if values is not None:
+        queryset = queryset.filter(_after_cursor(ordering, values))
+
+    # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(items[-1], ordering)
+    return items, next_cursor
+
+
+class EstimatedCountPaginator(Paginator):
+    # Для списков в админке по большим таблицам. Точный COUNT(*) - полный
+    # проход по таблице или индексу, поэтому считаем не дальше EXACT_LIMIT
+    # строк; если строк больше, берем оценку планировщика PostgreSQL.
+    EXACT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        queryset = queryset.order_by()
+        exact = queryset.values('pk')[:self.EXACT_LIMIT + 1].count()
+        if exact <= self.EXACT_LIMIT:
+            return exact
+        plan = json.loads(queryset.explain(format='json'))
+        return max(exact, int(plan[0]['Plan']['Plan Rows']))
@@ -0,0 +1,208 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+# Сколько соседей храним на объект. На странице показываем меньше,
+# запас нужен, чтобы список не пустел между полными пересчетами.
+RELATED_LIMIT = 12
+# Во сколько чужих списков объект попадает за один пересчет. Новая книга
+# в большой категории могла бы обойти последних соседей у тысяч книг;
+# остальные списки догонит полный пересчет (manage.py rebuild_recommendations).
+INCOMING_LIMIT = 10 * RELATED_LIMIT
+# Объектов в одном запросе пересчета
+BATCH_SIZE = 500
+
+CATEGORY_WEIGHT = 3.0
+AUTHOR_WEIGHT = 2.0
+RECENCY_WEIGHT = 1.0
+# За сколько дней бонус за свежесть падает до нуля
+RECENCY_DAYS = 5 * 365
+
+
+class Source:
+    # Таблицы и выражения для SQL пересчета: пары кандидатов с базовой
+    # оценкой (общие категории, автор) и дата для бонуса за свежесть
+    def __init__(self, table, related_table, owner_column, pairs, visible, date):
+        self.table = table
+        self.related_table = related_table
+        self.owner_column = owner_column
+        self.pairs = pairs
+        self.visible = visible
+        self.date = date
+
+
+BOOKS = Source(
+    'main_book', 'main_relatedbook', 'book_id',
+    pairs="""
+        SELECT owner_id, other_id, SUM(shared) * %(category)s + MAX(same_author) * %(author)s AS base FROM (
+            SELECT oc.book_id AS owner_id, cc.book_id AS other_id, COUNT(*) AS shared, 0 AS same_author
+            FROM main_book_categories oc
+            JOIN main_book_categories cc ON cc.category_id = oc.category_id AND cc.book_id <> oc.book_id
+            WHERE oc.book_id = ANY(%(ids)s)
+            GROUP BY 1, 2
+            UNION ALL
+            SELECT o.id, c.id, 0, 1 FROM main_book o
+            JOIN main_book c ON c.author_id = o.author_id AND c.id <> o.id
+            WHERE o.id = ANY(%(ids)s)
+        ) pairs GROUP BY 1, 2
+    """,
+    visible='{alias}.is_available',
+    date='{alias}.publication_date',
+)
+
+NEWS = Source(
+    'main_news', 'main_relatednews', 'news_id',
+    pairs="""
+        SELECT o.id AS owner_id, c.id AS other_id, %(category)s AS base FROM main_news o
+        JOIN main_news c ON c.category = o.category AND c.id <> o.id
+        WHERE o.id = ANY(%(ids)s)
+    """,
+    visible='{alias}.is_published',
+    date='({alias}.publish_date AT TIME ZONE %(time_zone)s)::date',
+)
+
+
+def _scored(source):
+    # forward - вес соседа в списке объекта, backward - вес объекта в списке
+    # соседа: базовая оценка пары симметрична, бонус за свежесть - у того,
+    # кого показывают
+    def bonus(alias):
+        date = source.date.format(alias=alias)
+        return f'%(recency)s * GREATEST(0, 1 - (%(today)s - {date}) / %(days)s::float)'
+
+    return f"""
+        WITH base AS ({source.pairs}),
+        scored AS (
+            SELECT b.owner_id, b.other_id, b.base + {bonus('c')} AS forward, b.base + {bonus('o')} AS backward
+            FROM base b
+            JOIN {source.table} o ON o.id = b.owner_id
+            JOIN {source.table} c ON c.id = b.other_id
+            WHERE {source.visible.format(alias='o')} AND {source.visible.format(alias='c')}
+        )
+    """
+
+
+def _params(ids, **extra):
+    return {
+        'ids': list(ids), 'category': CATEGORY_WEIGHT, 'author': AUTHOR_WEIGHT,
+        'recency': RECENCY_WEIGHT, 'days': RECENCY_DAYS, 'today': timezone.localdate(),
+        'time_zone': settings.TIME_ZONE, 'limit': RELATED_LIMIT, **extra,
+    }
+
+
+def _replace_own(cursor, source, ids):
+    # Собственные списки объектов пересобираются целиком: первые
+    # RELATED_LIMIT соседей отбирает сам запрос
+    cursor.execute(f'DELETE FROM {source.related_table} WHERE {source.owner_column} = ANY(%(ids)s)', _params(ids))
+    cursor.execute(f"""
+        {_scored(source)}
+        INSERT INTO {source.related_table} ({source.owner_column}, related_id, score)
+        SELECT owner_id, other_id, forward FROM (
+            SELECT owner_id, other_id, forward,
+                   ROW_NUMBER() OVER (PARTITION BY owner_id ORDER BY forward DESC, other_id) AS position
+            FROM scored
+        ) ranked WHERE position <= %(limit)s
+    """, _params(ids))
+
+
+def _update_incoming(cursor, source, ids):
+    # В чужой список объект попадает, только если обходит его последнего,
+    # RELATED_LIMIT-го соседа; уже стоящие в списках записи сохраняются
+    # в первую очередь. Пишутся только новые записи и изменившиеся оценки.
+    related, owner = source.related_table, source.owner_column
+    cursor.execute(f"""
+        {_scored(source)},
+        thresholds AS (
+            -- Порог считается один раз на список, а не на каждую пару
+            SELECT lists.list_id, threshold.score FROM (
+                SELECT DISTINCT other_id AS list_id FROM scored WHERE NOT (other_id = ANY(%(ids)s))
+            ) lists
+            LEFT JOIN LATERAL (
+                SELECT r.score FROM {related} r
+                WHERE r.{owner} = lists.list_id AND NOT (r.related_id = ANY(%(ids)s))
+                ORDER BY r.score DESC OFFSET %(limit)s - 1 LIMIT 1
+            ) threshold ON TRUE
+        )
+        SELECT list_id, related_id, score, current FROM (
+            SELECT s.other_id AS list_id, s.owner_id AS related_id, s.backward AS score, existing.score AS current,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY s.owner_id ORDER BY existing.score IS NULL, s.backward DESC, s.other_id
+                   ) AS position
+            FROM scored s
+            JOIN thresholds t ON t.list_id = s.other_id
+            LEFT JOIN {related} existing ON existing.{owner} = s.other_id AND existing.related_id = s.owner_id
+            WHERE t.score IS NULL OR s.backward > t.score
+        ) ranked WHERE position <= %(incoming)s
+    """, _params(ids, incoming=INCOMING_LIMIT))
+    rows = cursor.fetchall()
+
+    # Из остальных чужих списков объект убирается
+    cursor.execute(f"""
+        DELETE FROM {related} r
+        WHERE r.related_id = ANY(%(ids)s) AND NOT (r.{owner} = ANY(%(ids)s))
+          AND NOT EXISTS (
+              SELECT 1 FROM unnest(%(lists)s::bigint[], %(kept)s::bigint[]) AS kept(list_id, related_id)
+              WHERE kept.list_id = r.{owner} AND kept.related_id = r.related_id
+          )
+    """, _params(ids, lists=[row[0] for row in rows], kept=[row[1] for row in rows]))
+
+    changed = [row for row in rows if row[2] != row[3]]
+    if changed:
+        cursor.execute(f"""
+            INSERT INTO {related} ({owner}, related_id, score)
+            SELECT * FROM unnest(%(lists)s::bigint[], %(kept)s::bigint[], %(scores)s::float8[])
+            ON CONFLICT ({owner}, related_id) DO UPDATE SET score = EXCLUDED.score
+        """, _params(
+            ids, lists=[row[0] for row in changed], kept=[row[1] for row in changed],
+            scores=[row[2] for row in changed],
+        ))
+    _trim(cursor, source, sorted({row[0] for row in changed if row[3] is None}))
+
+
+def _trim(cursor, source, list_ids):
+    # Только списки, куда добавлена новая запись: в них могло стать
+    # RELATED_LIMIT + 1 соседей
+    if not list_ids:
+        return
+    cursor.execute(f"""
+        DELETE FROM {source.related_table} WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY {source.owner_column} ORDER BY score DESC, related_id
+                ) AS position
+                FROM {source.related_table} WHERE {source.owner_column} = ANY(%(lists)s)
+            ) ranked WHERE position > %(limit)s
+        )
+    """, _params([], lists=list_ids))
+
+
+def _rebuild(source, ids, using):
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            _replace_own(cursor, source, batch)
+            _update_incoming(cursor, source, batch)
+
+
+def rebuild_related_books(book_ids, using=DEFAULT_DB_ALIAS):
+    # Пересчет для набора книг одними и теми же запросами, сколько бы
+    # книг ни было: после сохранения одной книги, массового действия
+    # в админке или импорта
+    _rebuild(BOOKS, book_ids, using)
+
+
+def rebuild_related_news(news_ids, using=DEFAULT_DB_ALIAS):
+    _rebuild(NEWS, news_ids, using)
+
+
+def rebuild_all(using=DEFAULT_DB_ALIAS):
+    # Полный пересчет: каждый объект получает собственный список заново,
+    # поэтому обновлять чужие списки не нужно
+    for source in (BOOKS, NEWS):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {source.table} ORDER BY id')
+            ids = [row[0] for row in cursor.fetchall()]
+        for start in range(0, len(ids), BATCH_SIZE):
+            with transaction.atomic(using=using), connections[using].cursor() as cursor:
+                _replace_own(cursor, source, ids[start:start + BATCH_SIZE])
@@ -0,0 +1,74 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.urls import Resolver404, resolve
+
+from .cache import bumped_within
+
+# Чтение с реплик. Роутер Django знает только модель, а не страницу,
+# поэтому реплику для запроса выбирает ReplicaMiddleware (main/middleware.py)
+# и передает ее роутеру через переменную контекста: она видна и в потоках
+# sync_to_async асинхронных представлений. Вне такого запроса - в админке,
+# командах manage.py, при POST - все запросы идут в основную базу.
+
+# Публичные страницы сайта только читают; просмотры новостей пишутся
+# в основную базу через db_for_write
+REPLICA_VIEW_MODULES = ('main.views', 'main.async_views', 'main.feeds')
+# Клиент, который только что что-то отправил, читает из основной базы
+STICKY_COOKIE = 'db_primary'
+# Запись меняет версию кеша страниц в основной базе сразу, а реплика
+# догоняет ее с отставанием. Страница, собранная в это время на реплике,
+# легла бы в кеш под новой версией со старыми данными (вместе с ETag)
+# и жила бы там до следующей записи. Поэтому DB_REPLICA_STICKY_SECONDS
+# секунд после смены версии все читают из основной базы.
+
+_read_database = ContextVar('read_database', default=None)
+
+
+def replicas():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+@contextmanager
+def reads_from(alias):
+    # None - основная база
+    token = _read_database.set(alias)
+    try:
+        yield
+    finally:
+        _read_database.reset(token)
+
+
+def replica_for(request):
+    # Одна реплика на весь запрос, чтобы страница не собиралась из реплик
+    # с разным отставанием
+    names = replicas()
+    if not names or request.method not in ('GET', 'HEAD') or STICKY_COOKIE in request.COOKIES:
+        return None
+    if bumped_within(settings.DB_REPLICA_STICKY_SECONDS):
+        return None
+    try:
+        match = resolve(request.path_info, getattr(request, 'urlconf', None))
+    except Resolver404:
+        return None
+    if match.func.__module__ not in REPLICA_VIEW_MODULES:
+        return None
+    return random.choice(names)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_database.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии основной базы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,104 @@
+import re
+
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity,
+)
+from django.db.models import F, Func, OuterRef, Q, Subquery, TextField, Value
+
+SEARCH_CONFIG = 'russian'
+MIN_QUERY_LENGTH = 2
+
+# Адыгейская палочка (Ӏ) на клавиатуре набирается как угодно: латинская
+# I или l, цифра 1, вертикальная черта. Внутри кириллического слова все
+# эти варианты приводим к строчной ӏ, а ё - к е. Один и тот же шаблон
+# применяется к запросу в Python и к индексируемому тексту в PostgreSQL.
+PALOCHKA_PATTERN = r'(?<=[а-яёА-ЯЁӀӏ])[ӀIl1|]|[ӀIl1|](?=[а-яёА-ЯЁӀӏ])'
+PALOCHKA = 'ӏ'
+
+_palochka_re = re.compile(PALOCHKA_PATTERN)
+
+
+def normalize_text(text):
+    text = _palochka_re.sub(PALOCHKA, text.strip())
+    return text.replace('Ё', 'Е').replace('ё', 'е')
+
+
+def _normalize_sql(expression):
+    text = Func(expression, Value(''), function='COALESCE', output_field=TextField())
+    replaced = Func(
+        text, Value(PALOCHKA_PATTERN), Value(PALOCHKA), Value('g'),
+        function='regexp_replace', output_field=TextField(),
+    )
+    return Func(replaced, Value('Ёё'), Value('Ее'), function='translate', output_field=TextField())
+
+
+def _vector(expression, weight):
+    return SearchVector(_normalize_sql(expression), weight=weight, config=SEARCH_CONFIG)
+
+
+def update_book_vectors(books):
+    # Имя автора берется подзапросом, чтобы обновлять книги одним UPDATE
+    author_model = books.model._meta.get_field('author').related_model
+    author_name = Subquery(
+        author_model.objects.filter(pk=OuterRef('author_id')).values('name')[:1]
+    )
+    return books.update(search_vector=(
+        _vector(F('title'), 'A')
+        + _vector(author_name, 'B')
+        + _vector(F('description'), 'C')
+    ))
+
+
+def update_news_vectors(news):
+    return news.update(search_vector=(
+        _vector(F('title'), 'A')
+        + _vector(F('short_description'), 'B')
+        + _vector(F('content'), 'C')
+    ))
+
+
+def search_query(text):
+    return SearchQuery(normalize_text(text), config=SEARCH_CONFIG, search_type='websearch')
+
+
+def filter_books(books, text):
+    # Полнотекстовое совпадение или похожее название (опечатки).
+    # Оба условия обслуживаются GIN-индексами.
+    return books.filter(
+        Q(search_vector=search_query(text))
+        | Q(title__trigram_word_similar=normalize_text(text))
+    )
+
+
+def _ranked(queryset, text, trigram_field, limit):
+    query = search_query(text)
+    results = list(
+        queryset.filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', '-id')[:limit]
+    )
+    if results:
+        return results
+    # Ничего не нашлось - вероятно, опечатка. Ищем по триграммам.
+    return _similar(queryset, text, trigram_field, limit)
+
+
+def _similar(queryset, text, field, limit):
+    text = normalize_text(text)
+    return list(
+        queryset.filter(**{field + '__trigram_word_similar': text})
+        .annotate(rank=TrigramWordSimilarity(text, field))
+        .order_by('-rank', '-id')[:limit]
+    )
+
+
+def search_books(books, text, limit):
+    return _ranked(books, text, 'title', limit)
+
+
+def search_news(news, text, limit):
+    return _ranked(news, text, 'title', limit)
+
+
+def search_authors(authors, text, limit):
+    return _similar(authors, text, 'name', limit)
@@ -0,0 +1,194 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_cache_version
+from .catalog import refresh_catalog
+from .conditional import mark_structure_changed
+from .images import delete_derivatives, get_derivatives
+from .models import Author, AuthorCategory, Book, CatalogEntry, Category, News
+from .recommendations import rebuild_related_books, rebuild_related_news
+from .search import update_book_vectors, update_news_vectors
+
+BOOK_SEARCH_FIELDS = {'title', 'description', 'author'}
+AUTHOR_SEARCH_FIELDS = {'name'}
+NEWS_SEARCH_FIELDS = {'title', 'short_description', 'content'}
+BOOK_RELATED_FIELDS = {'author', 'publication_date', 'is_available'}
+NEWS_RELATED_FIELDS = {'category', 'publish_date', 'is_published'}
+CATALOG_BOOK_FIELDS = {
+    'title', 'slug', 'author', 'cover_image', 'publication_date', 'is_available', 'is_bestseller', 'is_new',
+}
+CATALOG_AUTHOR_FIELDS = {'name', 'slug'}
+
+
+def _touches(update_fields, fields):
+    # save(update_fields=[...]) без текстовых полей вектор не меняет
+    return update_fields is None or bool(fields & set(update_fields))
+
+
+@receiver(post_save, sender=Book)
+def update_book_search(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and _touches(update_fields, BOOK_SEARCH_FIELDS):
+        update_book_vectors(Book.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Author)
+def update_author_books_search(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Имя автора входит в поисковый вектор каждой его книги
+    if not raw and _touches(update_fields, AUTHOR_SEARCH_FIELDS):
+        update_book_vectors(Book.objects.filter(author=instance))
+
+
+@receiver(post_save, sender=News)
+def update_news_search(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and _touches(update_fields, NEWS_SEARCH_FIELDS):
+        update_news_vectors(News.objects.filter(pk=instance.pk))
+
+
+# Записи каталога обновляются сразу, в той же транзакции, что и книга.
+# Удаление книги или автора удаляет их каскадом.
+@receiver(post_save, sender=Book)
+def update_catalog_entry(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and _touches(update_fields, CATALOG_BOOK_FIELDS):
+        refresh_catalog(Book.objects.filter(pk=instance.pk))
+
+
+@receiver(m2m_changed, sender=Book.categories.through)
+def update_catalog_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # category.book_set.clear() не передает pk_set: берем книги из каталога
+        if pk_set is None:
+            books = Book.objects.filter(pk__in=CatalogEntry.objects.filter(
+                category_slugs__contains=[instance.slug]).values('pk'))
+        else:
+            books = Book.objects.filter(pk__in=pk_set)
+    else:
+        books = Book.objects.filter(pk=instance.pk)
+    refresh_catalog(books)
+
+
+@receiver(post_save, sender=Author)
+def update_catalog_author(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and _touches(update_fields, CATALOG_AUTHOR_FIELDS):
+        CatalogEntry.objects.filter(author=instance).update(author_name=instance.name, author_slug=instance.slug)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def update_catalog_category_slug(sender, instance, raw=False, **kwargs):
+    # Записи и со старым slug категории, и с ее книгами
+    if raw:
+        return
+    refresh_catalog(Book.objects.filter(
+        Q(categories=instance) | Q(pk__in=CatalogEntry.objects.filter(
+            category_slugs__contains=[instance.slug]).values('pk'))
+    ).distinct())
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=News)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=AuthorCategory)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=News)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=AuthorCategory)
+@receiver(m2m_changed, sender=Book.categories.through)
+@receiver(m2m_changed, sender=Author.categories.through)
+def invalidate_page_cache(sender, **kwargs):
+    if kwargs.get('raw'):
+        return
+    if kwargs.get('action', 'post_').startswith('post_'):
+        bump_cache_version()
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=News)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=AuthorCategory)
+@receiver(m2m_changed, sender=Book.categories.through)
+@receiver(m2m_changed, sender=Author.categories.through)
+def invalidate_http_validators(sender, **kwargs):
+    # Эти изменения не видны в updated_at, см. main/conditional.py
+    if kwargs.get('action', 'post_').startswith('post_'):
+        mark_structure_changed()
+
+
+# Похожие книги и новости пересчитываются после коммита: к этому моменту
+# админка уже сохранила и категории книги
+def _rebuild_related_books(book_ids):
+    # Списки похожих книг меняются и на страницах других книг
+    rebuild_related_books(book_ids)
+    mark_structure_changed()
+
+
+@receiver(post_save, sender=Book)
+def update_related_books(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and _touches(update_fields, BOOK_RELATED_FIELDS):
+        transaction.on_commit(lambda: _rebuild_related_books([instance.pk]))
+
+
+@receiver(m2m_changed, sender=Book.categories.through)
+def update_related_books_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # category.book_set.add(...) меняет сразу несколько книг
+        book_ids = list(pk_set or ())
+    else:
+        book_ids = [instance.pk]
+    transaction.on_commit(lambda: _rebuild_related_books(book_ids))
+
+
+@receiver(post_save, sender=News)
+def update_related_news(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and _touches(update_fields, NEWS_RELATED_FIELDS):
+        transaction.on_commit(lambda: rebuild_related_news([instance.pk]))
+
+
+IMAGE_FIELDS = {Book: 'cover_image', Author: 'photo', News: 'image'}
+
+
+@receiver(pre_save, sender=Book)
+@receiver(pre_save, sender=Author)
+@receiver(pre_save, sender=News)
+def remember_replaced_image(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Прежнее изображение, если его заменяют: его копии удалим после сохранения
+    field = IMAGE_FIELDS[sender]
+    if raw or instance._state.adding or not _touches(update_fields, {field}):
+        return
+    previous = sender._base_manager.filter(pk=instance.pk).values_list(field, flat=True).first()
+    image = getattr(instance, field)
+    # Новый файл еще не записан в хранилище и может получить то же имя
+    if previous and (previous != image.name or not image._committed):
+        instance._replaced_image = previous
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=News)
+def build_image_derivatives(sender, instance, raw=False, update_fields=None, **kwargs):
+    field = IMAGE_FIELDS[sender]
+    image = getattr(instance, field)
+    previous = instance.__dict__.pop('_replaced_image', None)
+    if previous:
+        transaction.on_commit(lambda: delete_derivatives(previous))
+    if raw or not image or not _touches(update_fields, {field}):
+        return
+    # Копии строим сразу после загрузки, чтобы первый посетитель их не ждал
+    transaction.on_commit(lambda: get_derivatives(image.name))
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=News)
+def remove_image_derivatives(sender, instance, **kwargs):
+    image = getattr(instance, IMAGE_FIELDS[sender])
+    if image:
+        transaction.on_commit(lambda: delete_derivatives(image.name))
@@ -0,0 +1,175 @@
+import hashlib
+from itertools import islice
+from xml.sax.saxutils import escape
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Max
+from django.urls import reverse
+from django.utils.encoding import iri_to_uri
+
+from .cache import get_cache_version
+from .models import Author, Book, News
+
+# sitemap.xml для поисковых роботов: индекс и части по SHARD_SIZE адресов
+# (протокол разрешает до 50 000). Части нарезаются по диапазонам
+# первичного ключа: часть n - строки с pk от n * SHARD_SIZE, поэтому
+# каждая читается по индексу первичного ключа, а индекс собирается одним
+# GROUP BY на раздел. Часть не загружается в память целиком: строки идут
+# через серверный курсор (iterator) и сразу уходят клиенту, а готовый
+# текст остается в кеше до следующего изменения данных.
+
+SHARD_SIZE = 10000
+# Номер части, за которым pk вышел бы за пределы bigint
+MAX_SHARD = (2 ** 63 - 1) // SHARD_SIZE
+CHUNK_SIZE = 2000
+CONTENT_TYPE = 'application/xml; charset=utf-8'
+
+# Раздел: (строки, маршрут страницы)
+SECTIONS = {
+    'books': (lambda: Book.objects.available(), 'book_detail'),
+    'authors': (lambda: Author.objects.all(), 'author_detail'),
+    'news': (lambda: News.objects.published(), 'news_detail'),
+}
+# Страницы без slug - отдельная часть pages-0
+PAGES = ['index', 'catalog', 'authors', 'news', 'about', 'contacts']
+
+HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+FOOTER = '</urlset>\n'
+
+
+def base_url(request):
+    return request.build_absolute_uri('/').rstrip('/')
+
+
+def _lastmod(value):
+    return f'<lastmod>{value.isoformat(timespec="seconds")}</lastmod>' if value else ''
+
+
+def shards(section):
+    # [(номер части, самое позднее updated_at в ней)]
+    queryset, _ = SECTIONS[section]
+    rows = (
+        queryset().order_by().annotate(shard=F('pk') / SHARD_SIZE)
+        .values('shard').annotate(lastmod=Max('updated_at')).order_by('shard')
+    )
+    return [(row['shard'], row['lastmod']) for row in rows]
+
+
+def index_xml(base):
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n',
+        f'<sitemap><loc>{escape(base + reverse("sitemap_section", args=["pages", 0]))}</loc></sitemap>\n',
+    ]
+    for section in SECTIONS:
+        for shard, lastmod in shards(section):
+            loc = escape(base + reverse('sitemap_section', args=[section, shard]))
+            lines.append(f'<sitemap><loc>{loc}</loc>{_lastmod(lastmod)}</sitemap>\n')
+    lines.append('</sitemapindex>\n')
+    return ''.join(lines)
+
+
+def pages_xml(base):
+    return HEADER + ''.join(
+        f'<url><loc>{escape(base + reverse(name))}</loc></url>\n' for name in PAGES
+    ) + FOOTER
+
+
+def shard_rows(section, shard):
+    queryset, _ = SECTIONS[section]
+    return (
+        queryset().filter(pk__gte=shard * SHARD_SIZE, pk__lt=(shard + 1) * SHARD_SIZE)
+        .order_by('pk').values_list('slug', 'updated_at')
+    )
+
+
+def shard_exists(section, shard):
+    # Потоковый ответ уже не сменит статус на 404, поэтому пустую часть
+    # (номер за последней) проверяем заранее: чтение одной строки по индексу pk
+    return shard <= MAX_SHARD and shard_rows(section, shard).exists()
+
+
+def bound_rows(section, shard):
+    # Строки читаются уже после выхода из представления, когда
+    # ReplicaMiddleware вернул чтение в основную базу: базу выбираем сейчас
+    rows = shard_rows(section, shard)
+    return rows.using(rows.db)
+
+
+async def aiterate(rows, chunk_size=CHUNK_SIZE):
+    # QuerySet.aiterator() для values_list выполняет запрос прямо в цикле
+    # событий и падает с SynchronousOnlyOperation. Читаем тот же серверный
+    # курсор порциями в потоке: все порции - в одном потоке и соединении.
+    iterator = rows.iterator(chunk_size=chunk_size)
+    fetch = sync_to_async(lambda: list(islice(iterator, chunk_size)))
+    while chunk := await fetch():
+        for row in chunk:
+            yield row
+
+
+def _url_prefix(base, section):
+    # reverse() один раз на часть, а не на каждую из тысяч строк
+    _, route = SECTIONS[section]
+    prefix, _, suffix = reverse(route, args=['slug']).rpartition('slug')
+    return escape(base + prefix), escape(suffix)
+
+
+def _entries(prefix, suffix, rows):
+    return ''.join(
+        f'<url><loc>{prefix}{escape(iri_to_uri(slug))}{suffix}</loc>{_lastmod(updated_at)}</url>\n'
+        for slug, updated_at in rows
+    )
+
+
+def shard_xml(base, section, rows):
+    # Куски ответа по CHUNK_SIZE адресов
+    prefix, suffix = _url_prefix(base, section)
+    yield HEADER
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            yield _entries(prefix, suffix, chunk)
+            chunk = []
+    yield _entries(prefix, suffix, chunk) + FOOTER
+
+
+async def ashard_xml(base, section, rows):
+    prefix, suffix = _url_prefix(base, section)
+    yield HEADER
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            yield _entries(prefix, suffix, chunk)
+            chunk = []
+    yield _entries(prefix, suffix, chunk) + FOOTER
+
+
+def shard_cache_key(base, section, shard):
+    # Под версией кеша страниц: любое изменение книг, авторов и новостей
+    # делает сохраненные части недоступными
+    digest = hashlib.md5(base.encode('utf-8')).hexdigest()
+    return f'main:sitemap:{get_cache_version()}:{digest}:{section}:{shard}'
+
+
+def cached_stream(key, chunks):
+    # Отдает куски клиенту и кладет весь текст в кеш, когда он дочитан до конца.
+    # Оборванная отдача в кеш не попадает.
+    parts = []
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        parts.append(data)
+        yield data
+    cache.set(key, b''.join(parts), settings.PAGE_CACHE_TIMEOUT)
+
+
+async def acached_stream(key, chunks):
+    parts = []
+    async for chunk in chunks:
+        data = chunk.encode('utf-8')
+        parts.append(data)
+        yield data
+    await cache.aset(key, b''.join(parts), settings.PAGE_CACHE_TIMEOUT)
@@ -0,0 +1,110 @@
+import hashlib
+import re
+from contextlib import contextmanager
+from functools import reduce
+from operator import or_
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+# Slug для адресов из названий на русском и адыгейском. slugify без
+# транслитерации выбрасывает кириллицу целиком, поэтому сначала переводим
+# текст в латиницу. Уникальность - суффиксом -2, -3..., номер выбирается
+# по одному запросу по префиксу (уникальный индекс slug с varchar_pattern_ops)
+# под advisory-блокировкой на основу без числовых суффиксов: два
+# одновременных сохранения с названиями "А" и "А 2" не получат один
+# и тот же slug a-2.
+
+# Адыгейские сочетания передаем до побуквенной замены
+DIGRAPHS = {'гъ': 'gh', 'къ': 'q', 'хъ': 'x', 'хь': 'h'}
+
+LETTERS = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ё': 'e',
+    # Палочка отмечает смычно-гортанные согласные. Ее пишут латинской I,
+    # поэтому и в slug она - i: без нее кӏэ и кэ дали бы один адрес.
+    # Латинская I и цифра 1 в названии остаются собой: "Книга1" - не "книгаӏ".
+    'ӏ': 'i',
+}
+
+_digraphs_re = re.compile('|'.join(DIGRAPHS))
+# Числовые суффиксы уникальности: a-2-3 -> a
+_suffixes_re = re.compile(r'(-\d+)+$')
+
+# Запас длины под суффикс: основа не обрезается при нумерации
+SUFFIX_RESERVE = 6
+LOOKUP_CHUNK = 500
+
+
+def transliterate(text):
+    text = _digraphs_re.sub(lambda match: DIGRAPHS[match.group()], text.strip().lower())
+    return ''.join(LETTERS.get(char, char) for char in text)
+
+
+def base_slug(model, text):
+    max_length = model._meta.get_field('slug').max_length - SUFFIX_RESERVE
+    return slugify(transliterate(text))[:max_length].strip('-') or model._meta.model_name
+
+
+def _lock(connection, model, bases):
+    # Блокировки до конца транзакции; по возрастанию ключа, без взаимных ожиданий.
+    # Ключ - основа без суффиксов: основы a и a-2 претендуют на один slug a-2.
+    keys = sorted({
+        int.from_bytes(
+            hashlib.blake2b(
+                f'{model._meta.db_table}:{_suffixes_re.sub("", base)}'.encode('utf-8'), digest_size=8,
+            ).digest(),
+            'big', signed=True,
+        )
+        for base in bases
+    })
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(key) FROM unnest(%s::bigint[]) AS key', [keys])
+
+
+def unique_slugs(model, texts, reserved=()):
+    # Slug для пачки новых объектов. Вызывать внутри транзакции, в которой
+    # объекты будут вставлены. reserved - slug, уже занятые в этой пачке.
+    if not texts:
+        return []
+    using = router.db_for_write(model)
+    connection = connections[using]
+    if not connection.in_atomic_block:
+        raise transaction.TransactionManagementError('unique_slugs() нужно вызывать внутри transaction.atomic()')
+
+    bases = [base_slug(model, text) for text in texts]
+    distinct = sorted(set(bases))
+    _lock(connection, model, distinct)
+    taken = set(reserved)
+    for start in range(0, len(distinct), LOOKUP_CHUNK):
+        chunk = distinct[start:start + LOOKUP_CHUNK]
+        condition = reduce(or_, (Q(slug=base) | Q(slug__startswith=f'{base}-') for base in chunk))
+        taken.update(model._base_manager.using(using).filter(condition).values_list('slug', flat=True))
+
+    slugs = []
+    numbers = {}
+    for base in bases:
+        number = numbers.get(base, 1)
+        slug = base if number == 1 else f'{base}-{number}'
+        while slug in taken:
+            number += 1
+            slug = f'{base}-{number}'
+        numbers[base] = number
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+@contextmanager
+def generated_slug(instance, text):
+    # Для save(): пустой slug заполняется из text, а вставка строки идет
+    # в той же транзакции, что держит блокировку
+    if instance.slug:
+        yield
+        return
+    with transaction.atomic(using=router.db_for_write(type(instance))):
+        instance.slug = unique_slugs(type(instance), [text])[0]
+        yield
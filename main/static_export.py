@@ -0,0 +1,233 @@
+import hashlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db import connections
+from django.db.models import CharField, F, OuterRef, Value
+from django.db.models.functions import Cast, Concat
+from django.http import Http404
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from .models import Author, Book, News, RelatedNews
+
+logger = logging.getLogger(__name__)
+
+# Выгрузка раскладывается так, чтобы nginx отдавал ее без Django:
+#
+#   location / {
+#       if ($args) { proxy_pass http://django; }   # фильтры, поиск, курсоры
+#       root /srv/adyge_books/static_export;
+#       try_files $uri $uri/index.html @django;
+#   }
+
+MANIFEST_NAME = '.export-manifest.json'
+
+# Страницы-списки зависят от многих объектов и рендерятся при каждой выгрузке
+LIST_PAGES = ['index', 'about', 'authors', 'news']
+
+# Поля, которые не видны на страницах и не должны вызывать перерисовку.
+# Счетчик просмотров в выгрузке замораживается на момент рендеринга.
+IGNORED_FIELDS = {'search_vector', 'views_count', 'updated_at'}
+
+
+def _fields(model):
+    return [field.attname for field in model._meta.concrete_fields if field.name not in IGNORED_FIELDS]
+
+
+def _text(*parts):
+    return Concat(*[Cast(part, CharField()) if isinstance(part, str) else part for part in parts],
+                  output_field=CharField())
+
+
+def _signatures(queryset, url_name):
+    fields = _fields(queryset.model)
+    pages = {}
+    for row in queryset.values(*fields, *queryset.query.annotations):
+        digest = hashlib.md5(json.dumps(row, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        pages[reverse(url_name, kwargs={'slug': row['slug']})] = digest
+    return pages
+
+
+def collect_pages():
+    # {адрес: подпись данных}; None - рендерить всегда
+    pages = {reverse(name): None for name in LIST_PAGES}
+
+    # Похожие книги - тем же запросом, что и в представлении, и все поля,
+    # которые выводит их карточка
+    recommended = Book.objects.recommended_for(OuterRef('pk')).values(
+        value=_text('id', Value(':'), 'slug', Value(':'), 'title', Value(':'), 'cover_image', Value(':'),
+                    'is_bestseller', Value(':'), 'is_new', Value(':'), 'author__name')
+    )
+    categories = Book.categories.through.objects.filter(book=OuterRef('pk')).order_by(
+        'category_id').values(value=_text('category__slug', Value(':'), 'category__name'))
+    pages.update(_signatures(
+        Book.objects.available().annotate(
+            author_name=F('author__name'), author_slug=F('author__slug'),
+            category_list=ArraySubquery(categories), recommended=ArraySubquery(recommended),
+        ),
+        'book_detail',
+    ))
+
+    books = Book.objects.available().filter(author=OuterRef('pk')).order_by('id').values(
+        value=_text('id', Value(':'), 'slug', Value(':'), 'title', Value(':'),
+                    'cover_image', Value(':'), 'publication_date', Value(':'), 'is_new', Value(':'), 'is_bestseller')
+    )
+    author_categories = Author.categories.through.objects.filter(author=OuterRef('pk')).order_by(
+        'authorcategory_id').values(value=_text('authorcategory__slug', Value(':'), 'authorcategory__name'))
+    pages.update(_signatures(
+        Author.objects.annotate(book_list=ArraySubquery(books), category_list=ArraySubquery(author_categories)),
+        'author_detail',
+    ))
+
+    related = RelatedNews.objects.filter(news=OuterRef('pk')).order_by('-score').values(
+        value=_text('related_id', Value(':'), 'related__slug', Value(':'), 'related__title',
+                    Value(':'), 'related__image', Value(':'), 'related__publish_date', Value(':'),
+                    'related__is_published')
+    )
+    pages.update(_signatures(
+        News.objects.published().annotate(related_list=ArraySubquery(related)),
+        'news_detail',
+    ))
+    return pages
+
+
+def template_files():
+    # (каталог, файл) для всех шаблонов сайта
+    directories = [Path(directory) for directory in settings.TEMPLATES[0]['DIRS']]
+    directories.append(Path(__file__).resolve().parent / 'templates')
+    for directory in directories:
+        for path in sorted(directory.rglob('*.html')):
+            yield directory, path
+
+
+def templates_signature():
+    # Правка шаблонов меняет все страницы сразу
+    digest = hashlib.md5()
+    for directory, path in template_files():
+        digest.update(str(path.relative_to(directory)).encode('utf-8'))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def page_file(root, path):
+    return Path(root) / path.strip('/') / 'index.html'
+
+
+def render_page(root, path):
+    # Та же функция представления, что и для живого сайта, но без кеша
+    # страниц и HTTP-заголовков кеширования
+    match = resolve(path)
+    view = inspect.unwrap(match.func)
+    if iscoroutinefunction(view):
+        view = async_to_sync(view)
+    request = RequestFactory().get(path)
+    request.user = AnonymousUser()
+    request.resolver_match = match
+    request.static_export = True
+    try:
+        response = view(request, *match.args, **match.kwargs)
+    except Http404:
+        return False
+    if response.status_code != 200:
+        return False
+
+    target = page_file(root, path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temporary = target.with_name(f'.{target.name}.{os.getpid()}.tmp')
+    temporary.write_bytes(response.content)
+    os.replace(temporary, target)
+    return True
+
+
+def _render_chunk(root, paths):
+    results = {}
+    for path in paths:
+        try:
+            results[path] = render_page(root, path)
+        except Exception:
+            logger.exception('Не удалось выгрузить %s', path)
+            results[path] = None
+    return results
+
+
+def _render_in_worker(root, paths):
+    try:
+        return _render_chunk(root, paths)
+    finally:
+        connections.close_all()
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def remove_page(root, path):
+    target = page_file(root, path)
+    if target.exists():
+        target.unlink()
+    # Пустые каталоги за удаленной страницей тоже убираем
+    directory = target.parent
+    while directory != Path(root) and directory.exists() and not any(directory.iterdir()):
+        directory.rmdir()
+        directory = directory.parent
+
+
+def export(root, workers=1, force=False, chunk_size=200):
+    # Возвращает (перерисовано, пропущено, удалено, ошибок)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    manifest_path = root / MANIFEST_NAME
+    manifest = {}
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+
+    pages = collect_pages()
+    templates = templates_signature()
+    previous = {}
+    if not force and manifest.get('templates') == templates:
+        previous = manifest.get('pages', {})
+    dirty = [
+        path for path, signature in pages.items()
+        if signature is None or previous.get(path) != signature
+    ]
+
+    if workers > 1 and len(dirty) > chunk_size:
+        # Дочерние процессы открывают собственные соединения с базой
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        results = {}
+        chunks = list(_chunks(dirty, chunk_size))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            for chunk in pool.map(_render_in_worker, [root] * len(chunks), chunks):
+                results.update(chunk)
+    else:
+        results = _render_chunk(root, dirty)
+
+    rendered = {path for path, ok in results.items() if ok}
+    failed = {path for path, ok in results.items() if ok is None}
+    # Объект пропал между сбором адресов и рендерингом
+    gone = {path for path, ok in results.items() if ok is False}
+    removed = [path for path in manifest.get('pages', {}) if path not in pages or path in gone]
+    for path in removed:
+        remove_page(root, path)
+
+    exported = {
+        path: signature for path, signature in pages.items()
+        if path in rendered or (path not in results and path in previous)
+    }
+    manifest_path.write_text(
+        json.dumps({'templates': templates, 'pages': exported}, ensure_ascii=False, indent=0),
+        encoding='utf-8',
+    )
+    return len(rendered), len(pages) - len(dirty), len(removed), len(failed)
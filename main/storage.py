@@ -0,0 +1,43 @@
+import logging
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+from .assets import compress_file, minify_css
+
+logger = logging.getLogger(__name__)
+
+
+class StaticStorage(ManifestStaticFilesStorage):
+    # collectstatic: CSS минифицируется до подсчета хеша, имена получают
+    # хеш содержимого (их можно кешировать навсегда), а рядом с каждым
+    # текстовым файлом кладутся сжатые копии .gz и .br
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+
+        paths = dict(paths)
+        for name in paths:
+            if name.endswith('.css') and not name.endswith('.min.css'):
+                path = Path(self.path(name))
+                path.write_text(minify_css(path.read_text('utf-8')), 'utf-8')
+                # Хеш считается по содержимому из этого хранилища, а не из исходного каталога
+                paths[name] = (self, name)
+
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+            if not isinstance(processed, Exception):
+                names.update({name, hashed_name} - {None})
+        for name in sorted(names):
+            compress_file(self.path(name))
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Файла нет в сборке (например, ссылка на еще не добавленное
+            # изображение) - отдаем ссылку без хеша вместо ошибки страницы
+            logger.warning('Статический файл %s не найден в сборке', name)
+            return name
@@ -0,0 +1,168 @@
+import datetime
+import random
+
+from django.db import models, transaction
+from django.db.models.expressions import RawSQL
+
+from .cache import bump_cache_version
+from .catalog import sync_catalog
+from .conditional import mark_structure_changed
+from .models import ArchivedContactMessage, Author, AuthorCategory, Book, Category, ContactMessage, News
+
+# Все синтетические записи помечены, чтобы их можно было удалить
+PREFIX = 'bench-'
+EMAIL_DOMAIN = 'bench.invalid'
+BATCH_SIZE = 2000
+
+WORDS = [
+    'адыгэ', 'псалъэ', 'тхылъ', 'усэ', 'таурыхъ', 'гъатхэ', 'мэз', 'къушъхьэ',
+    'нэф', 'гупшысэ', 'лъэпкъ', 'шъыпкъэ', 'дунай', 'гъогу', 'насып', 'орэд',
+    'история', 'сказки', 'стихи', 'повесть', 'роман', 'горы', 'море', 'память',
+]
+
+
+def _phrase(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def seed(books=10000, authors=1000, news=5000, messages=10000, random_seed=42):
+    # Быстро заполняет базу правдоподобными данными через bulk_create.
+    # Сигналы не срабатывают: поисковые векторы и похожие книги
+    # при необходимости пересчитываются отдельными командами,
+    # записи каталога строятся здесь же.
+    rng = random.Random(random_seed)
+    today = datetime.date.today()
+
+    with transaction.atomic():
+        categories = [
+            Category.objects.get_or_create(slug=f'{PREFIX}category-{i}', defaults={'name': f'Категория {i}'})[0]
+            for i in range(12)
+        ]
+        author_categories = [
+            AuthorCategory.objects.get_or_create(slug=f'{PREFIX}genre-{i}', defaults={'name': f'Жанр {i}'})[0]
+            for i in range(6)
+        ]
+
+        start = Author.objects.filter(slug__startswith=PREFIX).count()
+        created_authors = Author.objects.bulk_create([
+            Author(
+                name=f'{_phrase(rng, 2)} {start + i}',
+                slug=f'{PREFIX}author-{start + i}',
+                bio=_phrase(rng, 60),
+                is_popular=rng.random() < 0.05,
+            )
+            for i in range(authors)
+        ], batch_size=BATCH_SIZE)
+        AuthorThrough = Author.categories.through
+        AuthorThrough.objects.bulk_create([
+            AuthorThrough(author_id=author.pk, authorcategory_id=category.pk)
+            for author in created_authors
+            for category in rng.sample(author_categories, rng.randint(0, 2))
+        ], batch_size=BATCH_SIZE)
+
+        # Только синтетические авторы: clear() удаляет книги вместе с ними,
+        # страницы настоящих авторов не затрагиваются
+        author_ids = list(Author.objects.filter(slug__startswith=PREFIX).values_list('id', flat=True))
+        if books and not author_ids:
+            raise ValueError('Для синтетических книг нужны синтетические авторы')
+        start = Book.objects.filter(slug__startswith=PREFIX).count()
+        for offset in range(0, books, BATCH_SIZE):
+            created_books = Book.objects.bulk_create([
+                Book(
+                    title=_phrase(rng, rng.randint(1, 4)),
+                    slug=f'{PREFIX}book-{start + offset + i}',
+                    author_id=rng.choice(author_ids),
+                    description=_phrase(rng, 80),
+                    cover_image='books/covers/bench.jpg',
+                    publication_date=today - datetime.timedelta(days=rng.randint(0, 365 * 30)),
+                    is_available=rng.random() < 0.9,
+                    is_bestseller=rng.random() < 0.05,
+                    is_new=rng.random() < 0.1,
+                )
+                for i in range(min(BATCH_SIZE, books - offset))
+            ])
+            BookThrough = Book.categories.through
+            BookThrough.objects.bulk_create([
+                BookThrough(book_id=book.pk, category_id=category.pk)
+                for book in created_books
+                for category in rng.sample(categories, rng.randint(1, 3))
+            ])
+
+        start = News.objects.filter(slug__startswith=PREFIX).count()
+        News.objects.bulk_create([
+            News(
+                title=_phrase(rng, 5),
+                slug=f'{PREFIX}news-{start + i}',
+                content=_phrase(rng, 200),
+                short_description=_phrase(rng, 20),
+                category=rng.choice(News.NEWS_CATEGORIES)[0],
+                image='news/bench.jpg',
+                views_count=rng.randint(0, 5000),
+                is_published=rng.random() < 0.95,
+            )
+            for i in range(news)
+        ], batch_size=BATCH_SIZE)
+        # publish_date проставляется auto_now_add, разносим даты по десяти годам
+        News.objects.filter(slug__startswith=PREFIX).update(
+            publish_date=RawSQL("now() - random() * interval '3650 days'", [])
+        )
+
+        sync_catalog(Book.objects.filter(slug__startswith=PREFIX))
+
+        ContactMessage.objects.bulk_create([
+            ContactMessage(
+                name=_phrase(rng, 2),
+                email=f'user{i}@{EMAIL_DOMAIN}',
+                subject=rng.choice(ContactMessage.SUBJECT_CHOICES)[0],
+                message=_phrase(rng, 40),
+                agree_to_terms=True,
+                is_processed=rng.random() < 0.8,
+            )
+            for i in range(messages)
+        ], batch_size=BATCH_SIZE)
+        ContactMessage.objects.filter(email__endswith='@' + EMAIL_DOMAIN).update(
+            created_at=RawSQL("now() - random() * interval '1095 days'", [])
+        )
+
+
+def _raw_delete(queryset):
+    # DELETE одним запросом, без загрузки строк и без сигналов: иначе на
+    # каждую из сотен тысяч строк - смена версии кеша, пересборка каталога
+    # и удаление копий изображений. Зависимые строки (все связи в main -
+    # CASCADE) и связи многие-ко-многим удаляются раньше тем же способом.
+    model = queryset.model
+    for field in model._meta.many_to_many:
+        through = field.remote_field.through
+        through.objects.filter(**{f'{field.m2m_field_name()}__in': queryset})._raw_delete(queryset.db)
+    for relation in model._meta.related_objects:
+        if relation.many_to_many:
+            through = relation.through
+            through.objects.filter(**{f'{relation.field.m2m_reverse_field_name()}__in': queryset})._raw_delete(
+                queryset.db
+            )
+        else:
+            assert relation.on_delete is models.CASCADE, relation
+            _raw_delete(relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': queryset}))
+    return queryset._raw_delete(queryset.db)
+
+
+def clear():
+    with transaction.atomic():
+        # Настоящие книги в синтетических категориях: их записи каталога
+        # пересобираются одной сверкой в конце
+        categories = Category.objects.filter(slug__startswith=PREFIX)
+        touched = list(Book.objects.filter(categories__in=categories).exclude(
+            slug__startswith=PREFIX).values_list('pk', flat=True).distinct())
+
+        _raw_delete(ContactMessage.objects.filter(email__endswith='@' + EMAIL_DOMAIN))
+        _raw_delete(ArchivedContactMessage.objects.filter(email__endswith='@' + EMAIL_DOMAIN))
+        _raw_delete(News.objects.filter(slug__startswith=PREFIX))
+        _raw_delete(Book.objects.filter(slug__startswith=PREFIX))
+        _raw_delete(Author.objects.filter(slug__startswith=PREFIX))
+        _raw_delete(categories)
+        _raw_delete(AuthorCategory.objects.filter(slug__startswith=PREFIX))
+
+        sync_catalog(Book.objects.filter(pk__in=touched))
+    # Вместо сигналов на каждую строку - одна смена версии кеша
+    bump_cache_version()
+    mark_structure_changed()
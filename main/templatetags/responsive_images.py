@@ -0,0 +1,45 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from ..images import cached_derivatives, get_derivatives, queue_derivatives, supported_formats
+from ..instrumentation import timed
+
+register = template.Library()
+
+CARD_SIZES = '(max-width: 576px) 50vw, (max-width: 992px) 33vw, 280px'
+
+
+@register.simple_tag(takes_context=True)
+def responsive_image(context, image, alt='', sizes=CARD_SIZES, lazy=True):
+    # <picture> с AVIF/WebP-копиями разной ширины и оригиналом как запасным вариантом
+    if not image:
+        return ''
+    with timed('images'):
+        derivatives = cached_derivatives(image.name)
+        if derivatives is None and getattr(context.get('request'), 'static_export', False):
+            # Выгруженная страница не перерисуется, когда копии появятся
+            derivatives = get_derivatives(image.name)
+        elif derivatives is None:
+            # Обычно копии строит сигнал после сохранения; если их нет
+            # в кеше, строим в фоне, а пока отдаем оригинал
+            queue_derivatives(image.name)
+            derivatives = {}
+        sources = []
+        for extension, mime_type, *_ in supported_formats():
+            variants = derivatives.get(extension)
+            if variants:
+                srcset = ', '.join(f'{default_storage.url(name)} {width}w' for width, name in variants)
+                sources.append((mime_type, srcset, sizes))
+        url = image.url
+    img = format_html(
+        '<img src="{}" alt="{}" loading="{}" decoding="async">',
+        url, alt, 'lazy' if lazy else 'eager',
+    )
+    if not sources:
+        return img
+    return format_html(
+        '<picture>{}{}</picture>',
+        format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', sources),
+        img,
+    )
@@ -1,3 +1,1811 @@
-from django.test import TestCase
+import base64
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core import mail
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, router, transaction
+from django.db.models.fields.files import ImageFieldFile
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.templatetags.static import static
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import async_views, urls
+from .models import (
+    ArchivedContactMessage, Author, AuthorCategory, Book, CatalogEntry, Category, ContactMessage, News, OutboxEmail, RelatedBook,
+)
+from .cache import bump_cache_version, bumped_within, get_cache_version
+from .checks import shared_cache
+from .conditional import validate
+from .counters import ViewCounter
+from .middleware import ReplicaMiddleware, ThrottleMiddleware
+from . import sitemaps, synthetic, throttle
+from .management.commands.benchmark_indexes import VIEW_INDEXES
+from .routers import ReplicaRouter
+from .images import build_derivatives, delete_derivatives
+from .instrumentation import collect, fingerprint, metrics
+from .outbox import MAX_ATTEMPTS, backoff, deliver_batch
+from .recommendations import RELATED_LIMIT, rebuild_related_books
+from .archive import archive_batch, archive_cutoff
+from .assets import build_icons, minify_css
+from .warmup import compile_templates, template_names, warmup
+from .pagination import CATALOG_ORDERINGS, EstimatedCountPaginator, decode_cursor, keyset_page
+from .search import normalize_text, search_books
+from .slugs import base_slug, transliterate, unique_slugs
+from .static_export import export
+
+
+def make_book(author, title, publication_date, **kwargs):
+    return Book.objects.create(
+        title=title,
+        slug=kwargs.pop('slug', None) or f'book-{Book.objects.count() + 1}',
+        author=author,
+        description=kwargs.pop('description', 'Описание'),
+        cover_image='books/covers/cover.jpg',
+        publication_date=publication_date,
+        **kwargs
+    )
+
+
+class CatalogPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        cls.category = Category.objects.create(name='Поэзия', slug='poetry')
+        start = datetime.date(2020, 1, 1)
+        # По две книги на дату, чтобы проверить разрешение ничьих по id
+        for i in range(10):
+            book = make_book(cls.author, f'Книга {i:02d}', start + datetime.timedelta(days=i // 2))
+            if i % 2:
+                book.categories.add(cls.category)
+
+    def setUp(self):
+        cache.clear()
+
+    def collect(self, sort_by, page_size):
+        books = Book.objects.filter(is_available=True)
+        cursor = None
+        seen = []
+        while True:
+            page, cursor = keyset_page(books, CATALOG_ORDERINGS[sort_by], cursor, page_size)
+            seen.extend(page)
+            if not cursor:
+                return seen
+
+    def test_pages_cover_catalog_without_gaps_or_duplicates(self):
+        for sort_by in CATALOG_ORDERINGS:
+            expected = list(Book.objects.order_by(*CATALOG_ORDERINGS[sort_by]))
+            self.assertEqual(self.collect(sort_by, 3), expected)
+
+    def test_invalid_cursor_returns_first_page(self):
+        books = Book.objects.all()
+        first, _ = keyset_page(books, CATALOG_ORDERINGS['new'], None, 3)
+        broken, _ = keyset_page(books, CATALOG_ORDERINGS['new'], 'не-курсор', 3)
+        self.assertEqual(first, broken)
+
+    def test_tampered_cursor_values_return_first_page(self):
+        first = self.client.get(reverse('catalog_page')).json()['html']
+        tampered = [
+            ['не дата', 5], [None, None], [{'a': 1}, [1]], ['2020-01-01', 'abc'],
+            ['2020-01-01', 10 ** 20], ['да?', '2020-01-01', 1],
+        ]
+        for sort_by, values in [('new', values) for values in tampered[:5]] + [('popular', tampered[5])]:
+            with self.subTest(sort=sort_by, values=values):
+                cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+                response = self.client.get(reverse('catalog_page'), {'sort': sort_by, 'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                if sort_by == 'new':
+                    self.assertEqual(response.json()['html'], first)
+        cursor = base64.urlsafe_b64encode(json.dumps(['a\u0000b', 1]).encode()).decode()
+        response = self.client.get(reverse('catalog_page'), {'sort': 'title', 'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+
+    def test_cursor_survives_deleted_anchor_book(self):
+        ordering = CATALOG_ORDERINGS['new']
+        entries = list(CatalogEntry.objects.order_by(*ordering))
+        page, cursor = keyset_page(CatalogEntry.objects.all(), ordering, page_size=3)
+        self.assertEqual(page, entries[:3])
+        # Книга-якорь курсора удалена, пока читатель листал каталог
+        Book.objects.filter(pk=page[-1].pk).delete()
+        page, _ = keyset_page(CatalogEntry.objects.all(), ordering, cursor, page_size=3)
+        self.assertEqual(page, entries[3:6])
+
+    def test_cursor_check_runs_no_queries(self):
+        cursor = keyset_page(CatalogEntry.objects.all(), CATALOG_ORDERINGS['new'], page_size=3)[1]
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(decode_cursor(cursor, CATALOG_ORDERINGS['new'], CatalogEntry))
+
+    def test_json_page_keeps_filters(self):
+        response = self.client.get(reverse('catalog_page'), {'category': 'poetry', 'sort': 'title'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['html'].count('book-card'), 5)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_catalog_page_links_next_cursor(self):
+        response = self.client.get(reverse('catalog'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['books']), 10)
+        self.assertIsNone(response.context['next_query'])
+
+
+# Максимальное число SQL-запросов на страницу. Бюджет не зависит от
+# количества объектов на странице: если он превышен, в шаблон или
+# представление вернулся N+1. Запрос валидаторов HTTP-кеша
+# (main/conditional.py) проверяется отдельно: не больше одного.
+QUERY_BUDGETS = {
+    'index': 3,
+    'catalog': 3,
+    'catalog_page': 1,
+    'book_detail': 3,
+    'authors': 3,
+    'author_detail': 2,
+    'about': 0,
+    'contacts': 0,
+    'news': 1,
+    'news_detail': 3,
+    'search': 3,
+    'sitemap': 3,
+    # Проверка, что часть не пуста; строки читаются при отдаче ответа, после замера
+    'sitemap_section': 1,
+    'news_feed': 1,
+    'news_feed_atom': 1,
+    'robots_txt': 0,
+}
+
+
+@override_settings(NEWS_VIEWS_FLUSH_INTERVAL=0)
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categories = [Category.objects.create(name=f'Категория {i}', slug=f'category-{i}') for i in range(3)]
+        author_categories = [
+            AuthorCategory.objects.create(name=f'Жанр {i}', slug=f'genre-{i}') for i in range(3)
+        ]
+        for i in range(5):
+            author = Author.objects.create(name=f'Автор {i}', slug=f'author-{i}', bio='Био', is_popular=True)
+            author.categories.set(author_categories)
+            for j in range(4):
+                book = make_book(author, f'Книга {i}-{j}', datetime.date(2020, 1, 1 + j), slug=f'book-{i}-{j}')
+                book.categories.set(categories)
+        for i in range(5):
+            News.objects.create(
+                title=f'Новость {i}', slug=f'news-{i}', content='Текст',
+                short_description='Кратко', category='events', image='news/image.jpg',
+            )
+        cls.kwargs = {
+            'book_detail': {'slug': 'book-0-0'},
+            'author_detail': {'slug': 'author-0'},
+            'news_detail': {'slug': 'news-0'},
+            'sitemap_section': {'section': 'books', 'shard': 0},
+        }
+
+    def setUp(self):
+        cache.clear()
+
+    def test_every_url_has_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names - set(QUERY_BUDGETS), set())
+
+    def test_query_budgets(self):
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(url=name):
+                url = reverse(name, kwargs=self.kwargs.get(name))
+                match = resolve(url)
+                with CaptureQueriesContext(connection) as queries:
+                    validate(RequestFactory().get(url), getattr(match.func, 'validators', None), match.args, match.kwargs)
+                self.assertLessEqual(len(queries), 1)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                executed = [query['sql'] for query in queries.captured_queries]
+                self.assertLessEqual(
+                    len(executed), budget,
+                    f'{url}: {len(executed)} запросов при бюджете {budget}:\n' + '\n'.join(executed)
+                )
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Исхак Машбаш', slug='mashbash', bio='Био')
+        make_book(cls.author, 'Адыгэ таурыхъхэр', datetime.date(2020, 1, 1), slug='taurykh',
+                  description='Сказки для детей')
+        make_book(cls.author, 'КӀэлэцӀыкӀу усэхэр', datetime.date(2021, 1, 1), slug='useher')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_normalize_palochka_variants(self):
+        self.assertEqual(normalize_text('кIэлэцIыкIу'), 'кӏэлэцӏыкӏу')
+        self.assertEqual(normalize_text('Кl1элэ'), 'Кӏӏэлэ')
+        self.assertEqual(normalize_text('Том 1'), 'Том 1')
+        self.assertEqual(normalize_text('ёлка'), 'елка')
+
+    def test_vector_includes_author_and_description(self):
+        books = Book.objects.available()
+        self.assertEqual(len(search_books(books, 'Машбаш', 10)), 2)
+        self.assertEqual([book.slug for book in search_books(books, 'сказка', 10)], ['taurykh'])
+
+    def test_latin_palochka_matches_cyrillic(self):
+        found = search_books(Book.objects.available(), 'кIэлэцIыкIу', 10)
+        self.assertEqual([book.slug for book in found], ['useher'])
+
+    def test_author_rename_updates_books(self):
+        self.author.name = 'Кужъ'
+        self.author.save()
+        self.assertEqual(len(search_books(Book.objects.available(), 'Кужъ', 10)), 2)
+
+    def test_search_endpoint(self):
+        response = self.client.get(reverse('search'), {'q': 'Машбаш', 'format': 'json'})
+        self.assertEqual(len(response.json()['books']), 2)
+
+    def test_catalog_search_by_author(self):
+        response = self.client.get(reverse('catalog'), {'search': 'Машбаш'})
+        self.assertEqual(len(response.context['books']), 2)
+
+
+class ViewCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.news = News.objects.create(
+            title='Новость', slug='news', content='Текст',
+            short_description='Кратко', category='events', image='news/image.jpg',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_views_are_buffered_until_flush(self):
+        counter = ViewCounter(News, 'views_count', 'NEWS_VIEWS_FLUSH_INTERVAL')
+        with mock.patch.object(counter, '_start_flusher'), self.assertNumQueries(0):
+            for _ in range(3):
+                counter.record(self.news.pk)
+        self.assertEqual(counter.live_count(self.news), 3)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(counter.flush(), 3)
+        self.news.refresh_from_db()
+        self.assertEqual(self.news.views_count, 3)
+        self.assertEqual(counter.live_count(self.news), 3)
+
+    def test_failed_flush_keeps_views(self):
+        counter = ViewCounter(News, 'views_count', 'NEWS_VIEWS_FLUSH_INTERVAL')
+        with mock.patch.object(counter, '_start_flusher'):
+            counter.record(self.news.pk)
+        with mock.patch.object(News.objects, 'filter', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                counter.flush()
+        self.assertEqual(counter.pending(self.news.pk), 1)
+
+    @override_settings(NEWS_VIEWS_FLUSH_INTERVAL=0)
+    def test_news_detail_counts_view(self):
+        self.client.get(reverse('news_detail', args=['news']))
+        response = self.client.get(reverse('news_detail', args=['news']))
+        self.assertEqual(response.context['news_item'].views_count, 2)
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        cls.category = Category.objects.create(name='Поэзия', slug='poetry')
+        cls.book = make_book(cls.author, 'Книга', datetime.date(2020, 1, 1), slug='book')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeated_request_is_served_from_cache(self):
+        self.client.get(reverse('catalog'), {'sort': 'title', 'category': 'poetry'})
+        with self.assertNumQueries(0):
+            # Порядок параметров на ключ не влияет
+            self.client.get(reverse('catalog'), {'category': 'poetry', 'sort': 'title'})
+
+    def test_filters_are_part_of_key(self):
+        self.client.get(reverse('catalog'))
+        # Книги, счетчики фильтров и список категорий
+        with self.assertNumQueries(3):
+            self.client.get(reverse('catalog'), {'category': 'poetry'})
+
+    def test_index_fragments_are_cached(self):
+        self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('index'))
+
+    def test_model_changes_invalidate(self):
+        url = reverse('book_detail', args=['book'])
+        self.assertNotContains(self.client.get(url), 'Поэзия')
+        self.book.categories.add(self.category)
+        self.assertContains(self.client.get(url), 'Поэзия')
+        self.category.name = 'Проза'
+        self.category.save()
+        self.assertContains(self.client.get(url), 'Проза')
+        self.author.name = 'Другой автор'
+        self.author.save()
+        self.assertContains(self.client.get(url), 'Другой автор')
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.poetry = Category.objects.create(name='Поэзия', slug='poetry')
+        self.prose = Category.objects.create(name='Проза', slug='prose')
+        self.author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        self.other = Author.objects.create(name='Другой', slug='other', bio='Био')
+
+    def book(self, slug, author, categories, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = make_book(author, slug, timezone.localdate(), slug=slug, **kwargs)
+        with self.captureOnCommitCallbacks(execute=True):
+            book.categories.set(categories)
+        return book
+
+    def related_slugs(self, book):
+        return [related.slug for related in Book.objects.recommended_for(book)]
+
+    def test_scores_shared_categories_and_author(self):
+        main = self.book('main', self.author, [self.poetry, self.prose])
+        self.book('both', self.other, [self.poetry, self.prose])
+        self.book('same-author', self.author, [])
+        self.book('one', self.other, [self.prose])
+        self.book('unrelated', self.other, [])
+        self.assertEqual(self.related_slugs(main), ['both', 'one', 'same-author'])
+
+    def test_changes_update_neighbours_incrementally(self):
+        main = self.book('main', self.author, [self.poetry])
+        late = self.book('late', self.other, [self.poetry])
+        self.assertEqual(self.related_slugs(main), ['late'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            late.categories.remove(self.poetry)
+        self.assertEqual(self.related_slugs(main), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            late.categories.add(self.poetry)
+        late.is_available = False
+        with self.captureOnCommitCallbacks(execute=True):
+            late.save()
+        self.assertEqual(self.related_slugs(main), [])
+
+    def test_detail_page_reads_precomputed_neighbours(self):
+        main = self.book('main', self.author, [self.poetry])
+        self.book('neighbour', self.other, [self.poetry])
+        response = self.client.get(reverse('book_detail', args=[main.slug]))
+        self.assertEqual([book.slug for book in response.context['related_books']], ['neighbour'])
+
+    def test_related_news_by_category(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = News.objects.create(title='Первая', slug='first', content='Текст', short_description='Кратко',
+                                        category='events', image='news/image.jpg')
+            News.objects.create(title='Вторая', slug='second', content='Текст', short_description='Кратко',
+                                category='events', image='news/image.jpg')
+            News.objects.create(title='Награда', slug='award', content='Текст', short_description='Кратко',
+                                category='awards', image='news/image.jpg')
+        self.assertEqual([news.slug for news in first.get_related_news()], ['second'])
+
+    def test_full_lists_take_only_stronger_neighbours(self):
+        main = self.book('main', self.author, [self.poetry, self.prose])
+        for number in range(RELATED_LIMIT):
+            self.book(f'strong-{number}', self.other, [self.poetry, self.prose])
+        full = self.related_slugs(main)
+        # Новая книга с одной общей категорией слабее всех двенадцати соседей
+        weak = self.book('weak', self.other, [self.poetry])
+        self.assertEqual(self.related_slugs(main), full)
+        self.assertFalse(RelatedBook.objects.filter(book=main, related=weak).exists())
+        self.assertEqual(RelatedBook.objects.filter(book=main).count(), RELATED_LIMIT)
+        # Книга того же автора обходит их и вытесняет последнего
+        strong = self.book('stronger', self.author, [self.poetry, self.prose])
+        self.assertEqual(self.related_slugs(main)[0], strong.slug)
+        self.assertEqual(RelatedBook.objects.filter(book=main).count(), RELATED_LIMIT)
+
+    def test_bulk_rebuild_writes_all_lists(self):
+        books = [self.book(f'book-{number}', self.other, [self.poetry]) for number in range(4)]
+        RelatedBook.objects.all().delete()
+        # Точка сохранения, пересборка своих списков, отбор и чистка чужих
+        with self.assertNumQueries(6):
+            rebuild_related_books([book.pk for book in books])
+        for book in books:
+            self.assertEqual(len(self.related_slugs(book)), 3)
+
+    def test_full_rebuild_matches_incremental(self):
+        main = self.book('main', self.author, [self.poetry, self.prose])
+        self.book('both', self.other, [self.poetry, self.prose])
+        self.book('same-author', self.author, [])
+        expected = self.related_slugs(main)
+        RelatedBook.objects.all().delete()
+        call_command('rebuild_recommendations', stdout=io.StringIO())
+        self.assertEqual(self.related_slugs(main), expected)
+
+
+class ResponsiveImageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self, name, size):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'purple').save(buffer, 'JPEG')
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def test_derivatives_are_width_bucketed_without_upscaling(self):
+        name = self.upload('books/covers/cover.jpg', (600, 900))
+        derivatives = build_derivatives(name)
+        self.assertEqual([width for width, _ in derivatives['webp']], [160, 320, 480])
+        for _, path in derivatives['webp']:
+            self.assertTrue(path.startswith('books/covers/thumbs/'))
+            with default_storage.open(path) as thumbnail:
+                self.assertEqual(Image.open(thumbnail).format, 'WEBP')
+
+    def test_derivatives_use_name_returned_by_storage(self):
+        name = self.upload('books/covers/cover.jpg', (400, 600))
+        renamed = lambda target, max_length=None: target.replace('w.', 'w_x1.')
+        with mock.patch.object(default_storage, 'get_available_name', side_effect=renamed):
+            derivatives = build_derivatives(name, force=True)
+        paths = [path for _, path in derivatives['webp']]
+        self.assertEqual(paths, [
+            'books/covers/thumbs/cover.jpg-160w_x1.webp', 'books/covers/thumbs/cover.jpg-320w_x1.webp',
+        ])
+        self.assertTrue(all(default_storage.exists(path) for path in paths))
+        delete_derivatives(name)
+        self.assertFalse(any(default_storage.exists(path) for path in paths))
+
+    def test_tag_renders_srcset_and_lazy_loading(self):
+        author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        book = make_book(author, 'Книга', datetime.date(2020, 1, 1), slug='book')
+        book.cover_image = self.upload('books/covers/cover.jpg', (1000, 1500))
+        template = Template('{% load responsive_images %}{% responsive_image book.cover_image book.title %}')
+        # Копий еще нет: рендеринг их не строит, а ставит в очередь
+        with mock.patch('main.images._builder.submit', side_effect=lambda build, name: build(name)) as submit:
+            html = template.render(Context({'book': book}))
+        submit.assert_called_once()
+        self.assertTrue(html.startswith('<img src="/media/books/covers/cover.jpg"'))
+
+        html = template.render(Context({'book': book}))
+        self.assertIn('<picture>', html)
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('thumbs/cover.jpg-800w.webp 800w', html)
+        self.assertIn('loading="lazy"', html)
+
+    def test_same_stem_sources_get_separate_derivatives(self):
+        jpeg = build_derivatives(self.upload('books/covers/cover.jpg', (400, 600)))
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 600), 'green').save(buffer, 'PNG')
+        png = build_derivatives(default_storage.save('books/covers/cover.png', ContentFile(buffer.getvalue())))
+        self.assertFalse({path for _, path in jpeg['webp']} & {path for _, path in png['webp']})
+
+    def test_replaced_image_loses_old_derivatives(self):
+        author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        with self.captureOnCommitCallbacks(execute=True):
+            book = make_book(author, 'Книга', datetime.date(2020, 1, 1), slug='book')
+            book.cover_image = self.upload('books/covers/old.jpg', (400, 600))
+            book.save()
+        old = [path for _, path in build_derivatives(book.cover_image.name)['webp']]
+        self.assertTrue(old and all(default_storage.exists(path) for path in old))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.cover_image = self.upload('books/covers/new.jpg', (400, 600))
+            book.save()
+        self.assertFalse(any(default_storage.exists(path) for path in old))
+        self.assertTrue(default_storage.exists('books/covers/thumbs/new.jpg-160w.webp'))
+
+    def test_missing_original_falls_back_to_plain_img(self):
+        html = Template('{% load responsive_images %}{% responsive_image image "Нет" %}').render(
+            Context({'image': ImageFieldFile(None, Book._meta.get_field('cover_image'), 'books/covers/missing.jpg')})
+        )
+        self.assertTrue(html.startswith('<img src="/media/books/covers/missing.jpg"'))
+
+
+class IndexBenchmarkTests(TestCase):
+    def test_benchmark_reports_both_runs_and_keeps_indexes(self):
+        output = io.StringIO()
+        call_command(
+            'benchmark_indexes', seed=True, books=200, authors=20, news=50, messages=50,
+            repeat=1, stdout=output,
+        )
+        self.assertIn('catalog_new', output.getvalue())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_indexes WHERE indexname = 'catalog_new_idx'")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            # Каждый замеряемый индекс есть в схеме, иначе DROP IF EXISTS молча пропустит его
+            cursor.execute('SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s)', [VIEW_INDEXES])
+            self.assertEqual(sorted(row[0] for row in cursor.fetchall()), sorted(VIEW_INDEXES))
+
+    def test_synthetic_data_leaves_real_rows_alone(self):
+        author = Author.objects.create(name='Настоящий автор', slug='real', bio='Био')
+        book = make_book(author, 'Настоящая книга', datetime.date(2020, 1, 1), slug='real-book')
+        synthetic.seed(books=50, authors=5, news=5, messages=5)
+        self.assertFalse(Book.objects.filter(author=author).exclude(pk=book.pk).exists())
+
+        # Настоящая книга в синтетической категории: категория уходит из каталога
+        book.categories.add(Category.objects.filter(slug__startswith=synthetic.PREFIX).first())
+        with mock.patch('main.signals.bump_cache_version') as per_row, \
+                mock.patch('main.synthetic.bump_cache_version') as once:
+            synthetic.clear()
+        per_row.assert_not_called()
+        once.assert_called_once()
+        self.assertFalse(Book.objects.filter(slug__startswith=synthetic.PREFIX).exists())
+        self.assertFalse(Author.objects.filter(slug__startswith=synthetic.PREFIX).exists())
+        self.assertEqual(list(Book.objects.values_list('pk', flat=True)), [book.pk])
+        self.assertEqual(CatalogEntry.objects.get().category_slugs, [])
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    DEFAULT_FROM_EMAIL='site@example.com', CONTACT_EMAIL='office@example.com, editor@example.com',
+)
+class OutboxTests(TestCase):
+    def setUp(self):
+        # Корзины ограничения частоты и отметки о принятых сообщениях
+        cache.clear()
+
+    def post_contact(self):
+        return self.client.post(reverse('contacts'), {
+            'name': 'Читатель', 'email': 'reader@example.com', 'subject': 'general',
+            'message': 'Здравствуйте', 'agree_to_terms': 'on',
+        })
+
+    def test_contact_form_queues_email_without_sending(self):
+        response = self.post_contact()
+        self.assertRedirects(response, reverse('contacts'))
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.contact_message, ContactMessage.objects.get())
+        self.assertEqual(email.recipient_list(), ['office@example.com', 'editor@example.com'])
+        self.assertIn('Здравствуйте', email.body)
+
+    def test_deliver_batch_sends_pending_emails(self):
+        self.post_contact()
+        self.assertEqual(deliver_batch(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['office@example.com', 'editor@example.com'])
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.status, OutboxEmail.STATUS_SENT)
+        self.assertIsNotNone(email.sent_at)
+        # Отправленное письмо второй раз не уходит
+        self.assertEqual(deliver_batch(), (0, 0))
+
+    def test_failure_is_retried_with_backoff(self):
+        self.post_contact()
+        with mock.patch('main.outbox.EmailMessage.send', side_effect=OSError('connection refused')):
+            self.assertEqual(deliver_batch(), (0, 1))
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.status, OutboxEmail.STATUS_PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('connection refused', email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now() + backoff(1) - datetime.timedelta(seconds=5))
+        # До наступления следующей попытки письмо не берется
+        self.assertEqual(deliver_batch(), (0, 0))
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_batch(), (1, 0))
+        self.assertEqual(OutboxEmail.objects.get().attempts, 2)
+
+    def test_gives_up_after_max_attempts(self):
+        self.post_contact()
+        OutboxEmail.objects.update(attempts=MAX_ATTEMPTS - 1)
+        with mock.patch('main.outbox.EmailMessage.send', side_effect=OSError('timeout')):
+            deliver_batch()
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.STATUS_FAILED)
+
+    def test_email_without_recipients_waits_for_configuration(self):
+        with override_settings(CONTACT_EMAIL=''):
+            self.post_contact()
+            self.assertEqual(deliver_batch(), (0, 1))
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.status, OutboxEmail.STATUS_PENDING)
+        self.assertIn('CONTACT_EMAIL', email.last_error)
+        self.assertEqual(len(mail.outbox), 0)
+        # Адреса настроили - письмо уходит при следующей попытке
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_batch(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['office@example.com', 'editor@example.com'])
+
+
+@override_settings(NEWS_VIEWS_FLUSH_INTERVAL=0)
+class UrlBenchmarkTests(TestCase):
+    def test_benchmark_covers_every_route_and_writes_json(self):
+        target = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        target.close()
+        self.addCleanup(lambda: os.remove(target.name))
+        output = io.StringIO()
+        call_command(
+            'benchmark_urls', seed=True, books=60, authors=10, news=20, messages=5,
+            repeat=2, warmup=0, json=target.name, stdout=output,
+        )
+        with open(target.name, encoding='utf-8') as source:
+            report = json.load(source)
+        rows = report['urls']
+        names = {pattern.name for pattern in urls.urlpatterns}
+        covered = {name for name in names if any(key.startswith(name) for key in rows)}
+        self.assertEqual(covered, names)
+        for name, row in rows.items():
+            with self.subTest(url=name):
+                self.assertEqual(row['status'], 200)
+                self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+        self.assertGreater(rows['catalog_new']['queries'], 0)
+        self.assertGreater(rows['catalog_new']['render_ms'], 0)
+
+    def test_cold_runs_keep_foreign_cache_keys(self):
+        cache.clear()
+        cache.set('other-app:session', 'value')
+        version = get_cache_version()
+        call_command('benchmark_urls', repeat=1, warmup=0, stdout=io.StringIO())
+        self.assertEqual(cache.get('other-app:session'), 'value')
+        self.assertGreater(get_cache_version(), version)
+        # Замер не меняет данные: чтение не переводится на основную базу
+        self.assertFalse(bumped_within(60))
+
+
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        for i in range(6):
+            make_book(author, f'Книга {i}', datetime.date(2020, 1, 1 + i), slug=f'book-{i}')
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('catalog'))
+        header = response['Server-Timing']
+        self.assertRegex(header, r'db;dur=[\d.]+;desc="\d+ SQL"')
+        self.assertIn('templates;dur=', header)
+        self.assertIn('total;dur=', header)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('catalog'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('adyge_requests_total{view="catalog",status="200"} 1', body)
+        self.assertIn('adyge_request_duration_seconds_count{view="catalog"} 1', body)
+        self.assertIn('adyge_db_queries_total{view="catalog"}', body)
+
+    def test_metrics_endpoint_is_local_only(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, 404)
+
+    def test_metrics_behind_proxy_use_client_address(self):
+        url = reverse('metrics')
+        # Прокси не указан в настройках: адрес 127.0.0.1 - это сам прокси
+        with override_settings(THROTTLE_PROXY_COUNT=0):
+            self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='203.0.113.5').status_code, 404)
+        with override_settings(THROTTLE_PROXY_COUNT=1):
+            self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='203.0.113.5').status_code, 404)
+            self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='127.0.0.1').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        response = self.client.get(url, REMOTE_ADDR='203.0.113.5', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_duplicate_queries_are_fingerprinted(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            fingerprint('SELECT * FROM t  WHERE id IN (%s)'),
+        )
+        with collect() as stats:
+            for book in Book.objects.all():
+                book.author.name
+        duplicates = stats.duplicates(5)
+        self.assertEqual(len(duplicates), 1)
+        sql, count, where = duplicates[0]
+        self.assertEqual(count, 6)
+        self.assertIn('main/tests.py', where)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_request_is_logged(self):
+        with self.assertLogs('main.instrumentation', 'WARNING') as logs:
+            self.client.get(reverse('about'))
+        self.assertIn('Медленный запрос about', logs.output[0])
+
+
+class StaticExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        cls.books = [
+            make_book(cls.author, f'Книга {i}', datetime.date(2020, 1, 1 + i), slug=f'book-{i}') for i in range(3)
+        ]
+        cls.news_item = News.objects.create(
+            title='Новость', slug='news-item', content='Текст', short_description='Кратко',
+            category='events', image='news/image.jpg',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_export_writes_every_read_only_page(self):
+        rendered, skipped, removed, failed = export(self.root)
+        self.assertEqual((rendered, skipped, removed, failed), (4 + 3 + 1 + 1, 0, 0, 0))
+        for path in ('index.html', 'about/index.html', 'catalog/book-0/index.html',
+                     'authors/author/index.html', 'news/news-item/index.html'):
+            self.assertTrue(os.path.exists(os.path.join(self.root, path)), path)
+        with open(os.path.join(self.root, 'catalog/book-0/index.html'), encoding='utf-8') as page:
+            self.assertIn('Книга 0', page.read())
+        # Выгрузка не считается просмотром новости
+        self.news_item.refresh_from_db()
+        self.assertEqual(self.news_item.views_count, 0)
+
+    def test_second_export_renders_only_changed_pages(self):
+        export(self.root)
+        self.assertEqual(export(self.root), (4, 5, 0, 0))
+
+        Book.objects.filter(pk=self.books[0].pk).update(title='Новое название')
+        # Меняются карточка книги и страница автора со списком книг
+        self.assertEqual(export(self.root), (6, 3, 0, 0))
+
+        Book.objects.filter(pk=self.books[1].pk).delete()
+        rendered, skipped, removed, failed = export(self.root)
+        self.assertEqual(removed, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'catalog/book-1')))
+
+    def test_related_card_badges_rerender_page(self):
+        RelatedBook.objects.create(book=self.books[0], related=self.books[1], score=1)
+        export(self.root)
+        Book.objects.filter(pk=self.books[1].pk).update(is_bestseller=True)
+        # Книга, ее автор и книга, где она в похожих, плюс страницы-списки
+        self.assertEqual(export(self.root), (7, 2, 0, 0))
+        with open(os.path.join(self.root, 'catalog/book-0/index.html'), encoding='utf-8') as page:
+            self.assertIn('Бестселлер', page.read())
+
+    def test_force_renders_everything(self):
+        export(self.root)
+        self.assertEqual(export(self.root, force=True)[0], 9)
+
+
+# Адреса сайта с асинхронными представлениями, для ROOT_URLCONF в тестах ниже
+urlpatterns = urls.site_patterns(async_views)
+
+
+@override_settings(ROOT_URLCONF=__name__, ASYNC_PARALLEL_QUERIES=False, NEWS_VIEWS_FLUSH_INTERVAL=0)
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        author_category = AuthorCategory.objects.create(name='Жанр', slug='genre')
+        cls.author = Author.objects.create(name='Автор', slug='author', bio='Био', is_popular=True)
+        cls.author.categories.add(author_category)
+        for i in range(3):
+            book = make_book(cls.author, f'Книга {i}', datetime.date(2020, 1, 1 + i), slug=f'book-{i}')
+            book.categories.add(category)
+        cls.news_item = News.objects.create(
+            title='Новость', slug='news-item', content='Текст', short_description='Кратко',
+            category='events', image='news/image.jpg',
+        )
+        cls.kwargs = {
+            'book_detail': {'slug': 'book-0'},
+            'author_detail': {'slug': 'author'},
+            'news_detail': {'slug': 'news-item'},
+            'sitemap_section': {'section': 'books', 'shard': 0},
+        }
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_every_page_renders(self):
+        for name in QUERY_BUDGETS:
+            with self.subTest(url=name):
+                response = await self.async_client.get(reverse(name, kwargs=self.kwargs.get(name)))
+                self.assertEqual(response.status_code, 200)
+
+    async def test_pages_match_sync_views(self):
+        response = await self.async_client.get(reverse('author_detail', kwargs={'slug': 'author'}))
+        for i in range(3):
+            self.assertContains(response, f'Книга {i}')
+        response = await self.async_client.get(reverse('index'))
+        self.assertContains(response, 'Книга 2')
+        self.assertContains(response, 'Новость')
+        response = await self.async_client.get(reverse('search'), {'q': 'Книга', 'format': 'json'})
+        self.assertEqual(len(response.json()['books']), 3)
+
+    async def test_missing_object_is_404(self):
+        response = await self.async_client.get(reverse('book_detail', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_news_view_is_counted(self):
+        await self.async_client.get(reverse('news_detail', kwargs={'slug': 'news-item'}))
+        await self.news_item.arefresh_from_db()
+        self.assertEqual(self.news_item.views_count, 1)
+
+    async def test_contact_form_is_saved_with_notification(self):
+        response = await self.async_client.post(reverse('contacts'), {
+            'name': 'Читатель', 'email': 'reader@example.com', 'subject': 'general',
+            'message': 'Здравствуйте', 'agree_to_terms': 'on',
+        })
+        self.assertRedirects(response, reverse('contacts'), fetch_redirect_response=False)
+        self.assertEqual(await OutboxEmail.objects.filter(contact_message__email='reader@example.com').acount(), 1)
+
+
+@override_settings(ROOT_URLCONF=__name__, ASYNC_PARALLEL_QUERIES=True)
+class AsyncParallelQueryTests(TransactionTestCase):
+    async def test_independent_queries_run_in_own_threads(self):
+        author = await Author.objects.acreate(name='Автор', slug='author', bio='Био', is_popular=True)
+        await Book.objects.acreate(
+            title='Книга', slug='book', author=author, description='Описание',
+            cover_image='books/covers/book.jpg', publication_date=datetime.date(2020, 1, 1),
+        )
+        response = await self.async_client.get(reverse('index'))
+        self.assertContains(response, 'Книга')
+        self.assertContains(response, 'Автор')
+
+
+class CatalogEntryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        cls.poetry = Category.objects.create(name='Поэзия', slug='poetry')
+        cls.prose = Category.objects.create(name='Проза', slug='prose')
+        cls.book = make_book(cls.author, 'Книга', datetime.date(2020, 1, 1), slug='book')
+        cls.book.categories.add(cls.poetry, cls.prose)
+
+    def setUp(self):
+        cache.clear()
+
+    def entry(self):
+        return CatalogEntry.objects.filter(pk=self.book.pk).first()
+
+    def test_entry_follows_book_and_categories(self):
+        entry = self.entry()
+        self.assertEqual((entry.title, entry.author_name, entry.author_slug), ('Книга', 'Автор', 'author'))
+        self.assertEqual(entry.category_slugs, ['poetry', 'prose'])
+
+        self.book.categories.remove(self.prose)
+        self.assertEqual(self.entry().category_slugs, ['poetry'])
+        self.poetry.book_set.clear()
+        self.assertEqual(self.entry().category_slugs, [])
+
+    def test_entry_follows_author_and_category_renames(self):
+        self.author.name = 'Новое имя'
+        self.author.save()
+        self.poetry.slug = 'verse'
+        self.poetry.save()
+        entry = self.entry()
+        self.assertEqual(entry.author_name, 'Новое имя')
+        self.assertEqual(entry.category_slugs, ['prose', 'verse'])
+
+        self.prose.delete()
+        self.assertEqual(self.entry().category_slugs, ['verse'])
+
+    def test_unavailable_book_leaves_catalog(self):
+        self.book.is_available = False
+        self.book.save()
+        self.assertIsNone(self.entry())
+        self.book.is_available = True
+        self.book.save(update_fields=['is_available'])
+        self.assertIsNotNone(self.entry())
+
+    def test_sync_command_repairs_drift(self):
+        Book.objects.filter(pk=self.book.pk).update(title='Исправлено')
+        make_book(self.author, 'Скрытая', datetime.date(2020, 1, 2), slug='hidden')
+        # Массовый UPDATE идет мимо сигналов
+        Book.objects.filter(slug='hidden').update(is_available=False)
+        call_command('sync_catalog', stdout=io.StringIO())
+        self.assertEqual(self.entry().title, 'Исправлено')
+        self.assertFalse(CatalogEntry.objects.filter(slug='hidden').exists())
+
+    def test_catalog_category_filter_reads_one_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('catalog'), {'category': 'poetry'})
+        self.assertContains(response, 'Книга')
+        books_sql = next(query['sql'] for query in queries.captured_queries if 'main_catalogentry' in query['sql'])
+        self.assertNotIn('JOIN', books_sql)
+        self.assertNotIn('DISTINCT', books_sql)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        cls.category = Category.objects.create(name='Поэзия', slug='poetry')
+        cls.book = make_book(cls.author, 'Книга', datetime.date(2020, 1, 1), slug='book')
+        cls.book.categories.add(cls.category)
+        cls.other = make_book(cls.author, 'Другая', datetime.date(2020, 1, 2), slug='other')
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_page_is_304_without_view_queries(self):
+        url = reverse('book_detail', kwargs={'slug': 'book'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=300', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.revalidate(url, response)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(len(queries.captured_queries), 0)
+
+        cached = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, 304)
+
+        # Правка, которая страницу не затрагивает: время изменения
+        # пересчитывается одним агрегатным запросом, ответ остается 304
+        News.objects.create(
+            title='Новость', slug='news-item', content='Текст', short_description='Кратко',
+            category='events', image='news/image.jpg',
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+    def test_hidden_or_missing_book_is_404_without_validators(self):
+        Book.objects.filter(pk=self.other.pk).update(is_available=False)
+        url = reverse('book_detail', kwargs={'slug': 'other'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+        # Без условных заголовков валидаторы для 404 не считаются вовсе
+        with mock.patch('main.conditional.validate') as validate:
+            response = self.client.get(reverse('book_detail', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+        validate.assert_not_called()
+
+    def test_changes_invalidate_validators(self):
+        detail = reverse('book_detail', kwargs={'slug': 'book'})
+        catalog = reverse('catalog')
+        first = {url: self.client.get(url) for url in (detail, catalog)}
+
+        self.author.bio = 'Новая биография'
+        self.author.save()
+        for url, response in first.items():
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+        # Удаление не оставляет updated_at, список меняется через отметку в кеше
+        response = self.client.get(catalog)
+        self.other.delete()
+        self.assertEqual(self.revalidate(catalog, response).status_code, 200)
+
+        response = self.client.get(detail)
+        self.book.categories.clear()
+        self.assertEqual(self.revalidate(detail, response).status_code, 200)
+
+    @override_settings(NEWS_VIEWS_FLUSH_INTERVAL=0)
+    def test_flushed_views_refresh_news_lists(self):
+        news_item = News.objects.create(
+            title='Новость', slug='news-item', content='Текст', short_description='Кратко',
+            category='events', image='news/image.jpg',
+        )
+        pages = [reverse('index'), reverse('news')]
+        first = {url: self.client.get(url) for url in pages}
+        # Сброс просмотров не меняет updated_at, но списки их показывают
+        self.client.get(reverse('news_detail', kwargs={'slug': news_item.slug}))
+        for url, response in first.items():
+            with self.subTest(url=url):
+                self.assertContains(response, '<i class="fas fa-eye"></i> 0</span>')
+                fresh = self.revalidate(url, response)
+                self.assertEqual(fresh.status_code, 200)
+                self.assertContains(fresh, '<i class="fas fa-eye"></i> 1</span>')
+
+    def test_pages_without_validators(self):
+        news_item = News.objects.create(
+            title='Новость', slug='news-item', content='Текст', short_description='Кратко',
+            category='events', image='news/image.jpg',
+        )
+        response = self.client.get(reverse('news_detail', kwargs={'slug': news_item.slug}))
+        self.assertFalse(response.has_header('ETag'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        response = self.client.get(reverse('book_detail', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class BulkImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Исхак Машбаш', slug='mashbash', bio='Био')
+        Category.objects.create(name='Поэзия', slug='poetry')
+        Category.objects.create(name='Проза', slug='prose')
+        make_book(cls.author, 'Старое название', datetime.date(2000, 1, 1), slug='existing')
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(text)
+        return path
+
+    def books_csv(self, count, start=0):
+        lines = ['title,author,categories,description,publication_date,cover_image,is_new']
+        lines += [
+            f'Book {start + i},mashbash,poetry;prose,Описание,2020-01-{i % 28 + 1:02d},books/covers/cover.jpg,true'
+            for i in range(count)
+        ]
+        return self.write(f'books-{count}.csv', '\n'.join(lines) + '\n')
+
+    def test_import_creates_books_with_unique_slugs_and_catalog_entries(self):
+        Book.objects.create(
+            title='Book 0', slug='book-0', author=self.author, description='Описание',
+            cover_image='books/covers/cover.jpg', publication_date=datetime.date(2020, 1, 1),
+        )
+        path = self.write('books.csv', (
+            'title,author,categories,description,publication_date,cover_image\n'
+            'Book 0,mashbash,poetry,Описание,2021-05-01,books/covers/a.jpg\n'
+            'Book 0,mashbash,prose,Описание,2021-05-02,books/covers/b.jpg\n'
+            'Book 1,nobody,poetry,Описание,2021-05-03,books/covers/c.jpg\n'
+        ))
+        output = io.StringIO()
+        call_command('import_catalog', 'books', path, stdout=output)
+        self.assertIn('Создано: 2', output.getvalue())
+        self.assertIn('пропущено строк: 1', output.getvalue())
+
+        slugs = set(Book.objects.filter(title='Book 0').values_list('slug', flat=True))
+        self.assertEqual(slugs, {'book-0', 'book-0-2', 'book-0-3'})
+        book = Book.objects.get(slug='book-0-3')
+        self.assertEqual(list(book.categories.values_list('slug', flat=True)), ['prose'])
+        self.assertEqual(CatalogEntry.objects.get(pk=book.pk).category_slugs, ['prose'])
+        self.assertEqual(search_books(Book.objects.all(), 'Book', 10)[0].title, 'Book 0')
+
+    def test_existing_rows_are_updated_by_slug(self):
+        path = self.write('books.jsonl', json.dumps({
+            'slug': 'existing', 'title': 'Новое название', 'categories': ['poetry'],
+        }, ensure_ascii=False) + '\n' + 'не json\n')
+        call_command('import_catalog', 'books', path, stdout=io.StringIO())
+        book = Book.objects.get(slug='existing')
+        self.assertEqual(book.title, 'Новое название')
+        self.assertEqual(book.publication_date, datetime.date(2000, 1, 1))
+        self.assertEqual(CatalogEntry.objects.get(pk=book.pk).title, 'Новое название')
+
+    def test_query_count_does_not_grow_with_rows(self):
+        counts = []
+        for start, count in ((0, 5), (100, 40)):
+            with CaptureQueriesContext(connection) as queries:
+                call_command('import_catalog', 'books', self.books_csv(count, start),
+                             '--skip-recommendations', stdout=io.StringIO())
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Book.objects.filter(is_new=True).count(), 45)
+
+    def test_recommendations_rebuilt_once_per_import(self):
+        for number in range(10):
+            make_book(self.author, f'Книга {number}', datetime.date(2010, 1, 1))
+        with mock.patch('main.bulk.rebuild_related_books') as rebuild, mock.patch('main.bulk.rebuild_all') as full:
+            call_command('import_catalog', 'books', self.books_csv(2), stdout=io.StringIO())
+            rebuild.assert_called_once()
+            self.assertEqual(len(rebuild.call_args.args[0]), 2)
+            full.assert_not_called()
+            # Импорт, затронувший большую часть книг, - полный пересчет
+            call_command('import_catalog', 'books', self.books_csv(20, 100), stdout=io.StringIO())
+            self.assertEqual(rebuild.call_count, 1)
+            full.assert_called_once()
+
+    def test_cover_files_are_uploaded(self):
+        files = os.path.join(self.directory, 'files')
+        os.mkdir(files)
+        Image.new('RGB', (400, 600), 'purple').save(os.path.join(files, 'cover.jpg'), 'JPEG')
+        path = self.write('books.csv', (
+            'title,author,description,publication_date,cover_image\n'
+            'Book,mashbash,Описание,2021-05-01,cover.jpg\n'
+            'Broken,mashbash,Описание,2021-05-01,missing.jpg\n'
+        ))
+        with override_settings(MEDIA_ROOT=os.path.join(self.directory, 'media')):
+            call_command('import_catalog', 'books', path, '--files', files, stdout=io.StringIO())
+            book = Book.objects.get(title='Book')
+            self.assertTrue(book.cover_image.name.startswith('books/covers/cover'))
+            self.assertTrue(default_storage.exists(book.cover_image.name))
+        self.assertFalse(Book.objects.filter(title='Broken').exists())
+
+    def test_bad_files_fail_only_their_rows(self):
+        files = os.path.join(self.directory, 'files')
+        os.mkdir(files)
+        Image.new('RGB', (400, 600), 'purple').save(os.path.join(files, 'cover.jpg'), 'JPEG')
+        Image.new('RGB', (400, 600), 'purple').save(os.path.join(self.directory, 'outside.jpg'), 'JPEG')
+        with open(os.path.join(files, 'corrupt.jpg'), 'wb') as corrupt:
+            corrupt.write(b'not an image')
+        path = self.write('books.csv', (
+            'title,author,description,publication_date,cover_image\n'
+            'Book,mashbash,Описание,2021-05-01,cover.jpg\n'
+            'Escape,mashbash,Описание,2021-05-01,../outside.jpg\n'
+            f'Absolute,mashbash,Описание,2021-05-01,{os.path.join(self.directory, "outside.jpg")}\n'
+            'Corrupt,mashbash,Описание,2021-05-01,corrupt.jpg\n'
+        ))
+        output = io.StringIO()
+        with override_settings(MEDIA_ROOT=os.path.join(self.directory, 'media')), \
+                self.assertLogs('main.bulk', 'WARNING') as logs:
+            call_command('import_catalog', 'books', path, '--files', files, stdout=output)
+        self.assertIn('пропущено строк: 3', output.getvalue())
+        self.assertEqual(list(Book.objects.filter(title__in=['Book', 'Escape', 'Absolute', 'Corrupt']).values_list(
+            'title', flat=True)), ['Book'])
+        self.assertIn('вне каталога', '\n'.join(logs.output))
+
+    def test_recommendations_rebuilt_per_batch(self):
+        for number in range(20):
+            make_book(self.author, f'Книга {number}', datetime.date(2010, 1, 1))
+        with mock.patch('main.bulk.rebuild_related_books') as rebuild, mock.patch('main.bulk.rebuild_all') as full:
+            call_command('import_catalog', 'books', self.books_csv(4), '--batch-size', '2', stdout=io.StringIO())
+        self.assertEqual([len(call.args[0]) for call in rebuild.call_args_list], [2, 2])
+        full.assert_not_called()
+
+    def test_export_round_trip(self):
+        Book.objects.get(slug='existing').categories.add(Category.objects.get(slug='poetry'))
+        for fmt in ('csv', 'jsonl'):
+            with self.subTest(format=fmt):
+                path = os.path.join(self.directory, f'books.{fmt}')
+                call_command('export_catalog', 'books', path)
+                Book.objects.filter(slug='existing').update(title='Испорчено')
+                call_command('import_catalog', 'books', path, stdout=io.StringIO())
+                book = Book.objects.get(slug='existing')
+                self.assertEqual(book.title, 'Старое название')
+                self.assertEqual(list(book.categories.values_list('slug', flat=True)), ['poetry'])
+                self.assertEqual(Book.objects.count(), 1)
+
+
+def make_untitled_book(author, title):
+    return Book.objects.create(
+        title=title, author=author, description='Описание', cover_image='books/covers/cover.jpg',
+        publication_date=datetime.date(2020, 1, 1),
+    )
+
+
+class SlugTests(TestCase):
+    def test_cyrillic_and_adyghe_titles_are_transliterated(self):
+        self.assertEqual(transliterate('Щедрая осень'), 'shchedraya osen')
+        self.assertEqual(transliterate('КIэлэцIыкIу гъатхэ'), 'kieletsiykiu ghatkhe')
+        self.assertEqual(transliterate('Ёлка'), 'elka')
+        category = Category.objects.create(name='Поэзия')
+        self.assertEqual(category.slug, 'poeziya')
+
+    def test_palochka_title_round_trips_through_slug(self):
+        author = Author.objects.create(name='Автор', bio='Био')
+        book = make_untitled_book(author, 'КӀэлэцӀыкӀу усэхэр')
+        self.assertEqual(book.slug, 'kieletsiykiu-usekher')
+        # Тот же заголовок без палочки - другое слово и другой адрес
+        self.assertNotEqual(make_untitled_book(author, 'Кэлэцыку усэхэр').slug, book.slug)
+        response = self.client.get(reverse('book_detail', args=[book.slug]))
+        self.assertContains(response, 'КӀэлэцӀыкӀу усэхэр')
+
+    def test_digits_next_to_cyrillic_stay_digits(self):
+        # Палочкой считается только сама буква Ӏ, а не похожие на нее символы
+        self.assertEqual(transliterate('Книга1'), 'kniga1')
+        self.assertEqual(base_slug(Book, 'Том 1-й'), 'tom-1-y')
+        self.assertEqual(base_slug(Book, 'Кӏэ'), 'kie')
+
+    def test_same_titles_get_numbered_suffixes(self):
+        author = Author.objects.create(name='Исхак Машбаш', bio='Био')
+        Author.objects.create(name='Исхак Машбаш-младший', bio='Био')
+        self.assertEqual(author.slug, 'iskhak-mashbash')
+        books = [make_untitled_book(author, 'Сказки') for _ in range(3)]
+        self.assertEqual([book.slug for book in books], ['skazki', 'skazki-2', 'skazki-3'])
+        with transaction.atomic():
+            self.assertEqual(unique_slugs(Book, ['Сказки', 'Сказки', '!!!']), ['skazki-4', 'skazki-5', 'book'])
+
+
+class ConcurrentSlugTests(TransactionTestCase):
+    def test_concurrent_insert_waits_for_lock(self):
+        author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        created = []
+
+        def save_in_thread():
+            try:
+                created.append(make_untitled_book(author, 'Сказки'))
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            book = make_untitled_book(author, 'Сказки')
+            thread = threading.Thread(target=save_in_thread)
+            thread.start()
+            # Второе сохранение ждет блокировку основы до коммита первого
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+        thread.join(10)
+        self.assertEqual((book.slug, created[0].slug), ('skazki', 'skazki-2'))
+
+    def test_numbered_base_shares_lock_with_plain_base(self):
+        # "Сказки 2" - основа skazki-2, тот же slug, что у второй книги "Сказки"
+        author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        created = []
+
+        def save_in_thread():
+            try:
+                created.append(make_untitled_book(author, 'Сказки 2'))
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            make_untitled_book(author, 'Сказки')
+            thread = threading.Thread(target=save_in_thread)
+            thread.start()
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(make_untitled_book(author, 'Сказки').slug, 'skazki-2')
+        thread.join(10)
+        self.assertEqual(created[0].slug, 'skazki-2-2')
+
+
+class CatalogFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        poetry = Category.objects.create(name='Поэзия', slug='poetry')
+        prose = Category.objects.create(name='Проза', slug='prose')
+        Category.objects.create(name='Детям', slug='children')
+        first = Author.objects.create(name='Первый', slug='first', bio='Био')
+        second = Author.objects.create(name='Второй', slug='second', bio='Био')
+        books = [
+            (first, datetime.date(2019, 5, 1), [poetry], {'is_new': True}),
+            (first, datetime.date(2020, 5, 1), [poetry, prose], {'is_bestseller': True}),
+            (second, datetime.date(2020, 6, 1), [prose], {}),
+            (second, datetime.date(2021, 6, 1), [prose], {'is_bestseller': True}),
+        ]
+        for i, (author, date, categories, flags) in enumerate(books):
+            make_book(author, f'Книга {i}', date, slug=f'book-{i}', **flags).categories.set(categories)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_facets_combine_and_count_other_filters(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('catalog'), {'category': ['poetry', 'prose'], 'author': 'second'})
+        self.assertEqual(len(response.context['books']), 2)
+        facets = response.context['facets']
+        # Категории считаются по книгам второго автора, авторы - по обеим категориям
+        self.assertEqual(facets['categories'], [
+            ('children', 'Детям', 0, False), ('poetry', 'Поэзия', 0, True), ('prose', 'Проза', 2, True),
+        ])
+        self.assertEqual(facets['authors'], [('second', 'Второй', 2, True), ('first', 'Первый', 2, False)])
+        self.assertEqual(facets['years'], [(2020, 1), (2021, 1)])
+        self.assertEqual(facets['flags'], {'new': 0, 'bestseller': 1})
+        facet_queries = [query for query in queries.captured_queries if 'UNION ALL' in query['sql']]
+        self.assertEqual(len(facet_queries), 1)
+
+    def test_year_range_and_flags(self):
+        response = self.client.get(reverse('catalog'), {'year_from': '2020', 'year_to': '2020', 'bestseller': '1'})
+        self.assertEqual([book.slug for book in response.context['books']], ['book-1'])
+        self.assertEqual(response.context['facets']['flags'], {'new': 0, 'bestseller': 1})
+
+    def test_popular_sort_keeps_all_books(self):
+        response = self.client.get(reverse('catalog'), {'sort': 'popular'})
+        self.assertEqual([book.slug for book in response.context['books']], ['book-3', 'book-1', 'book-2', 'book-0'])
+        response = self.client.get(reverse('catalog_page'), {'sort': 'popular', 'author': 'first'})
+        self.assertEqual(response.json()['html'].count('book-card'), 2)
+
+
+class ContactArchiveTests(TestCase):
+    def make_message(self, days, is_processed=True, **kwargs):
+        return ContactMessage.objects.create(
+            name='Читатель', email='reader@example.com', subject='general', message='Здравствуйте',
+            agree_to_terms=True, is_processed=is_processed,
+            created_at=timezone.now() - datetime.timedelta(days=days), **kwargs,
+        )
+
+    def test_moves_old_processed_messages_in_batches(self):
+        old = [self.make_message(400) for _ in range(3)]
+        sent = self.make_message(300)
+        OutboxEmail.objects.create(
+            contact_message=sent, subject='s', body='b', from_email='', recipients='', status=OutboxEmail.STATUS_SENT,
+        )
+        queued = self.make_message(300)
+        OutboxEmail.objects.create(contact_message=queued, subject='s', body='b', from_email='', recipients='')
+        unprocessed = self.make_message(400, is_processed=False)
+        recent = self.make_message(10)
+
+        before = archive_cutoff(180)
+        self.assertEqual(archive_batch(before, limit=2), 2)
+        self.assertEqual(archive_batch(before, limit=2), 2)
+        self.assertEqual(archive_batch(before, limit=2), 0)
+
+        self.assertEqual(
+            set(ArchivedContactMessage.objects.values_list('pk', flat=True)), {m.pk for m in old} | {sent.pk},
+        )
+        self.assertEqual(ArchivedContactMessage.objects.get(pk=sent.pk).email_status, OutboxEmail.STATUS_SENT)
+        self.assertEqual(
+            set(ContactMessage.objects.values_list('pk', flat=True)), {queued.pk, unprocessed.pk, recent.pk},
+        )
+        self.assertEqual(OutboxEmail.objects.get().contact_message, queued)
+
+    def test_command(self):
+        self.make_message(400)
+        output = io.StringIO()
+        call_command('archive_contact_messages', '--dry-run', stdout=output)
+        self.assertIn('К переносу: 1', output.getvalue())
+        call_command('archive_contact_messages', '--batch-size', '10', stdout=output)
+        self.assertIn('Перенесено в архив: 1', output.getvalue())
+        self.assertFalse(ContactMessage.objects.exists())
+
+    def test_estimated_count_is_bounded(self):
+        for _ in range(8):
+            self.make_message(1)
+        messages = ContactMessage.objects.all()
+        self.assertEqual(EstimatedCountPaginator(messages, 5).count, 8)
+        with mock.patch.object(EstimatedCountPaginator, 'EXACT_LIMIT', 3):
+            with CaptureQueriesContext(connection) as queries:
+                count = EstimatedCountPaginator(messages, 5).count
+        # Точный подсчет остановился на четвертой строке, дальше - оценка
+        self.assertGreaterEqual(count, 4)
+        self.assertIn('LIMIT 4', queries.captured_queries[0]['sql'])
+        self.assertTrue(queries.captured_queries[1]['sql'].startswith('EXPLAIN'))
+
+    def test_admin_changelist_and_search(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.make_message(1)
+        response = self.client.get(reverse('admin:main_contactmessage_changelist'), {'q': 'здравств'})
+        self.assertContains(response, 'reader@example.com')
+        self.assertFalse(response.context['cl'].show_full_result_count)
+        response = self.client.get(reverse('admin:main_archivedcontactmessage_changelist'))
+        self.assertEqual(response.status_code, 200)
+        # Страница архива читается из B-tree по дате, без сортировки всей таблицы
+        queryset = response.context['cl'].result_list
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        self.assertIn('contact_archive_recent_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.poetry = Category.objects.create(name='Поэзия', slug='poetry')
+        cls.prose = Category.objects.create(name='Проза', slug='prose')
+        cls.genre = AuthorCategory.objects.create(name='Жанр', slug='genre')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def add_rows(self, count):
+        for _ in range(count):
+            number = Author.objects.count()
+            author = Author.objects.create(name=f'Автор {number}', slug=f'author-{number}', bio='Био')
+            author.categories.add(self.genre)
+            make_book(author, f'Книга {number}', datetime.date(2020, 1, 1)).categories.add(self.poetry)
+
+    def changelist_queries(self, model):
+        url = reverse(f'admin:main_{model}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.add_rows(2)
+        counts = {model: self.changelist_queries(model) for model in ('author', 'book')}
+        self.add_rows(5)
+        self.assertEqual({model: self.changelist_queries(model) for model in ('author', 'book')}, counts)
+
+    def test_autocomplete_filter_reads_only_selected_value(self):
+        self.add_rows(1)
+        url = reverse('admin:main_book_changelist')
+        response = self.client.get(url)
+        self.assertContains(response, 'data-field-name="categories"')
+        self.assertNotContains(response, '>Проза<')
+        response = self.client.get(url, {'categories__id__exact': self.poetry.pk})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertContains(response, f'<option value="{self.poetry.pk}" selected>Поэзия</option>', html=True)
+
+    def test_bulk_actions_update_catalog(self):
+        self.add_rows(3)
+        books = list(Book.objects.order_by('pk'))
+        url = reverse('admin:main_book_changelist')
+        selected = [book.pk for book in books[:2]]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'action': 'set_is_bestseller', '_selected_action': selected})
+        self.assertEqual(
+            set(CatalogEntry.objects.filter(is_bestseller=True).values_list('book', flat=True)), set(selected),
+        )
+        with mock.patch('main.admin.rebuild_related_books', wraps=rebuild_related_books) as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(url, {'action': 'add_category', 'category': self.prose.pk, '_selected_action': selected})
+        # Один пересчет похожих на все выбранные книги
+        rebuild.assert_called_once()
+        self.assertEqual(sorted(rebuild.call_args.args[0]), selected)
+        self.assertEqual([related.pk for related in Book.objects.recommended_for(books[0])], [books[1].pk, books[2].pk])
+        self.assertEqual(
+            sorted(CatalogEntry.objects.get(book=books[0]).category_slugs), ['poetry', 'prose'],
+        )
+        self.assertEqual(self.prose.book_set.count(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'action': 'unset_is_available', '_selected_action': selected})
+        self.assertFalse(CatalogEntry.objects.filter(book__in=selected).exists())
+
+        author = Author.objects.order_by('pk').first()
+        self.client.post(reverse('admin:main_author_changelist'), {
+            'action': 'set_is_popular', '_selected_action': [author.pk],
+        })
+        self.assertTrue(Author.objects.get(pk=author.pk).is_popular)
+
+
+class StaticAssetTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_minify_css_keeps_strings_and_licenses(self):
+        css = '/* c */\na > b , c :hover { content: "a ; b" ; width: calc(100% - 1px); }\n/*! license */'
+        self.assertEqual(minify_css(css), 'a>b,c :hover{content:"a ; b";width:calc(100% - 1px)}/*! license */')
+
+    def test_collectstatic_hashes_minifies_and_serves_precompressed(self):
+        storages = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'main.storage.StaticStorage'}}
+        with override_settings(
+            STATIC_ROOT=self.root, STORAGES=storages, STATIC_SERVE=True,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+        ):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            url = static('css/styles.css')
+            self.assertRegex(url, r'^/static/css/styles\.[0-9a-f]{12}\.css$')
+            name = url[len('/static/'):]
+            with open(os.path.join(self.root, name), encoding='utf-8') as stylesheet:
+                self.assertNotIn('\n', stylesheet.read())
+            self.assertTrue(os.path.exists(os.path.join(self.root, name + '.gz')))
+
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertIn(b'--font-main', gzip.decompress(b''.join(response.streaming_content)))
+            self.assertEqual(
+                self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                304,
+            )
+
+            response = self.client.get('/static/css/styles.css', HTTP_ACCEPT_ENCODING='gzip;q=0')
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(response['Cache-Control'], 'public, max-age=300')
+            self.assertEqual(self.client.get('/static/../manage.py').status_code, 404)
+
+    def test_build_icons_keeps_only_used_glyphs(self):
+        source = os.path.join(self.root, 'fontawesome')
+        os.makedirs(os.path.join(source, 'metadata'))
+        os.makedirs(os.path.join(source, 'webfonts'))
+        icons = {
+            'phone': {'unicode': 'f095', 'styles': ['solid']},
+            'location-dot': {'unicode': 'f3c5', 'styles': ['solid'], 'aliases': {'names': ['map-marker-alt']}},
+            'anchor': {'unicode': 'f13d', 'styles': ['solid']},
+            'vk': {'unicode': 'f189', 'styles': ['brands']},
+        }
+        with open(os.path.join(source, 'metadata', 'icons.json'), 'w') as metadata:
+            json.dump(icons, metadata)
+        with open(os.path.join(source, 'webfonts', 'fa-solid-900.woff2'), 'wb') as font:
+            font.write(b'font')
+        with open(os.path.join(self.root, 'page.html'), 'w') as page:
+            page.write('<i class="fas fa-phone"></i><i class="fas fa-map-marker-alt"></i><i class="fas fa-missing"></i>')
+
+        output = os.path.join(self.root, 'out')
+        with mock.patch('main.assets.font_subset', None):
+            used, unknown = build_icons(source, output, [self.root])
+        self.assertEqual(used, ['map-marker-alt', 'phone'])
+        self.assertEqual(unknown, ['missing'])
+        with open(os.path.join(output, 'icons.css'), encoding='utf-8') as stylesheet:
+            css = stylesheet.read()
+        self.assertIn('.fa-map-marker-alt:before{content:"\\f3c5"}', css)
+        self.assertNotIn('anchor', css)
+        # Фирменные значки не используются - их шрифт не нужен
+        self.assertNotIn('Brands', css)
+        self.assertTrue(os.path.exists(os.path.join(output, 'webfonts', 'fa-solid-900.woff2')))
+
+
+@override_settings(DEBUG=False, TESTING=False)
+class SharedCacheCheckTests(TestCase):
+    def test_process_local_cache_is_refused_in_production(self):
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=local):
+            self.assertEqual([error.id for error in shared_cache(None)], ['main.E001'])
+            with override_settings(PAGE_CACHE_TIMEOUT=0, THROTTLE_ENABLED=False):
+                self.assertEqual(shared_cache(None), [])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'main_cache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(shared_cache(None), [])
+
+
+class WarmupTests(TestCase):
+    def test_templates_are_cached_after_warmup(self):
+        self.assertEqual(compile_templates(), len(template_names()))
+        self.assertIn('base.html', template_names())
+        loader = settings.TEMPLATES[0]['OPTIONS']['loaders'][0]
+        self.assertEqual(loader[0], 'django.template.loaders.cached.Loader')
+
+    def test_warmup_requests_configured_pages(self):
+        # Закрытие соединений внутри транзакции теста сломало бы тест
+        with override_settings(WARMUP_PAGES=['/about/', '/missing-page/']), \
+                mock.patch('main.warmup.connections.close_all') as close_all:
+            result = warmup()
+        self.assertEqual(result['pages'], {'/about/': 200, '/missing-page/': 404})
+        self.assertEqual(result['templates'], len(template_names()))
+        close_all.assert_called_once()
+
+        with override_settings(TEMPLATE_WARMUP=False):
+            self.assertIsNone(warmup())
+
+
+@mock.patch('main.routers.replicas', return_value=['replica1'])
+class ReplicaRoutingTests(TestCase):
+    # Без второй базы: проверяем, куда роутер направил бы запросы
+    def setUp(self):
+        cache.clear()
+
+    def databases_for(self, request):
+        seen = {}
+
+        def get_response(request):
+            seen['read'] = Book.objects.all().db
+            seen['write'] = router.db_for_write(Book)
+            return HttpResponse()
+
+        response = ReplicaMiddleware(get_response)(request)
+        return seen, response
+
+    def test_public_pages_read_from_replica(self, replicas):
+        seen, response = self.databases_for(RequestFactory().get('/catalog/'))
+        self.assertEqual(seen, {'read': 'replica1', 'write': 'default'})
+        self.assertNotIn('db_primary', response.cookies)
+        # Вне запроса - основная база
+        self.assertEqual(Book.objects.all().db, 'default')
+
+    def test_admin_and_unknown_urls_use_primary(self, replicas):
+        for path in ('/admin/main/book/', '/no-such-page/'):
+            seen, _ = self.databases_for(RequestFactory().get(path))
+            self.assertEqual(seen['read'], 'default')
+
+    @override_settings(DB_REPLICA_STICKY_SECONDS=15)
+    def test_post_sticks_client_to_primary(self, replicas):
+        seen, response = self.databases_for(RequestFactory().post('/contacts/'))
+        self.assertEqual(seen['read'], 'default')
+        self.assertEqual(response.cookies['db_primary']['max-age'], 15)
+
+        request = RequestFactory().get('/catalog/')
+        request.COOKIES['db_primary'] = '1'
+        seen, _ = self.databases_for(request)
+        self.assertEqual(seen['read'], 'default')
+
+    @override_settings(DB_REPLICA_STICKY_SECONDS=15)
+    def test_reads_from_primary_right_after_data_changes(self, replicas):
+        # Иначе отстающая реплика отдала бы старые данные под новой версией кеша
+        bump_cache_version()
+        seen, _ = self.databases_for(RequestFactory().get('/catalog/'))
+        self.assertEqual(seen['read'], 'default')
+        with mock.patch('main.cache.time.time', return_value=time.time() + 16):
+            seen, _ = self.databases_for(RequestFactory().get('/catalog/'))
+        self.assertEqual(seen['read'], 'replica1')
+
+    def test_async_views_see_replica_in_worker_threads(self, replicas):
+        async def get_response(request):
+            read = await sync_to_async(lambda: Book.objects.all().db, thread_sensitive=False)()
+            return HttpResponse(read)
+
+        response = async_to_sync(ReplicaMiddleware(get_response))(RequestFactory().get('/news/'))
+        self.assertEqual(response.content, b'replica1')
+
+    def test_migrations_only_on_primary(self, replicas):
+        self.assertTrue(ReplicaRouter().allow_migrate('default', 'main'))
+        self.assertFalse(ReplicaRouter().allow_migrate('replica1', 'main'))
+
+    def test_middleware_disabled_without_replicas(self, replicas):
+        replicas.return_value = []
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaMiddleware(lambda request: HttpResponse())
+
+
+@override_settings(
+    THROTTLE_RATES={'contacts': {'ip': '3/m', 'session': '2/m'}, 'search': {'ip': '2/m', 'session': '2/m'}},
+    THROTTLE_PROXY_COUNT=0, CONTACT_DUPLICATE_SECONDS=3600,
+)
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttle.metrics.reset()
+
+    def post_contact(self, message, **extra):
+        return self.client.post(reverse('contacts'), {
+            'name': 'Читатель', 'email': 'reader@example.com', 'subject': 'general',
+            'message': message, 'agree_to_terms': 'on',
+        }, **extra)
+
+    def test_parse_rate(self):
+        self.assertEqual(throttle.parse_rate('5/10m'), (5, 600))
+        self.assertEqual(throttle.parse_rate('30/m'), (30, 60))
+        with self.assertRaises(ValueError):
+            throttle.parse_rate('5/week')
+
+    def test_bucket_refills_over_time(self):
+        keys = {'ip': '10.0.0.1'}
+        self.assertIsNone(throttle.take('search', keys, now=1000))
+        self.assertIsNone(throttle.take('search', keys, now=1000))
+        self.assertEqual(throttle.take('search', keys, now=1000), ('ip', 30))
+        # Токен восстанавливается за 30 секунд
+        self.assertIsNone(throttle.take('search', keys, now=1030))
+        self.assertIsNotNone(throttle.take('search', keys, now=1030))
+
+    def test_async_middleware_uses_async_cache(self):
+        async def view(request):
+            return HttpResponse('ok')
+
+        middleware = ThrottleMiddleware(view)
+        request = RequestFactory().get(reverse('search'), {'q': 'книга'})
+        # Синхронные get_many/set_many в цикле событий заблокировали бы его
+        with mock.patch.object(cache, 'get_many', side_effect=AssertionError), \
+                mock.patch.object(cache, 'set_many', side_effect=AssertionError):
+            statuses = [async_to_sync(middleware)(request).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_contact_posts_are_rejected_before_the_database(self):
+        for number in range(3):
+            self.assertEqual(self.post_contact(f'Сообщение {number}').status_code, 302)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_contact('Сообщение 4')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(ContactMessage.objects.count(), 3)
+        # Форма по-прежнему открывается, другой адрес не затронут
+        self.assertEqual(self.client.get(reverse('contacts')).status_code, 200)
+        self.assertEqual(self.post_contact('Другой', REMOTE_ADDR='10.0.0.2').status_code, 302)
+
+    def test_session_bucket_and_forwarded_address(self):
+        # Пустую сессию SessionMiddleware удаляет, поэтому cookie передаем в каждом запросе
+        cookie = f'{settings.SESSION_COOKIE_NAME}=session'
+        for number in range(2):
+            self.post_contact(f'Сообщение {number}', REMOTE_ADDR=f'10.0.0.{number}', HTTP_COOKIE=cookie)
+        self.assertEqual(self.post_contact('Еще', REMOTE_ADDR='10.0.0.9', HTTP_COOKIE=cookie).status_code, 429)
+        self.assertEqual(self.post_contact('Еще', REMOTE_ADDR='10.0.0.9').status_code, 302)
+
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='1.1.1.1, 2.2.2.2')
+        self.assertEqual(throttle.client_ip(request), '10.0.0.1')
+        with override_settings(THROTTLE_PROXY_COUNT=1):
+            self.assertEqual(throttle.client_ip(request), '2.2.2.2')
+        request = RequestFactory().get('/', REMOTE_ADDR='2001:db8::1')
+        self.assertEqual(throttle.client_ip(request), '2001:db8::/64')
+
+    def test_duplicate_contact_message_is_saved_once(self):
+        self.assertEqual(self.post_contact('Здравствуйте').status_code, 302)
+        response = self.post_contact('  Здравствуйте ')
+        self.assertRedirects(response, reverse('contacts'))
+        self.assertEqual(ContactMessage.objects.count(), 1)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+        self.assertEqual(throttle.metrics.duplicates, 1)
+
+    def test_only_real_searches_are_limited(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('catalog')).status_code, 200)
+            self.assertEqual(self.client.get(reverse('search'), {'q': 'а'}).status_code, 200)
+        self.client.get(reverse('search'), {'q': 'книга'})
+        self.client.get(reverse('catalog'), {'search': 'книга'})
+        self.assertEqual(self.client.get(reverse('catalog_page'), {'search': 'книга'}).status_code, 429)
+
+        output = throttle.metrics.render()
+        self.assertIn('adyge_throttle_checked_total{scope="search"} 3', output)
+        self.assertIn('adyge_throttle_limited_total{scope="search",key="ip"} 1', output)
+
+
+class SitemapTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Автор', slug='author', bio='Био')
+        cls.books = [make_book(author, f'Книга {i}', datetime.date(2020, 1, 1), slug=f'book-{i}') for i in range(5)]
+        make_book(author, 'Скрытая', datetime.date(2020, 1, 1), slug='hidden', is_available=False)
+        News.objects.create(
+            title='Презентация сборника', slug='presentation', content='Текст', short_description='Кратко',
+            category='events', image='news/image.jpg',
+        )
+        News.objects.create(
+            title='Черновик', slug='draft', content='Текст', short_description='Кратко',
+            category='events', image='news/image.jpg', is_published=False,
+        )
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('main.sitemaps.SHARD_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_index_lists_nonempty_shards(self):
+        response = self.client.get(reverse('sitemap'))
+        self.assertEqual(response['Content-Type'], 'application/xml; charset=utf-8')
+        content = response.content.decode()
+        for shard in {book.pk // 2 for book in self.books}:
+            self.assertIn(f'<loc>http://testserver/sitemap-books-{shard}.xml</loc><lastmod>', content)
+        self.assertIn('http://testserver/sitemap-pages-0.xml', content)
+        self.assertIn('sitemap-news-', content)
+
+    def test_shard_is_streamed_then_cached(self):
+        shard = self.books[0].pk // 2
+        url = reverse('sitemap_section', kwargs={'section': 'books', 'shard': shard})
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        expected = [book.slug for book in self.books if book.pk // 2 == shard]
+        self.assertEqual(content.count('<url>'), len(expected))
+        for slug in expected:
+            self.assertIn(f'<loc>http://testserver/catalog/{slug}/</loc><lastmod>', content)
+        self.assertTrue(content.endswith('</urlset>\n'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content.decode(), content)
+        self.assertEqual(len(queries), 0)
+
+        # Скрытые книги в карту не попадают, новые строки - после смены версии кеша
+        hidden = Book.objects.get(slug='hidden')
+        response = self.client.get(reverse('sitemap_section', kwargs={'section': 'books', 'shard': hidden.pk // 2}))
+        if Book.objects.available().filter(pk__in=[hidden.pk ^ 1]).exists():
+            self.assertNotIn('hidden', b''.join(response.streaming_content).decode())
+        else:
+            # В части только скрытая книга
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get('/sitemap-unknown-0.xml').status_code, 404)
+
+    def test_shard_past_the_last_is_404(self):
+        last = max(book.pk for book in self.books) // 2
+        for shard in (last + 10, 10 ** 18):
+            with self.subTest(shard=shard):
+                url = reverse('sitemap_section', kwargs={'section': 'books', 'shard': shard})
+                self.assertEqual(self.client.get(url).status_code, 404)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"stale"').status_code, 404)
+        self.assertEqual(self.client.get('/sitemap-pages-1.xml').status_code, 404)
+
+    def test_news_feeds(self):
+        response = self.client.get(reverse('news_feed'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('application/rss+xml', response['Content-Type'])
+        self.assertIn('Презентация сборника', response.content.decode())
+        self.assertIn('http://testserver/news/presentation/', response.content.decode())
+        self.assertNotIn('Черновик', response.content.decode())
+
+        response = self.client.get(reverse('news_feed_atom'))
+        self.assertIn('application/atom+xml', response['Content-Type'])
+        self.assertIn('<updated>', response.content.decode())
+
+    def test_robots_points_to_sitemap(self):
+        response = self.client.get(reverse('robots_txt'))
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertIn('Sitemap: http://testserver/sitemap.xml', response.content.decode())
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncSitemapTests(TransactionTestCase):
+    async def test_shard_is_streamed_from_async_iterator(self):
+        author = await Author.objects.acreate(name='Автор', slug='author', bio='Био')
+        book = await Book.objects.acreate(
+            title='Книга', slug='book', author=author, description='Описание',
+            cover_image='books/covers/book.jpg', publication_date=datetime.date(2020, 1, 1),
+        )
+        response = await self.async_client.get(reverse(
+            'sitemap_section', kwargs={'section': 'books', 'shard': book.pk // sitemaps.SHARD_SIZE},
+        ))
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('<loc>http://testserver/catalog/book/</loc>', content)
+        response = await self.async_client.get(reverse(
+            'sitemap_section', kwargs={'section': 'books', 'shard': book.pk // sitemaps.SHARD_SIZE + 1},
+        ))
+        self.assertEqual(response.status_code, 404)
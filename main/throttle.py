@@ -0,0 +1,210 @@
+import hashlib
+import ipaddress
+import math
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import Resolver404, resolve
+
+from .search import MIN_QUERY_LENGTH
+
+# Ограничение частоты дорогих запросов: отправки формы контактов (строка
+# в базе и письмо) и поиска (запросы с произвольной строкой не попадают
+# в кеш страниц). Для каждого клиента в кеше Django хранится корзина
+# токенов: запрос забирает токен, токены восполняются равномерно. Клиент -
+# это IP-адрес и, если есть, cookie сессии. ThrottleMiddleware проверяет
+# корзины до разбора сессии и до представления, поэтому отклоненный запрос
+# не доходит до базы. Чтение и запись корзины не атомарны: при гонке
+# клиент может получить пару лишних запросов, что для защиты от ботов
+# неважно. С несколькими процессами нужен общий кеш (REDIS_URL).
+
+# Маршрут -> (область с общими корзинами, какие запросы считаются)
+ROUTES = {
+    'contacts': ('contacts', lambda request: request.method == 'POST'),
+    'search': ('search', lambda request: _searching(request, 'q')),
+    'catalog': ('search', lambda request: _searching(request, 'search')),
+    'catalog_page': ('search', lambda request: _searching(request, 'search')),
+}
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def _searching(request, param):
+    return len(request.GET.get(param, '').strip()) >= MIN_QUERY_LENGTH
+
+
+def parse_rate(rate):
+    # '5/10m' -> (5, 600): 5 запросов подряд, затем по одному раз в 2 минуты
+    count, _, period = rate.partition('/')
+    number, unit = period[:-1] or '1', period[-1:]
+    if unit not in PERIODS or not count.isdigit() or not number.isdigit():
+        raise ValueError(f'Неверная ставка ограничения: {rate!r}')
+    return int(count), int(number) * PERIODS[unit]
+
+
+def client_address(request):
+    # За THROTTLE_PROXY_COUNT прокси адрес клиента - последний, добавленный
+    # нашими прокси в X-Forwarded-For; более ранние клиент может подделать
+    address = request.META.get('REMOTE_ADDR', '')
+    if settings.THROTTLE_PROXY_COUNT:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        if forwarded:
+            address = forwarded[-min(settings.THROTTLE_PROXY_COUNT, len(forwarded))]
+    return address
+
+
+def client_ip(request):
+    address = client_address(request)
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address
+    if ip.version == 6:
+        # Провайдер выдает абоненту целую сеть /64
+        return str(ipaddress.ip_network(f'{ip}/64', strict=False))
+    return str(ip)
+
+
+def client_keys(request):
+    keys = {'ip': client_ip(request)}
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if session:
+        keys['session'] = hashlib.md5(session.encode('utf-8')).hexdigest()
+    return keys
+
+
+def _buckets(scope, keys):
+    rates = settings.THROTTLE_RATES[scope]
+    return {
+        f'main:throttle:{scope}:{kind}:{value}': (kind, *parse_rate(rates[kind]))
+        for kind, value in keys.items() if kind in rates
+    }
+
+
+def _spend(buckets, states, now):
+    # (отказ или None, новые состояния корзин, срок их хранения)
+    updated = {}
+    for key, (kind, capacity, period) in buckets.items():
+        tokens, last = states.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * capacity / period)
+        if tokens < 1:
+            return (kind, math.ceil((1 - tokens) * period / capacity)), None, None
+        updated[key] = (tokens - 1, now)
+    # Через period корзина в любом случае полная - запись больше не нужна
+    return None, updated, max((period for _, _, period in buckets.values()), default=None)
+
+
+def take(scope, keys, now=None):
+    # Забирает по токену из корзин клиента. Возвращает None, если запрос
+    # разрешен, или (тип ключа, через сколько секунд повторить)
+    now = time.time() if now is None else now
+    buckets = _buckets(scope, keys)
+    limited, updated, timeout = _spend(buckets, cache.get_many(list(buckets)), now)
+    if updated:
+        cache.set_many(updated, timeout=timeout)
+    return limited
+
+
+async def atake(scope, keys, now=None):
+    # То же для асинхронных запросов: обращение к Redis не блокирует цикл событий
+    now = time.time() if now is None else now
+    buckets = _buckets(scope, keys)
+    limited, updated, timeout = _spend(buckets, await cache.aget_many(list(buckets)), now)
+    if updated:
+        await cache.aset_many(updated, timeout=timeout)
+    return limited
+
+
+def _scope(request):
+    # Область ограничения для запроса или None, если маршрут не ограничен
+    try:
+        match = resolve(request.path_info, getattr(request, 'urlconf', None))
+    except Resolver404:
+        return None
+    scope, counts = ROUTES.get(match.url_name, (None, None))
+    if scope is None or not counts(request):
+        return None
+    return scope
+
+
+def check(request):
+    # None или ответ take() для запроса к ограничиваемому маршруту
+    scope = _scope(request)
+    if scope is None:
+        return None
+    limited = take(scope, client_keys(request))
+    metrics.observe(scope, limited[0] if limited else None)
+    return limited
+
+
+async def acheck(request):
+    scope = _scope(request)
+    if scope is None:
+        return None
+    limited = await atake(scope, client_keys(request))
+    metrics.observe(scope, limited[0] if limited else None)
+    return limited
+
+
+def submission_key(data):
+    # Одинаковые сообщения формы контактов: повторная отправка, двойной клик, бот
+    fields = [str(data.get(name, '')).strip().lower() for name in ('email', 'subject', 'name')]
+    fields.append(' '.join(str(data.get('message', '')).split()))
+    return 'main:contact:' + hashlib.sha256('\0'.join(fields).encode('utf-8')).hexdigest()
+
+
+def first_submission(key):
+    # False, если такое же сообщение уже принято за CONTACT_DUPLICATE_SECONDS
+    if cache.add(key, 1, settings.CONTACT_DUPLICATE_SECONDS):
+        return True
+    metrics.duplicate()
+    return False
+
+
+class ThrottleMetrics:
+    # Счетчики для /metrics/, как main.instrumentation.Metrics
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checked = Counter()
+        self.limited = Counter()
+        self.duplicates = 0
+
+    def observe(self, scope, limited_by):
+        with self._lock:
+            self.checked[scope] += 1
+            if limited_by:
+                self.limited[(scope, limited_by)] += 1
+
+    def duplicate(self):
+        with self._lock:
+            self.duplicates += 1
+
+    def render(self):
+        with self._lock:
+            lines = [
+                '# HELP adyge_throttle_checked_total Запросы, прошедшие через ограничение частоты.',
+                '# TYPE adyge_throttle_checked_total counter',
+            ]
+            for scope, count in sorted(self.checked.items()):
+                lines.append(f'adyge_throttle_checked_total{{scope="{scope}"}} {count}')
+            lines += [
+                '# HELP adyge_throttle_limited_total Отклоненные запросы (429) по типу ключа.',
+                '# TYPE adyge_throttle_limited_total counter',
+            ]
+            for (scope, kind), count in sorted(self.limited.items()):
+                lines.append(f'adyge_throttle_limited_total{{scope="{scope}",key="{kind}"}} {count}')
+            lines += [
+                '# HELP adyge_contact_duplicates_total Повторные одинаковые сообщения формы контактов.',
+                '# TYPE adyge_contact_duplicates_total counter',
+                f'adyge_contact_duplicates_total {self.duplicates}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = ThrottleMetrics()
@@ -1,14 +1,49 @@
+from django.conf import settings
 from django.urls import path
-from . import views
-
-urlpatterns = [
-    path('', views.index, name='index'),
-    path('catalog/', views.catalog, name='catalog'),
-    path('catalog/<slug:slug>/', views.book_detail, name='book_detail'),
-    path('authors/', views.authors, name='authors'),
-    path('authors/<slug:slug>/', views.author_detail, name='author_detail'),
-    path('about/', views.about, name='about'),
-    path('contacts/', views.contacts, name='contacts'),
-    path('news/', views.news, name='news'),
-    path('news/<slug:slug>/', views.news_detail, name='news_detail'),
-]
\ No newline at end of file
+from . import async_views, conditional, views
+from .cache import cache_page_versioned
+from .feeds import AtomNewsFeed, NewsFeed
+from .conditional import http_cache
+
+# Политики HTTP-кеширования по маршрутам: max_age - для браузера,
+# s_maxage - для CDN и nginx. Страницы с валидаторами (main/conditional.py)
+# после истечения max_age проверяются запросом с If-None-Match и получают 304.
+LISTING = {'public': True, 'max_age': 60, 's_maxage': 300}
+DETAIL = {'public': True, 'max_age': 300, 's_maxage': 3600}
+STATIC = {'public': True, 'max_age': 3600, 's_maxage': 86400}
+# Главная выдает CSRF-токен формы, контакты - сообщения пользователю
+PRIVATE = {'private': True, 'no_cache': True}
+
+# Ленты новостей и robots.txt одинаковы под WSGI и ASGI
+SHARED_PATTERNS = [
+    path('feed/rss/', http_cache(cache_page_versioned(NewsFeed()), conditional.feed, **LISTING), name='news_feed'),
+    path('feed/atom/', http_cache(cache_page_versioned(AtomNewsFeed()), conditional.feed, **LISTING),
+         name='news_feed_atom'),
+    path('robots.txt', http_cache(views.robots_txt, conditional.static, **STATIC), name='robots_txt'),
+]
+
+# Под ASGI (ASYNC_VIEWS=True) те же адреса обслуживают асинхронные версии
+# представлений, см. main/async_views.py
+def site_patterns(views):
+    return [
+        path('', http_cache(views.index, conditional.index, **PRIVATE), name='index'),
+        path('catalog/', http_cache(views.catalog, conditional.catalog, **LISTING), name='catalog'),
+        path('api/catalog/', http_cache(views.catalog_page, conditional.catalog, **LISTING), name='catalog_page'),
+        path('catalog/<slug:slug>/', http_cache(views.book_detail, conditional.book_detail, **DETAIL),
+             name='book_detail'),
+        path('authors/', http_cache(views.authors, conditional.authors, **LISTING), name='authors'),
+        path('authors/<slug:slug>/', http_cache(views.author_detail, conditional.author_detail, **DETAIL),
+             name='author_detail'),
+        path('about/', http_cache(views.about, conditional.static, **STATIC), name='about'),
+        path('contacts/', http_cache(views.contacts, **PRIVATE), name='contacts'),
+        path('news/', http_cache(views.news, conditional.news, **LISTING), name='news'),
+        # Без валидаторов: каждый показ новости учитывается в счетчике просмотров
+        path('news/<slug:slug>/', http_cache(views.news_detail, private=True, no_cache=True), name='news_detail'),
+        path('search/', http_cache(views.search, public=True, max_age=60), name='search'),
+        # Карта сайта по частям, см. main/sitemaps.py
+        path('sitemap.xml', http_cache(views.sitemap_index, conditional.sitemap_index, **LISTING), name='sitemap'),
+        path('sitemap-<slug:section>-<int:shard>.xml',
+             http_cache(views.sitemap_section, conditional.sitemap_section, **DETAIL), name='sitemap_section'),
+    ] + SHARED_PATTERNS
+
+urlpatterns = site_patterns(async_views if settings.ASYNC_VIEWS else views)
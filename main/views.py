@@ -1,14 +1,28 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Book, Author, News, Category, AuthorCategory, ContactMessage
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from .models import Book, Author, News, Category, AuthorCategory, CatalogEntry, ContactMessage
+from . import sitemaps
 from django.contrib import messages
-from django.core.mail import send_mail
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from django.db import transaction
+from .cache import cache_page_versioned
+from .counters import news_views, views_stamp
+from .facets import apply_filters, facet_context, parse_filters
 from .forms import ContactForm
+from .instrumentation import metrics as request_metrics
+from .outbox import enqueue_contact_notification
+from .pagination import CATALOG_ORDERINGS, keyset_page
+from .search import MIN_QUERY_LENGTH, filter_books, search_authors, search_books, search_news
+from .throttle import client_address, first_submission, metrics as throttle_metrics, submission_key
 
 def index(request):
-    books = Book.objects.filter(is_available=True).order_by('-publication_date')[:8]
-    authors = Author.objects.filter(is_popular=True)[:6]
-    latest_news = News.objects.filter(is_published=True).order_by('-publish_date')[:3]
+    books = CatalogEntry.objects.order_by('-publication_date', '-pk')[:8]
+    authors = Author.objects.popular().order_by('name')[:6]
+    latest_news = News.objects.published().order_by('-publish_date')[:3]
     
     context = {
         'books': books,
@@ -17,50 +31,70 @@ def index(request):
     }
     return render(request, 'main/index.html', context)
 
-def catalog(request):
-    books = Book.objects.filter(is_available=True)
-    categories = Category.objects.all()
-    
-    # Фильтрация по категории
-    category_slug = request.GET.get('category')
-    if category_slug:
-        books = books.filter(categories__slug=category_slug)
+def _catalog_entries(search_query):
+    # Карточки читаются из плоской таблицы CatalogEntry, без JOIN
+    books = CatalogEntry.objects.all()
+    if len(search_query) >= MIN_QUERY_LENGTH:
+        books = books.filter(pk__in=filter_books(Book.objects.all(), search_query).values('pk'))
+    return books
+
+def _catalog_books(request):
+    search_query = request.GET.get('search', '').strip()
     
-    # Поиск
-    search_query = request.GET.get('search')
-    if search_query:
-        books = books.filter(title__icontains=search_query)
+    # Фильтры по категориям, авторам, годам и отметкам, см. main/facets.py
+    filters = parse_filters(request.GET)
+    books = apply_filters(_catalog_entries(search_query), filters)
     
     # Сортировка
     sort_by = request.GET.get('sort', 'new')
-    if sort_by == 'popular':
-        books = books.filter(is_bestseller=True)
-    elif sort_by == 'title':
-        books = books.order_by('title')
+    if sort_by not in CATALOG_ORDERINGS:
+        sort_by = 'new'
     
-    context = {
+    # Порядок задается ключом пагинации, поэтому здесь order_by не нужен
+    books, next_cursor = keyset_page(
+        books, CATALOG_ORDERINGS[sort_by], request.GET.get('cursor')
+    )
+    
+    next_query = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['cursor'] = next_cursor
+        next_query = params.urlencode()
+    
+    return {
         'books': books,
-        'categories': categories,
-        'current_category': category_slug,
+        'filters': filters,
         'search_query': search_query,
         'sort_by': sort_by,
+        'next_cursor': next_cursor,
+        'next_query': next_query,
     }
+
+def _catalog_facets(request):
+    # Счетчики боковой панели одним запросом, см. main.facets.facet_counts
+    entries = _catalog_entries(request.GET.get('search', '').strip())
+    return facet_context(entries, parse_filters(request.GET), Category.objects.order_by('name'))
+
+@cache_page_versioned
+def catalog(request):
+    context = _catalog_books(request)
+    context['facets'] = _catalog_facets(request)
     return render(request, 'main/catalog.html', context)
 
-def book_detail(request, slug):
-    book = get_object_or_404(Book, slug=slug, is_available=True)
-    related_books = Book.objects.filter(
-        categories__in=book.categories.all()
-    ).exclude(id=book.id).distinct()[:4]
-    
-    context = {
-        'book': book,
-        'related_books': related_books,
-    }
-    return render(request, 'main/book_detail.html', context)
+@cache_page_versioned
+def catalog_page(request):
+    # Следующая порция каталога для бесконечной прокрутки
+    context = _catalog_books(request)
+    html = render_to_string('main/includes/catalog_books.html', context, request=request)
+    return JsonResponse({
+        'html': html,
+        'next_cursor': context['next_cursor'],
+        'next_query': context['next_query'],
+    })
 
+@cache_page_versioned
 def authors(request):
-    authors = Author.objects.all().order_by('name')
+    authors = Author.objects.for_cards().order_by('name')
     
     category_slug = request.GET.get('category')
     if category_slug:
@@ -68,7 +102,7 @@ def authors(request):
     
     popular_only = request.GET.get('popular')
     if popular_only:
-        authors = authors.filter(is_popular=True)
+        authors = authors.popular()
     author_categories = AuthorCategory.objects.all()
     
     context = {
@@ -79,24 +113,14 @@ def authors(request):
     }
     return render(request, 'main/authors.html', context)
 
-def author_detail(request, slug):
-    author = get_object_or_404(Author, slug=slug)
-    books = Book.objects.filter(author=author, is_available=True)
-    
-    context = {
-        'author': author,
-        'books': books,
-    }
-    return render(request, 'main/author_detail.html', context)
-
+@cache_page_versioned
 def about(request):
     return render(request, 'main/about.html')
 
-def contacts(request):
-    return render(request, 'main/contacts.html')
-
+# Список показывает просмотры, см. main.counters.views_stamp
+@cache_page_versioned(stamp=views_stamp)
 def news(request):
-    news_list = News.objects.filter(is_published=True).order_by('-publish_date')
+    news_list = News.objects.published().order_by('-publish_date')
     
     category = request.GET.get('category')
     if category:
@@ -108,28 +132,38 @@ def news(request):
     }
     return render(request, 'main/news.html', context)
 
-def news_detail(request, slug):
-    news_item = get_object_or_404(News, slug=slug, is_published=True)
-    news_item.views_count += 1
-    news_item.save()
+def search(request):
+    query = request.GET.get('q', '').strip()
+    books, authors, news_list = [], [], []
+    
+    # Короткие запросы не ищем: они совпадают почти со всем
+    if len(query) >= MIN_QUERY_LENGTH:
+        books = search_books(Book.objects.available().for_cards(), query, 12)
+        authors = search_authors(Author.objects.all(), query, 6)
+        news_list = search_news(News.objects.published(), query, 6)
     
-    related_news = News.objects.filter(
-        category=news_item.category,
-        is_published=True
-    ).exclude(id=news_item.id).order_by('-publish_date')[:3]
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'books': [{'title': book.title, 'author': book.author.name,
+                       'url': reverse('book_detail', args=[book.slug])} for book in books],
+            'authors': [{'name': author.name,
+                         'url': reverse('author_detail', args=[author.slug])} for author in authors],
+            'news': [{'title': item.title,
+                      'url': reverse('news_detail', args=[item.slug])} for item in news_list],
+        })
     
     context = {
-        'news_item': news_item,
-        'related_news': related_news,
+        'query': query,
+        'books': books,
+        'authors': authors,
+        'news_list': news_list,
     }
-    return render(request, 'main/news_detail.html', context)
+    return render(request, 'main/search.html', context)
 
+@cache_page_versioned
 def book_detail(request, slug):
-    book = get_object_or_404(Book, slug=slug, is_available=True)
-    related_books = Book.objects.filter(
-        categories__in=book.categories.all(),
-        is_available=True
-    ).exclude(id=book.id).distinct()[:4]
+    book = get_object_or_404(Book.objects.available().for_detail(), slug=slug)
+    related_books = Book.objects.recommended_for(book)
     
     context = {
         'book': book,
@@ -137,9 +171,10 @@ def book_detail(request, slug):
     }
     return render(request, 'main/book_detail.html', context)
 
+@cache_page_versioned
 def author_detail(request, slug):
-    author = get_object_or_404(Author, slug=slug)
-    books = Book.objects.filter(author=author, is_available=True)
+    author = get_object_or_404(Author.objects.with_book_count(), slug=slug)
+    books = CatalogEntry.objects.filter(author=author)
     
     context = {
         'author': author,
@@ -148,14 +183,14 @@ def author_detail(request, slug):
     return render(request, 'main/author_detail.html', context)
 
 def news_detail(request, slug):
-    news_item = get_object_or_404(News, slug=slug, is_published=True)
-    news_item.views_count += 1
-    news_item.save()
+    news_item = get_object_or_404(News.objects.published(), slug=slug)
+    # На странице показываем счетчик с учетом текущего просмотра.
+    # Статическая выгрузка (main/static_export.py) просмотром не считается.
+    if not getattr(request, 'static_export', False):
+        news_item.views_count = news_views.live_count(news_item) + 1
+        news_views.record(news_item.pk)
     
-    related_news = News.objects.filter(
-        category=news_item.category,
-        is_published=True
-    ).exclude(id=news_item.id).order_by('-publish_date')[:3]
+    related_news = news_item.get_related_news()
     
     context = {
         'news_item': news_item,
@@ -163,34 +198,53 @@ def news_detail(request, slug):
     }
     return render(request, 'main/news_detail.html', context)
 
+@cache_page_versioned
+def sitemap_index(request):
+    return HttpResponse(sitemaps.index_xml(sitemaps.base_url(request)), content_type=sitemaps.CONTENT_TYPE)
+
+def sitemap_section(request, section, shard):
+    base = sitemaps.base_url(request)
+    if section == 'pages' and shard == 0:
+        return HttpResponse(sitemaps.pages_xml(base), content_type=sitemaps.CONTENT_TYPE)
+    if section not in sitemaps.SECTIONS:
+        raise Http404
+    key = sitemaps.shard_cache_key(base, section, shard)
+    body = cache.get(key)
+    if body is not None:
+        return HttpResponse(body, content_type=sitemaps.CONTENT_TYPE)
+    if not sitemaps.shard_exists(section, shard):
+        raise Http404
+    rows = sitemaps.bound_rows(section, shard).iterator(chunk_size=sitemaps.CHUNK_SIZE)
+    return StreamingHttpResponse(
+        sitemaps.cached_stream(key, sitemaps.shard_xml(base, section, rows)), content_type=sitemaps.CONTENT_TYPE,
+    )
+
+def robots_txt(request):
+    return render(request, 'robots.txt', {'base_url': sitemaps.base_url(request)}, content_type='text/plain; charset=utf-8')
+
+def save_contact_message(form):
+    # Сообщение и письмо-уведомление сохраняются вместе, а само письмо
+    # отправляет воркер (manage.py send_outbox), не задерживая ответ.
+    # Повтор того же сообщения не сохраняется, а отправитель видит
+    # обычный ответ об успехе.
+    key = submission_key(form.cleaned_data)
+    if not first_submission(key):
+        return None
+    try:
+        with transaction.atomic():
+            contact_message = form.save()
+            enqueue_contact_notification(contact_message)
+    except Exception:
+        # Иначе повторная отправка после ошибки сочлась бы дублем
+        cache.delete(key)
+        raise
+    return contact_message
+
 def contacts(request):
     if request.method == 'POST':
         form = ContactForm(request.POST)
         if form.is_valid():
-            # Сохраняем сообщение в базу данных
-            contact_message = form.save()
-            
-            # Отправляем email уведомление
-            try:
-                send_mail(
-                    subject=f'Новое сообщение: {contact_message.get_subject_display()}',
-                    message=f'''
-Имя: {contact_message.name}
-Email: {contact_message.email}
-Телефон: {contact_message.phone or "Не указан"}
-Тема: {contact_message.get_subject_display()}
-Сообщение:
-{contact_message.message}
-                    
-Дата: {contact_message.created_at.strftime("%d.%m.%Y %H:%M")}
-                    ''',
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[settings.CONTACT_EMAIL],
-                    fail_silently=False,
-                )
-            except Exception as e:
-                # Логируем ошибку отправки email, но не прерываем выполнение
-                print(f"Ошибка отправки email: {e}")
+            save_contact_message(form)
             
             # Показываем сообщение об успехе
             messages.success(request, 'Ваше сообщение успешно отправлено! Мы свяжемся с вами в ближайшее время.')
@@ -198,4 +252,19 @@ Email: {contact_message.email}
     else:
         form = ContactForm()
     
-    return render(request, 'main/contacts.html', {'form': form})
\ No newline at end of file
+    return render(request, 'main/contacts.html', {'form': form})
+
+def _metrics_allowed(request):
+    if settings.METRICS_TOKEN:
+        return constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}')
+    # Запрос через прокси, не указанный в THROTTLE_PROXY_COUNT, пришел бы
+    # с адреса самого прокси - 127.0.0.1 - и открыл бы метрики всем
+    if not settings.THROTTLE_PROXY_COUNT and 'HTTP_X_FORWARDED_FOR' in request.META:
+        return False
+    return client_address(request) in settings.METRICS_ALLOWED_IPS
+
+def metrics(request):
+    # Метрики для Prometheus: по токену или только с разрешенных адресов
+    if not _metrics_allowed(request):
+        raise Http404
+    return HttpResponse(request_metrics.render() + throttle_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateSyntaxError, engines
+from django.test import Client
+from django.urls import reverse
+
+from .conditional import templates_state
+
+logger = logging.getLogger(__name__)
+
+# Прогрев процесса до первого запроса. Без него каждый рабочий процесс
+# после выкладки компилирует шаблоны и импортирует представления на первых
+# посетителях. С gunicorn --preload прогрев выполняется один раз в главном
+# процессе, а рабочие получают готовые шаблоны после fork.
+
+
+def template_names():
+    names = []
+    for directory in settings.TEMPLATES[0]['DIRS']:
+        root = Path(directory)
+        names += sorted(path.relative_to(root).as_posix() for path in root.rglob('*.html'))
+    return names
+
+
+def compile_templates():
+    # Через загрузчик движка: cached.Loader оставляет скомпилированные
+    # шаблоны в памяти процесса
+    engine = engines['django']
+    compiled = 0
+    for name in template_names():
+        try:
+            engine.get_template(name)
+        except TemplateSyntaxError:
+            logger.exception('Шаблон %s не компилируется', name)
+        else:
+            compiled += 1
+    return compiled
+
+
+def prime_pages(paths):
+    # Полный путь запроса: промежуточные слои, представление, кеш страниц
+    host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.')
+    client = Client(HTTP_HOST='localhost' if host == '*' else host)
+    return {path: client.get(path).status_code for path in paths}
+
+
+def _warmup():
+    started = time.perf_counter()
+    try:
+        # Импорт маршрутов и всех модулей представлений
+        reverse('index')
+        templates = compile_templates()
+        # Подпись шаблонов для ETag и контекстные процессоры тоже
+        # вычисляются лениво, на первом запросе
+        templates_state()
+        engines['django'].engine.template_context_processors
+        pages = prime_pages(settings.WARMUP_PAGES)
+    except Exception:
+        logger.exception('Прогрев не удался')
+        return None
+    finally:
+        # Соединения и пулы, открытые до fork, не должны достаться
+        # рабочим процессам
+        connections.close_all()
+        for connection in connections.all(initialized_only=True):
+            if getattr(connection, 'pool', None) is not None:
+                connection.close_pool()
+    seconds = time.perf_counter() - started
+    logger.info('Прогрев: шаблонов %s, страниц %s за %.0f мс', templates, len(pages), seconds * 1000)
+    return {'templates': templates, 'pages': pages, 'seconds': seconds}
+
+
+def warmup():
+    if not settings.TEMPLATE_WARMUP:
+        return None
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return _warmup()
+    # uvicorn импортирует приложение уже внутри цикла событий, где
+    # синхронные запросы к базе запрещены: прогреваем в отдельном потоке
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(_warmup).result()
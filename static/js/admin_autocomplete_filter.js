@@ -0,0 +1,20 @@
+// Фильтры списков в админке с автодополнением (main/admin_filters.py):
+// выбор значения подставляет его в адрес страницы
+'use strict';
+{
+    const $ = django.jQuery;
+
+    $(function() {
+        $('.autocomplete-filter select').on('change', function() {
+            const params = new URLSearchParams(window.location.search);
+            params.delete('p');
+            params.delete(this.name.replace(/__[^_]+__exact$/, '__isnull'));
+            if (this.value) {
+                params.set(this.name, this.value);
+            } else {
+                params.delete(this.name);
+            }
+            window.location.search = params.toString();
+        });
+    });
+}